@@ -1,643 +1,371 @@
-from flask import Flask, render_template, request, session, redirect, url_for, send_file, abort
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Flask, before_render_template, template_rendered, render_template, request, session, redirect, url_for, abort, jsonify, make_response, g, get_template_attribute, send_from_directory, stream_template
+from markupsafe import Markup
+import cProfile
 import datetime
-import os
+import hashlib
+import hmac
 import json
-import csv
-from io import BytesIO
+import mimetypes
+import os
+import pstats
+import random
+import threading
+import time
+from collections import deque
+from io import BytesIO, StringIO
+
+import assets
+from catalog import CatalogLoader
+import compression
+from cache import LRUCache
+import charts
+from charts import ChartCache, MIMETYPES as CHART_MIMETYPES
+from favorites import FavoriteIndex
+from persistence import WriteBehind, BackgroundWriter
+from instrumentation import RouteTimings
+import metrics
+from profiling import ProfileStore, StackSampler
+from passwords import PasswordHasher, HasherBusy, LoginThrottle
+import counter_log
+from storage import open_storage
+from shared_counters import SharedCounters, CounterTableFull
+import search_stats
+from search_stats import SearchHistory
 
-# 加点要素：追加モジュール（環境に無い場合でも動作するように try/except）
-try:
-    import pandas as pd
-except Exception:
-    pd = None
+app = Flask(__name__)
+# session を使うために secret_key を設定
+app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'change_me_secret_key')
 
-try:
-    import matplotlib
-    matplotlib.use("Agg")
-    import matplotlib.pyplot as plt
-    from matplotlib import font_manager as _fm
-
-    def _configure_matplotlib_japanese():
-        """日本語の文字化け（豆腐）を避けるためのフォント設定。
-        - プロジェクト内の static/fonts 配下に日本語フォント(ttf/otf)があれば優先利用
-        - 無ければOSに入っている可能性が高い日本語フォント名を順に試す
-        """
-        # 1) 同梱フォント（任意）を優先
-        local_candidates = [
-            os.path.join(app.root_path, "static", "fonts", "ipaexg.ttf"),
-            os.path.join(app.root_path, "static", "fonts", "ipag.ttf"),
-            os.path.join(app.root_path, "static", "fonts", "NotoSansJP-Regular.otf"),
-            os.path.join(app.root_path, "static", "fonts", "NotoSansCJKjp-Regular.otf"),
-        ]
-        for fp in local_candidates:
-            if os.path.exists(fp):
-                try:
-                    _fm.fontManager.addfont(fp)
-                    prop = _fm.FontProperties(fname=fp)
-                    matplotlib.rcParams["font.family"] = prop.get_name()
-                    matplotlib.rcParams["axes.unicode_minus"] = False
-                    return True
-                except Exception:
-                    pass
-
-        # 2) システムフォント名（環境差があるので複数候補）
-        name_candidates = [
-            "IPAexGothic",
-            "IPAGothic",
-            "Noto Sans CJK JP",
-            "Noto Sans JP",
-            "TakaoGothic",
-            "Yu Gothic",
-            "Meiryo",
-            "Hiragino Sans",
-            "MS Gothic",
-        ]
-        for name in name_candidates:
-            try:
-                _fm.findfont(name, fallback_to_default=False)
-                matplotlib.rcParams["font.family"] = name
-                matplotlib.rcParams["axes.unicode_minus"] = False
-                return True
-            except Exception:
-                continue
+# ---- 種データ（出典は各種の sources を参照） ----
+# 原本は data/species.json。編集すると再起動なしで読み直される（catalog.py 参照）
+CATALOG_LOADER = CatalogLoader()
+CATALOG = CATALOG_LOADER.load()
 
-        matplotlib.rcParams["axes.unicode_minus"] = False
-        return False
+# 検索結果のキャッシュ（検索語の偏りが大きいので少数でもよく当たる）
+SEARCH_CACHE = LRUCache(maxsize=512)
+# 誰が見ても同じ部分（種の詳細本文・収録一覧の表）の描画済み HTML
+FRAGMENT_CACHE = LRUCache(maxsize=256)
 
-    # 追加モジュール（任意）：入っていれば一発で日本語フォントを設定してくれる
-    try:
-        import japanize_matplotlib  # noqa: F401
-        matplotlib.rcParams["axes.unicode_minus"] = False
-    except Exception:
-        pass
 
-except Exception:
-    plt = None
+@app.before_request
+def reload_catalog_if_changed():
+    """カタログの原本が変わっていれば、索引ごと新しい版に差し替える"""
+    global CATALOG
+    new = CATALOG_LOADER.reload_if_changed(CATALOG)
+    if new is not None:
+        CATALOG = new
 
 
-app = Flask(__name__)
-# session を使うために secret_key を設定
-app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'change_me_secret_key')
+# ---- 静的ファイル（内容ハッシュ付きの名前・事前圧縮、assets.py 参照） ----
+ASSET_MANIFEST = None
+ASSET_FILES = {}  # ハッシュ付きの名前 -> 対応表のエントリ
+# 開発時（debug）は CSS・JS の編集がすぐ反映されるよう、この間隔で原本の変更を確かめる
+ASSET_CHECK_INTERVAL = 2.0
+_asset_next_check = 0.0
 
-# ---- 種データ（出典は各種の sources を参照） ----
-SPECIES = [
-    {
-        'id': 'delphinapterus_leucas',
-        'jp': 'シロイルカ',
-        'en': 'Beluga whale',
-        'sci': 'Delphinapterus leucas',
-        'family': 'イッカク科（Monodontidae）',
-        'length': '最大16 ft（約4.9 m）',
-        'weight': '平均3,150 lb（約1,430 kg）',
-        'lifespan': '最大90年',
-        'distribution': '北半球の北極海と周辺海域に分布し、アラスカの多くの海域のほか、ロシア、カナダ、グリーンランドにも見られる。\n夏は浅い沿岸の浅瀬に多いが、季節によってはより深い海域にも移動し、最大で水深1,000 mまで潜水し、最長25分の潜水が報告されている。\n河口域や大きな河川デルタにも季節的に入り、魚の遡上（魚群）を利用して採餌する。',
-        'ecology': '「海のカナリア」とも呼ばれ、口笛・鳴き声・クリックなど多様な音を出す。聴覚とエコーロケーション（反響定位）で移動・採餌を行う。\n食性は多様で、タコ・イカ・カニ・エビ・二枚貝・巻貝・ゴカイ類などの無脊椎動物に加え、サケ、ユースタキオン（eulachon）、タラ、ニシン、ワカサギ類、カレイ類などの魚類も食べる。\n交尾は主に晩冬〜春とされ、雌は6〜14歳頃、雄はそれよりやや遅く性成熟する。妊娠期間は約15か月で、仔は少なくとも2年間授乳する。出産は一般に夏（新生仔の保温に有利な比較的温暖な海域）に多く、出産間隔は2〜3年とされる。',
-        'sources': [
-            {
-                'title': 'NOAA Fisheries: Beluga Whale',
-                'url': 'https://www.fisheries.noaa.gov/species/beluga-whale'
-            }
-        ]
-    },
-    {
-        'id': 'monodon_monoceros',
-        'jp': 'イッカク',
-        'en': 'Narwhal',
-        'sci': 'Monodon monoceros',
-        'family': 'イッカク科（Monodontidae）',
-        'length': '13–18 ft（約4.0–5.5 m）',
-        'weight': '1,760–3,530 lb（約800–1,600 kg）',
-        'lifespan': '最大50年',
-        'distribution': '北極海およびその周辺海域（大西洋側の北極域）に分布する。',
-        'ecology': '主な餌はグリーンランドオヒョウ（Greenland halibut）やホッキョクダラ（Arctic cod）で、イカやエビも食べるとされる。\n最大で3,937 ft（約1,200 m）まで潜水し、最長25分程度の潜水が報告されている。\n妊娠期間は13〜16か月とされ、通常1頭の仔を出産する。',
-        'sources': [
-            {
-                'title': 'NOAA Fisheries: Narwhal',
-                'url': 'https://www.fisheries.noaa.gov/species/narwhal'
-            }
-        ]
-    },
-    {
-        'id': 'orcinus_orca',
-        'jp': 'シャチ',
-        'en': 'Killer whale (Orca)',
-        'sci': 'Orcinus orca',
-        'family': 'マイルカ科（Delphinidae）',
-        'length': '23–32 ft（約7.0–9.8 m）',
-        'weight': '8,000–12,000 lb（約3,600–5,400 kg）',
-        'lifespan': '雄：平均約30年（最大で少なくとも60年）／雌：平均約50年（最大で少なくとも90年）',
-        'distribution': '全ての海に分布する。南極・ノルウェー・アラスカなどの寒冷海域で個体数が多い一方、熱帯・亜熱帯にも見られる。\n北東太平洋では、定住型（Resident）はカリフォルニアからロシアまで観察され、沖合型（Offshore）は沖合9マイル（約14 km）以遠にも多いとされる。',
-        'ecology': '高い社会性をもち、母系血縁を基盤とする「ポッド（pod）」と呼ばれる社会集団で生活する。\n水中音を利用して採餌・コミュニケーション・航行を行い、クリック・ホイッスル・パルス音などを用いる。北東太平洋の各ポッドは学習により共有される固有のコール（鳴音セット）をもつ。\n食性は生息海域の餌資源だけでなく、生態型（ecotype）ごとに学習された採餌文化に強く依存する。例えば米国太平洋岸北西部では、魚食（主にサケ）に特化する集団と、海棲哺乳類やイカを主に食べる集団が知られる。\n雌は10〜13歳で性成熟し、妊娠期間は15〜18か月、通常1頭の仔を出産する。仔は少なくとも1年間は母乳栄養のみで、その後も母親と密接に行動する期間が続く。出産季節は明確ではなく、出生は通年で起こりうる。',
-        'sources': [
-            {
-                'title': 'NOAA Fisheries: Killer Whale',
-                'url': 'https://www.fisheries.noaa.gov/species/killer-whale'
-            }
-        ]
-    },
-    {
-        'id': 'tursiops_truncatus',
-        'jp': 'ハンドウイルカ',
-        'en': 'Common bottlenose dolphin',
-        'sci': 'Tursiops truncatus',
-        'family': 'マイルカ科（Delphinidae）',
-        'length': '6–13 ft（約1.8–4.0 m）',
-        'weight': '300–1,400 lb（約140–640 kg）',
-        'lifespan': '',
-        'distribution': '世界の温帯〜熱帯域に広く分布する。\n港湾・湾・内海・河口域などの沿岸環境に加え、大陸棚上のやや深い海域、さらに外洋の沖合まで、多様な環境で確認されている。',
-        'ecology': '単独または群れで行動し、群れは分裂・再編を繰り返す（いわゆるフィッション・フュージョン型）。\n魚類・イカ・甲殻類（カニやエビなど）など多様な餌を利用し、単独採餌だけでなく協調して魚群を追い込むなど複数の採餌戦略を用いる。\n高周波のエコーロケーション等を用いて獲物を探索し、歯で魚を把持して頭から丸呑みする。',
-        'sources': [
-            {
-                'title': 'NOAA Fisheries: Common Bottlenose Dolphin',
-                'url': 'https://www.fisheries.noaa.gov/species/common-bottlenose-dolphin'
-            }
-        ]
-    },
-    {
-        'id': 'phocoena_phocoena',
-        'jp': 'ネズミイルカ',
-        'en': 'Harbor porpoise',
-        'sci': 'Phocoena phocoena',
-        'family': 'ネズミイルカ科（Phocoenidae）',
-        'length': '5–5.5 ft（約1.5–1.7 m）',
-        'weight': '135–170 lb（約61–77 kg）',
-        'lifespan': '最大24年',
-        'distribution': '北半球の温帯北部〜亜寒帯・北極域の沿岸〜沖合に分布する。湾・河口・港・フィヨルドなど水深650 ft（約200 m）未満の海域でよく見られる。\n北大西洋では西グリーンランド〜米国ノースカロライナ州ケープハッテラス付近、またバレンツ海〜西アフリカにかけて分布し、北太平洋では日本〜チュクチ海、米国カリフォルニア州ポイント・コンセプション〜ボーフォート海まで分布するとされる。',
-        'ecology': '主にニシンやサバなどの群れを作る魚類を食べ、時にイカ・タコも食べる。\n単独・ペア・10頭程度の小群で見られることが多いが、最大200頭規模の集合例も報告される。季節移動は沿岸—沖合方向の変化が中心で、餌資源や海氷条件の影響を受ける可能性がある。\n雌は3〜4歳で性成熟し、妊娠期間は10〜11か月、授乳は8〜12か月とされる。出産は主に5〜7月に多い。',
-        'sources': [
-            {
-                'title': 'NOAA Fisheries: Harbor Porpoise',
-                'url': 'https://www.fisheries.noaa.gov/species/harbor-porpoise'
-            }
-        ]
-    },
-    {
-        'id': 'megaptera_novaeangliae',
-        'jp': 'ザトウクジラ',
-        'en': 'Humpback whale',
-        'sci': 'Megaptera novaeangliae',
-        'family': 'ナガスクジラ科（Balaenopteridae）',
-        'length': '最大60 ft（約18 m）',
-        'weight': '最大80,000 lb（約36 t）',
-        'lifespan': '推定約80〜90年',
-        'distribution': '世界の主要な海に広く分布する。季節移動で高緯度の夏季採餌海域と、熱帯域の交尾・出産海域を往復し、個体によっては約5,000マイル（約8,000 km）を移動する。\n北太平洋ではアラスカ〜ハワイ間（約3,000マイル）を最短28日で移動した例がある。出産期には浅く温暖な海域（リーフ周辺や沿岸）を好むとされる。',
-        'ecology': '採餌海域は一般に寒冷で生産性の高い海域とされる。\n性成熟は4〜10歳で、雌は平均して2〜3年に1回、1頭の仔を出産する。妊娠期間は約11か月で、出生仔の体長は約13〜16 ftとされる。仔は離乳まで最大1年程度、母親の近くで行動する。',
-        'sources': [
-            {
-                'title': 'NOAA Fisheries: Humpback Whale',
-                'url': 'https://www.fisheries.noaa.gov/species/humpback-whale'
-            }
-        ]
-    },
-    {
-        'id': 'balaenoptera_musculus',
-        'jp': 'シロナガスクジラ',
-        'en': 'Blue whale',
-        'sci': 'Balaenoptera musculus',
-        'family': 'ナガスクジラ科（Balaenopteridae）',
-        'length': '最大110 ft（約34 m）',
-        'weight': '最大330,000 lb（約150 t）',
-        'lifespan': '推定約80〜90年',
-        'distribution': '北極域を除くほぼ全ての海に分布する。\n一般に夏季は高緯度の採餌海域、冬季は繁殖海域へ季節移動するが、地域によっては移動しない個体群の可能性も示唆されている。分布と移動は餌（オキアミ等）の集中に強く影響される。\n北大西洋では亜熱帯〜グリーンランド海まで分布し、米国西海岸域では冬季にメキシコ〜中米沖、夏季に米国西海岸沖などでの採餌が示唆される。',
-        'ecology': '単独またはペアで見られることが多いが、小規模な群れになることもある。採餌・移動時の遊泳速度はおよそ時速5マイル程度だが、短時間で20マイル以上まで加速できるとされる。\n主食はオキアミで、場合により魚類やカイアシ類（小型甲殻類）も食べる。口を開けてオキアミ群へ突進し、喉のヒダを膨らませて大量の海水ごと取り込み、ヒゲ板で濾し取る濾過摂食を行う。\n低周波のパルス・うなり声など非常に大きな音を発し、条件によっては1,000マイル離れた個体にも届きうるとされ、コミュニケーション等に用いられる可能性が示されている。',
-        'sources': [
-            {
-                'title': 'NOAA Fisheries: Blue Whale',
-                'url': 'https://www.fisheries.noaa.gov/species/blue-whale'
-            }
-        ]
-    },
-    {
-        'id': 'balaenoptera_physalus',
-        'jp': 'ナガスクジラ',
-        'en': 'Fin whale',
-        'sci': 'Balaenoptera physalus',
-        'family': 'ナガスクジラ科（Balaenopteridae）',
-        'length': '最大80 ft（約24 m）',
-        'weight': '最大100,000 lb（約45 t）',
-        'lifespan': '',
-        'distribution': '全ての主要な海の外洋性の深い海域に広く分布し、主に温帯〜極域で多い（熱帯では比較的少ない）。\n夏は極域寄りの採餌海域、冬は熱帯域の繁殖・出産海域へ移動する傾向があるが、冬季繁殖海域の位置は不明とされる。',
-        'ecology': '高速で遊泳し、2〜7頭程度の群れで見られることが多い。北大西洋ではザトウクジラやミンククジラ等と混群で採餌する例もある。\n夏季はオキアミ、小型群泳魚（ニシン、カペリン、イカナゴ等）、イカ類を主に食べ、口を開けて獲物群へ突進し、喉のヒダで大量の海水ごと取り込み、ヒゲ板で濾し取る。\n冬季は移動期に入り、絶食するとされる。1日あたり最大2トンの餌を食べる例が記載されている。',
-        'sources': [
-            {
-                'title': 'NOAA Fisheries: Fin Whale',
-                'url': 'https://www.fisheries.noaa.gov/species/fin-whale'
-            }
-        ]
-    },
-    {
-        'id': 'balaenoptera_acutorostrata',
-        'jp': 'ミンククジラ',
-        'en': 'Minke whale',
-        'sci': 'Balaenoptera acutorostrata',
-        'family': 'ナガスクジラ科（Balaenopteridae）',
-        'length': '最大35 ft（約11 m）',
-        'weight': '最大20,000 lb（約9 t）',
-        'lifespan': '',
-        'distribution': '温帯〜亜寒帯（冷温帯）を好むが、熱帯・亜熱帯にも見られ、世界中の多くの海域で確認される（広域分布）。\n沿岸・内海から外洋の沖合まで利用し、季節移動するが、地域によっては定住的な個体群もあるとされる。',
-        'ecology': '多くは単独または2〜3頭の小群で見られるが、極域寄りの採餌海域では最大400頭規模の疎な集合が観察された例がある。\n小魚群へ側方から突進して大量の海水ごと飲み込み、濾過摂食する。甲殻類・プランクトン・小型群泳魚（例：アンチョビー、タラ、ニシン、サケ、イカナゴ等）を機会的に利用する。\nクリック・グラントなど多様な音を発し、少なくとも15分の潜水が可能とされる。ブリーチングやスパイホッピングなど表層で活発な行動が見られる。',
-        'sources': [
-            {
-                'title': 'NOAA Fisheries: Minke Whale',
-                'url': 'https://www.fisheries.noaa.gov/species/minke-whale'
-            }
-        ]
-    },
-    {
-        'id': 'physeter_macrocephalus',
-        'jp': 'マッコウクジラ',
-        'en': 'Sperm whale',
-        'sci': 'Physeter macrocephalus',
-        'family': 'マッコウクジラ科（Physeteridae）',
-        'length': '雌：40 ft（約12 m）／雄：52 ft（約16 m）',
-        'weight': '雌：15トン／雄：45トン',
-        'lifespan': '最大60年',
-        'distribution': '世界の全ての海に分布する。分布は餌資源や繁殖に適した条件に依存し、群れの性・年齢構成によっても変化する。\nヒゲクジラ類ほど季節移動が予測しやすくはなく、成雄は温帯域まで長距離移動する一方、雌と若齢個体は熱帯域に周年分布する傾向が示されている。',
-        'ecology': '日常的に水深2,000 ft（約610 m）に達する深潜水で採餌し、潜水は最大45分程度継続する。深潜水後は数分間の浮上休息を挟んで次の潜水に移る。\n深海性のイカ類、サメ類、エイ類、魚類などを食べるとされる。摂餌量は1日あたり体重の約3〜3.5%と記載されている。\n雌は約9歳・体長約29 ftで性成熟し、以後は5〜7年に1回程度の頻度で出産するとされる。妊娠期間は14〜16か月で、出生仔は約13 ft。仔は1年未満で固形物も食べ始めるが、授乳は数年続く。\n雄は成長が長く続き、身体的成熟は約50歳・体長約52 ftとされる。',
-        'sources': [
-            {
-                'title': 'NOAA Fisheries: Sperm Whale',
-                'url': 'https://www.fisheries.noaa.gov/species/sperm-whale'
-            }
-        ]
-    },
-    {
-        'id': 'eubalaena_glacialis',
-        'jp': 'セミクジラ（北大西洋個体群）',
-        'en': 'North Atlantic right whale',
-        'sci': 'Eubalaena glacialis',
-        'family': 'セミクジラ科（Balaenidae）',
-        'length': '最大52 ft（約16 m）',
-        'weight': '',
-        'lifespan': '',
-        'distribution': '主に大西洋の大陸棚上の沿岸域に分布し、沖合の深海域まで移動することもある。\n季節移動を行い、春〜秋は米国ニューイングランド沖〜カナダ沿岸域で採餌・交尾し、秋以降に1,000マイル以上移動してサウスカロライナ〜ジョージア〜フロリダ北東部沖の浅い沿岸域（出産海域）へ向かう個体がいる（ただし移動パターンは変動する）。',
-        'ecology': '水面でブリーチングするほか、口吻を水面上に出しながら高密度のプランクトンを「スキム・フィーディング（掬い取り型の濾過摂食）」で食べる行動が見られる。\n主食はカイアシ類（copepods）などの動物プランクトンで、ゆっくり泳ぎながら口を開けて取り込み、ヒゲ板で濾し取る。採餌は表層から水柱下部まで行われうる。\n水面での活発な社会行動（SAG）が観察され、交尾や社会的相互作用が起こる。低周波のうなり声・うめき声などでコミュニケーションするとされる。',
-        'sources': [
-            {
-                'title': 'NOAA Fisheries: North Atlantic Right Whale',
-                'url': 'https://www.fisheries.noaa.gov/species/north-atlantic-right-whale'
-            }
-        ]
-    }
-,
-
-    {'id': 'lagenorhynchus_obliquidens',
-     'jp': 'カマイルカ',
-     'en': 'Pacific white-sided dolphin',
-     'sci': 'Lagenorhynchus obliquidens',
-     'family': 'マイルカ科（Delphinidae）',
-     'length': '約1.7–2.4 m（5.5–8 ft）',
-     'weight': '約136–181 kg（300–400 lb）',
-     'lifespan': '36–40年（出典：NOAA Fisheries）',
-     'distribution': '北太平洋の温帯域に分布し、外洋性（pelagic）。米国ではカリフォルニア～アラスカ沖で見られる。\n'
-                     '北米以外では、ベーリング海南部（アリューシャン列島周辺）、オホーツク海、日本海、黄海・東シナ海（日本の南方を含む）などが挙げられる。',
-     'ecology': '主にイカ類と小型の群泳魚（例：カペリン、イワシ類、ニシン類など）を食べる。\n潜水は6分以上続くことがあり、群れで魚群を追い込む行動が報告されている。成体は1日に約20 lbの餌を食べることがある。',
-     'sources': [{'title': 'NOAA Fisheries: Pacific White-Sided Dolphin',
-                  'url': 'https://www.fisheries.noaa.gov/species/pacific-white-sided-dolphin'}]},
-
-    {'id': 'phocoenoides_dalli',
-     'jp': 'イシイルカ',
-     'en': "Dall's porpoise",
-     'sci': 'Phocoenoides dalli',
-     'family': 'ネズミイルカ科（Phocoenidae）',
-     'length': '約2.1–2.4 m（7–8 ft）',
-     'weight': '約200 kg（440 lb）',
-     'lifespan': '15–20年（出典：NOAA Fisheries）',
-     'distribution': '北太平洋の沿岸～外洋に広く分布し、深い海域（一般に水深600 ft超）と冷温帯～亜寒帯の水温（約36–63°F）を好む。\n'
-                     '北緯30–62度の範囲で、アラスカ湾・ベーリング海・オホーツク海・日本海などに多い。米国ではバハ・カリフォルニア～ベーリング海、アジア側では日本中部～オホーツク海に分布するとされる。',
-     'ecology': '最大で水深1,640 ftまで潜水し、群泳する小魚、深海性の魚（例：ハダカイワシ類・シシャモ類など）、頭足類を主に食べ、甲殻類を食べることもある。\n'
-                '通常2–12頭程度の群れだが、時に数百～数千頭になる。カマイルカや短ヒレゴンドウクジラと混群を作ることがある。',
-     'sources': [{'title': "NOAA Fisheries: Dall's Porpoise",
-                  'url': 'https://www.fisheries.noaa.gov/species/dalls-porpoise'}]},
-
-    {'id': 'stenella_longirostris',
-     'jp': 'ハシナガイルカ',
-     'en': 'Spinner dolphin',
-     'sci': 'Stenella longirostris',
-     'family': 'マイルカ科（Delphinidae）',
-     'length': '約1.2–2.1 m（4–7 ft）',
-     'weight': '約59–77 kg（130–170 lb）',
-     'lifespan': '約20年（出典：NOAA Fisheries）',
-     'distribution': '熱帯～暖温帯の海域に世界的に分布し、いくつかの亜種が知られる。\n一部個体群では沿岸の湾内などを日中の休息場所として利用し、夜間に外洋で採餌する。',
-     'ecology': '夜間に深度650–1,000 ft付近で小魚・エビ類・イカ類などを捕食する。\n日中は4–5時間程度の休息行動をとり、休息中は主に視覚を用いる（エコーロケーションの使用は限定的とされる）。',
-     'sources': [{'title': 'NOAA Fisheries: Spinner Dolphin',
-                  'url': 'https://www.fisheries.noaa.gov/species/spinner-dolphin'}]},
-
-    {'id': 'delphinus_delphis',
-     'jp': 'マイルカ（短吻型）',
-     'en': 'Short-beaked common dolphin',
-     'sci': 'Delphinus delphis',
-     'family': 'マイルカ科（Delphinidae）',
-     'length': '約1.8 m（6 ft）',
-     'weight': '約77 kg（170 lb）',
-     'lifespan': '最大約40年（出典：NOAA Fisheries）',
-     'distribution': '亜熱帯～温帯の外洋性で、一般に大陸棚縁辺・大陸斜面の海域（約300–6,500 ft）を好む。\n海流（例：ガルフストリーム）や湧昇域・海嶺などの生産性が高い海域と結び付くことがある。',
-     'ecology': '数百頭規模の大きな群れを作り、時に約10,000頭の“メガポッド”になることがある。\n'
-                '昼間は休息し、夜間に餌（群泳魚や頭足類）を探す傾向がある。潜水は最大約1,000 ftだが、通常はより浅い（約100 ft程度）とされる。',
-     'sources': [{'title': 'NOAA Fisheries: Short-Beaked Common Dolphin',
-                  'url': 'https://www.fisheries.noaa.gov/species/short-beaked-common-dolphin'}]},
-
-    {'id': 'grampus_griseus',
-     'jp': 'ハナゴンドウ',
-     'en': "Risso's dolphin",
-     'sci': 'Grampus griseus',
-     'family': 'マイルカ科（Delphinidae）',
-     'length': '約2.6–4.0 m（8.5–13 ft）',
-     'weight': '約299–499 kg（660–1,100 lb）',
-     'lifespan': '少なくとも35年',
-     'distribution': '世界の温帯～熱帯の海域に広く分布する。\n'
-                     '一般に大陸棚縁辺・大陸斜面の外洋性深海域を好み、少なくとも水深1,000 ftまで潜水し、息止めは30分に達することがある。\n'
-                     '緯度64°N〜46°Sの範囲で報告があり、北半球では日本・ロシア・アラスカ湾などを含む。',
-     'ecology': '通常10〜30頭の群れで見られるが、単独・ペア、また数百〜数千頭の疎な集合も報告されている。\n他種（例：ハンドウイルカ、コククジラ、キタセミクジライルカ、カマイルカ）と同所的に見られることがある。',
-     'sources': [{'title': "NOAA Fisheries: Risso's Dolphin",
-                  'url': 'https://www.fisheries.noaa.gov/species/rissos-dolphin'}]},
-
-    {'id': 'pseudorca_crassidens',
-     'jp': 'ニセシャチ',
-     'en': 'False killer whale',
-     'sci': 'Pseudorca crassidens',
-     'family': 'マイルカ科（Delphinidae）',
-     'length': '約4.9 m（雌 16 ft）/ 約6.1 m（雄 20 ft）',
-     'weight': '約1361 kg（3,000 lb）',
-     'lifespan': '最大：雌63年／雄58年',
-     'distribution': '一般に外洋性の熱帯～亜熱帯で、水深3,300 ft超の深海域を好む。\n一方、ハワイ周辺の個体群では島に近い海域により強く関連する（島嶼の海洋環境が餌生物を集める可能性がある）。',
-     'ecology': '社会性が強く、強固な社会的結びつきをもつ。\n'
-                '少数個体のサブグループが、数十kmに広がる大きな集合の一部として行動することがあり、採餌の探索に役立つとされる。\n'
-                '獲物を捕らえると複数個体が集まり、獲物を分け合う行動が報告されている。ハワイでは40〜50頭規模の集合が見られることがある。',
-     'sources': [{'title': 'NOAA Fisheries: False Killer Whale',
-                  'url': 'https://www.fisheries.noaa.gov/species/false-killer-whale'}]},
-
-    {'id': 'globicephala_macrorhynchus',
-     'jp': 'ゴンドウクジラ（短ヒレ）',
-     'en': 'Short-finned pilot whale',
-     'sci': 'Globicephala macrorhynchus',
-     'family': 'マイルカ科（Delphinidae）',
-     'length': '約3.7–7.3 m（12–24 ft）',
-     'weight': '約998–2994 kg（2,200–6,600 lb）',
-     'lifespan': '35–60年',
-     'distribution': '熱帯～温帯の比較的温暖な海域を好み、沖合から沿岸近くまで見られるが、一般に深い海域を好む。\nイカ類の高密度域が主要な採餌場所になる。',
-     'ecology': '主にイカ類を食べるが、タコ類や魚類も捕食する。採餌は水深1,000 ft以上の中深層で行われることがある。\n'
-                '25〜50頭ほどの群れで見られることが多く、移動・採餌時には群れが横幅0.5マイル程度に広がることがある。\n'
-                '深く高速に潜って大型のイカを追うことがあり、深海の高速潜水者として知られる。',
-     'sources': [{'title': 'NOAA Fisheries: Short-Finned Pilot Whale',
-                  'url': 'https://www.fisheries.noaa.gov/species/short-finned-pilot-whale'}]},
-
-    {'id': 'stenella_coeruleoalba',
-     'jp': 'スジイルカ',
-     'en': 'Striped dolphin',
-     'sci': 'Stenella coeruleoalba',
-     'family': 'マイルカ科（Delphinidae）',
-     'length': '約2.4 m（雌 8 ft）/ 約2.7 m（雄 9 ft）',
-     'weight': '約150 kg（雌 330 lb）/ 約159 kg（雄 350 lb）',
-     'lifespan': '最大58年',
-     'distribution': '熱帯～暖温帯（約52–84°F）の外洋性で深い海域を好み、大陸棚の沖合（海側）に多い。\n'
-                     '北緯50度～南緯40度の範囲で報告が多く、湧昇域や収束帯と関連することがある。\n'
-                     '世界的に分布し、日本周辺でも報告がある。',
-     'ecology': '通常25〜100頭程度のまとまりのある群れで見られるが、数百〜数千頭の大群になることもある。\n群れ内には年齢・性・繁殖状態などに基づく複雑な個体関係があるとされ、他種の鯨類や海鳥と一緒に見られることは少ない。',
-     'sources': [{'title': 'NOAA Fisheries: Striped Dolphin',
-                  'url': 'https://www.fisheries.noaa.gov/species/striped-dolphin'}]},
-
-    {'id': 'balaena_mysticetus',
-     'jp': 'ホッキョククジラ',
-     'en': 'Bowhead whale',
-     'sci': 'Balaena mysticetus',
-     'family': 'セミクジラ科（Balaenidae）',
-     'length': '（準備中）',
-     'weight': '（準備中）',
-     'lifespan': '（準備中）',
-     'distribution': '（準備中：NOAA Fisheriesの種ページを根拠に追記予定）',
-     'ecology': '（準備中：NOAA Fisheriesの種ページを根拠に追記予定）',
-     'sources': [{'title': 'NOAA Fisheries: Bowhead Whale', 'url': 'https://www.fisheries.noaa.gov/species/bowhead-whale'}]},
-
-    {'id': 'balaenoptera_borealis',
-     'jp': 'イワシクジラ',
-     'en': 'Sei whale',
-     'sci': 'Balaenoptera borealis',
-     'family': 'ナガスクジラ科（Balaenopteridae）',
-     'length': '（準備中）',
-     'weight': '（準備中）',
-     'lifespan': '（準備中）',
-     'distribution': '（準備中：NOAA Fisheriesの種ページを根拠に追記予定）',
-     'ecology': '（準備中：NOAA Fisheriesの種ページを根拠に追記予定）',
-     'sources': [{'title': 'NOAA Fisheries: Sei Whale', 'url': 'https://www.fisheries.noaa.gov/species/sei-whale'}]},
-
-    {'id': 'eschrichtius_robustus',
-     'jp': 'コククジラ',
-     'en': 'Gray whale',
-     'sci': 'Eschrichtius robustus',
-     'family': 'コククジラ科（Eschrichtiidae）',
-     'length': '（準備中）',
-     'weight': '（準備中）',
-     'lifespan': '（準備中）',
-     'distribution': '（準備中：NOAA Fisheriesの種ページを根拠に追記予定）',
-     'ecology': '（準備中：NOAA Fisheriesの種ページを根拠に追記予定）',
-     'sources': [{'title': 'NOAA Fisheries: Gray Whale', 'url': 'https://www.fisheries.noaa.gov/species/gray-whale'}]},
-
-    {'id': 'balaenoptera_edeni',
-     'jp': 'ニタリクジラ',
-     'en': "Bryde's whale",
-     'sci': 'Balaenoptera edeni',
-     'family': 'ナガスクジラ科（Balaenopteridae）',
-     'length': '（準備中）',
-     'weight': '（準備中）',
-     'lifespan': '（準備中）',
-     'distribution': '（準備中：NOAA Fisheriesの種ページを根拠に追記予定）',
-     'ecology': '（準備中：NOAA Fisheriesの種ページを根拠に追記予定）',
-     'sources': [{'title': "NOAA Fisheries: Bryde's Whale", 'url': 'https://www.fisheries.noaa.gov/species/brydes-whale'}]},
-
-    {'id': 'kogia_breviceps',
-     'jp': 'コハクジラ',
-     'en': 'Pygmy sperm whale',
-     'sci': 'Kogia breviceps',
-     'family': 'マッコウクジラ科（Physeteridae）',
-     'length': '（準備中）',
-     'weight': '（準備中）',
-     'lifespan': '（準備中）',
-     'distribution': '（準備中：NOAA Fisheriesの種ページを根拠に追記予定）',
-     'ecology': '（準備中：NOAA Fisheriesの種ページを根拠に追記予定）',
-     'sources': [{'title': 'NOAA Fisheries: Pygmy Sperm Whale',
-                  'url': 'https://www.fisheries.noaa.gov/species/pygmy-sperm-whale'}]},
-
-    {'id': 'kogia_sima',
-     'jp': 'コマッコウ',
-     'en': 'Dwarf sperm whale',
-     'sci': 'Kogia sima',
-     'family': 'マッコウクジラ科（Physeteridae）',
-     'length': '（準備中）',
-     'weight': '（準備中）',
-     'lifespan': '（準備中）',
-     'distribution': '（準備中：NOAA Fisheriesの種ページを根拠に追記予定）',
-     'ecology': '（準備中：NOAA Fisheriesの種ページを根拠に追記予定）',
-     'sources': [{'title': 'NOAA Fisheries: Dwarf Sperm Whale',
-                  'url': 'https://www.fisheries.noaa.gov/species/dwarf-sperm-whale'}]},
-
-    {'id': 'stenella_attenuata',
-     'jp': 'マダライルカ',
-     'en': 'Pantropical spotted dolphin',
-     'sci': 'Stenella attenuata',
-     'family': 'マイルカ科（Delphinidae）',
-     'length': '（準備中）',
-     'weight': '（準備中）',
-     'lifespan': '（準備中）',
-     'distribution': '（準備中：NOAA Fisheriesの種ページを根拠に追記予定）',
-     'ecology': '（準備中：NOAA Fisheriesの種ページを根拠に追記予定）',
-     'sources': [{'title': 'NOAA Fisheries: Pantropical Spotted Dolphin',
-                  'url': 'https://www.fisheries.noaa.gov/species/pantropical-spotted-dolphin'}]},
-
-    {'id': 'phocoena_sinus',
-     'jp': 'バキータ',
-     'en': 'Vaquita',
-     'sci': 'Phocoena sinus',
-     'family': 'ネズミイルカ科（Phocoenidae）',
-     'length': '（準備中）',
-     'weight': '（準備中）',
-     'lifespan': '（準備中）',
-     'distribution': '（準備中：NOAA Fisheriesの種ページを根拠に追記予定）',
-     'ecology': '（準備中：NOAA Fisheriesの種ページを根拠に追記予定）',
-     'sources': [{'title': 'NOAA Fisheries: Vaquita', 'url': 'https://www.fisheries.noaa.gov/species/vaquita'}]},
-
-    {'id': 'berardius_bairdii',
-     'jp': 'ツチクジラ（ベアードオウギハクジラ）',
-     'en': "Baird's beaked whale",
-     'sci': 'Berardius bairdii',
-     'family': 'アカボウクジラ科（Ziphiidae）',
-     'length': '（準備中）',
-     'weight': '（準備中）',
-     'lifespan': '（準備中）',
-     'distribution': '（準備中：NOAA Fisheriesの種ページを根拠に追記予定）',
-     'ecology': '（準備中：NOAA Fisheriesの種ページを根拠に追記予定）',
-     'sources': [{'title': "NOAA Fisheries: Baird's Beaked Whale",
-                  'url': 'https://www.fisheries.noaa.gov/species/bairds-beaked-whale'}]},
-
-    {'id': 'ziphius_cavirostris',
-     'jp': 'アカボウクジラ',
-     'en': "Cuvier's beaked whale",
-     'sci': 'Ziphius cavirostris',
-     'family': 'アカボウクジラ科（Ziphiidae）',
-     'length': '（準備中）',
-     'weight': '（準備中）',
-     'lifespan': '（準備中）',
-     'distribution': '（準備中：NOAA Fisheriesの種ページを根拠に追記予定）',
-     'ecology': '（準備中：NOAA Fisheriesの種ページを根拠に追記予定）',
-     'sources': [{'title': "NOAA Fisheries: Cuvier's Beaked Whale",
-                  'url': 'https://www.fisheries.noaa.gov/species/cuviers-beaked-whale'}]},
-
-    {'id': 'globicephala_melas',
-     'jp': 'ゴンドウクジラ（長ヒレ）',
-     'en': 'Long-finned pilot whale',
-     'sci': 'Globicephala melas',
-     'family': 'マイルカ科（Delphinidae）',
-     'length': '（準備中）',
-     'weight': '（準備中）',
-     'lifespan': '（準備中）',
-     'distribution': '（準備中：NOAA Fisheriesの種ページを根拠に追記予定）',
-     'ecology': '（準備中：NOAA Fisheriesの種ページを根拠に追記予定）',
-     'sources': [{'title': 'NOAA Fisheries: Long-Finned Pilot Whale',
-                  'url': 'https://www.fisheries.noaa.gov/species/long-finned-pilot-whale'}]}
+
+def load_assets():
+    global ASSET_MANIFEST, ASSET_FILES
+    manifest = assets.ensure_built()
+    ASSET_MANIFEST = manifest
+    ASSET_FILES = {e["path"]: e for e in manifest["files"].values()} if manifest else {}
+
+
+load_assets()
+
+
+@app.template_global()
+def asset_url(filename):
+    """url_for('static', filename=...) の代わりに使う。ビルド済みならハッシュ付きの URL を返す"""
+    global _asset_next_check
+    if app.debug and time.monotonic() >= _asset_next_check:
+        _asset_next_check = time.monotonic() + ASSET_CHECK_INTERVAL
+        load_assets()
+    entry = ASSET_MANIFEST["files"].get(filename) if ASSET_MANIFEST else None
+    if entry is None:
+        return url_for("static", filename=filename)
+    return url_for("asset", filename=entry["path"])
+
+
+@app.route("/assets/<path:filename>")
+def asset(filename):
+    """ハッシュ付きの静的ファイル。名前が変わらない限り中身も変わらないので immutable で返す"""
+    entry = ASSET_FILES.get(filename)
+    if entry is None:
+        abort(404)
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    picked = assets.pick_encoding(entry, request.accept_encodings)
+    resp = send_from_directory(
+        assets.DIST_DIR,
+        filename + (picked[1] if picked else ""),
+        mimetype=mimetype,
+        max_age=365 * 24 * 3600,
+    )
+    if picked:
+        resp.headers["Content-Encoding"] = picked[0]
+    if entry["encodings"]:
+        resp.vary.add("Accept-Encoding")
+    resp.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return resp
+
+
+# ---- HTML のストリーミングと応答の圧縮 ----
+# 大きなページは全体を組み立ててから送るのではなく、描画しながら STREAM_CHUNK_SIZE 文字ずつ送る。
+# テキストの応答は gzip で圧縮する（COMPRESS_LEVEL=0 で無効。まとめて作った応答は
+# COMPRESS_MIN_SIZE バイト以上のときだけ）
+app.config["STREAM_PAGES"] = os.environ.get("STREAM_PAGES", "1") != "0"
+app.config["STREAM_CHUNK_SIZE"] = int(os.environ.get("STREAM_CHUNK_SIZE", 8192))
+app.config["COMPRESS_LEVEL"] = int(os.environ.get("COMPRESS_LEVEL", 6))
+app.config["COMPRESS_MIN_SIZE"] = int(os.environ.get("COMPRESS_MIN_SIZE", 1024))
+
+
+def _chunked(pieces, size):
+    """テンプレートが出す細かな断片を約 size 文字の塊にまとめる（大きな断片は切り分ける）"""
+    buf, n = [], 0
+    for piece in pieces:
+        if len(piece) >= size:
+            # 描画済みの一覧などの大きな断片は、つなげ直さずにそのまま切り出して送る
+            if buf:
+                yield "".join(buf)
+                buf, n = [], 0
+            for i in range(0, len(piece), size):
+                yield piece[i:i + size]
+            continue
+        buf.append(piece)
+        n += len(piece)
+        if n >= size:
+            yield "".join(buf)
+            buf, n = [], 0
+    if buf:
+        yield "".join(buf)
+
+
+def split_markup(html):
+    """描画済みの大きな HTML を STREAM_CHUNK_SIZE 文字ずつの Markup のタプルに分ける
+
+    テンプレートでは {% for part in ... %}{{ part }}{% endfor %} で出力する。大きな Markup を
+    {{ html }} で1つのまま出力すると、ストリーミングでもリクエストごとに全体がコピーされるため。
+    """
+    size = app.config["STREAM_CHUNK_SIZE"]
+    return tuple(Markup(html[i:i + size]) for i in range(0, len(html), size))
+
+
+def stream_page(template, **context):
+    """render_template の代わりに使う。STREAM_PAGES なら描画しながら送るジェネレータを返す"""
+    if not app.config["STREAM_PAGES"]:
+        return render_template(template, **context)
+    # 本文を送り終えたときにもう一度 teardown_request が呼ばれる（処理時間はそちらで記録する）
+    g.streaming = True
+    return _chunked(stream_template(template, **context), app.config["STREAM_CHUNK_SIZE"])
+
+
+def etag_matches(etag):
+    """If-None-Match に etag（または圧縮して送った版の ETag）が含まれるか"""
+    inm = request.if_none_match
+    return etag in inm or compression.gzip_etag(etag) in inm
+
+
+@app.after_request
+def compress_response(response):
+    return compression.compress_response(
+        response,
+        request.accept_encodings,
+        level=app.config["COMPRESS_LEVEL"],
+        min_size=app.config["COMPRESS_MIN_SIZE"],
+    )
+
+
+# ---- メトリクス（/metrics で Prometheus 形式で出す。metrics.py 参照） ----
+# 大きさ・キャッシュなど読み出し時に求める値は /metrics のルートの近くで登録する
+METRICS = metrics.Registry()
+REQUEST_COUNT = METRICS.counter(
+    "cetacean_http_requests_total", "応答したリクエスト数", ("endpoint", "method", "status"))
+REQUEST_SECONDS = METRICS.histogram(
+    "cetacean_http_request_duration_seconds", "ルートごとの処理時間（前処理から後片付けまで）", ("endpoint", "method"))
+STORAGE_SECONDS = METRICS.histogram(
+    "cetacean_storage_duration_seconds", "保存先の読み書きにかかった時間", ("backend", "operation"),
+    buckets=metrics.IO_BUCKETS)
+TEMPLATE_SECONDS = METRICS.histogram(
+    "cetacean_template_render_seconds", "テンプレートの描画時間（ストリーミングは送り終えるまで）", ("template",))
+CHART_SECONDS = METRICS.histogram(
+    "cetacean_chart_render_seconds", "グラフ画像の描画時間", ("format",))
+
+# 時間を計る保存先の処理
+STORAGE_OPERATIONS = [
+    "load_users", "save_user", "set_user_favorites",
+    "bbs_count", "bbs_page", "recent_bbs_messages", "append_bbs_message",
 ]
 
-SPECIES_BY_ID = {s["id"]: s for s in SPECIES}
 
 # ---- データ保存先（data/ に保存：サーバ再起動後も保持） ----
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_DIR = os.path.join(BASE_DIR, 'data')
+# 環境変数 DATA_DIR で別の場所を使える（ベンチマーク等で本番データを汚さないため）
+DATA_DIR = os.environ.get('DATA_DIR') or os.path.join(BASE_DIR, 'data')
 os.makedirs(DATA_DIR, exist_ok=True)
 
-VISITOR_FILE = os.path.join(DATA_DIR, 'visitor_count.json')
-SEARCH_FILE = os.path.join(DATA_DIR, 'search_counts.json')
-BBS_FILE = os.path.join(DATA_DIR, 'bbs_messages.csv')
-USERS_FILE = os.path.join(DATA_DIR, 'users.json')
+# 保存先：file（data/ の JSON・CSV、既定）または sqlite（data/cetacean.sqlite3）
+app.config["STORAGE_BACKEND"] = os.environ.get("STORAGE_BACKEND", "file")
+STORAGE = open_storage(app.config["STORAGE_BACKEND"], DATA_DIR)
+metrics.instrument(STORAGE, STORAGE_OPERATIONS, STORAGE_SECONDS, STORAGE.name)
+
+
+# ---- カウンタ等（保存先から復元） ----
+COUNTER_LOG = STORAGE.counter_store()
+# 書き出し（flush）は COUNTER_WRITER に渡す前に計測付きにしておく
+metrics.instrument(COUNTER_LOG, ["flush", "compact"], STORAGE_SECONDS, "counter_log")
+_counter_state = COUNTER_LOG.state()
+
+# 表示用の値は全ワーカ共通の共有カウンタ表から読む（読み取りはロックなし、加算は原子的）。
+# 表が無ければ、保存先から復元した値で作る
+COUNTERS = SharedCounters(
+    os.path.join(DATA_DIR, 'counters.shm'),
+    seed={
+        'visitor': _counter_state['visitor'],
+        # 枠は作成時に用意しておく（表がいっぱいになってからでは追加できない）
+        'hour': _counter_state['hour'] or 0,
+        **{'search:' + k: v for k, v in _counter_state['search'].items()},
+    },
+)
 
 
-def load_json(path, default):
-    try:
-        with open(path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception:
-        return default
+def visitor_count():
+    return COUNTERS.get('visitor')
+
+
+# 共有カウンタ表がいっぱいで枠を追加できない種（カタログの入れ替えを繰り返した場合など）は、
+# このワーカの中だけで数える（時 -> {種 id: 回数}）。時間が変わったら各ワーカが自分で履歴に残す
+_LOCAL_SEARCH_COUNTS = {}
+_LOCAL_SEARCH_LOCK = threading.Lock()
+_counter_table_full_logged = False
 
 
-def save_json(path, obj):
-    tmp = path + '.tmp'
-    with open(tmp, 'w', encoding='utf-8') as f:
-        json.dump(obj, f, ensure_ascii=False, indent=2)
-    os.replace(tmp, path)
+def log_counter_table_full():
+    global _counter_table_full_logged
+    if not _counter_table_full_logged:
+        _counter_table_full_logged = True
+        app.logger.warning("共有カウンタ表がいっぱいです。追加できない検索回数はワーカごとに数えます")
 
 
-def load_bbs_messages():
-    if not os.path.exists(BBS_FILE):
-        return []
+def count_search(species_id):
     try:
-        with open(BBS_FILE, newline='', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            out = []
-            for row in reader:
-                out.append({
-                    'ts': row.get('ts', ''),
-                    'user': row.get('user', ''),
-                    'text': row.get('text', ''),
-                })
-            return out
-    except Exception:
-        return []
+        COUNTERS.add('search:' + species_id)
+    except CounterTableFull:
+        log_counter_table_full()
+        with _LOCAL_SEARCH_LOCK:
+            counts = _LOCAL_SEARCH_COUNTS.setdefault(search_stats.hour_of(), {})
+            counts[species_id] = counts.get(species_id, 0) + 1
+    COUNTER_LOG.record(counter_log.SEARCH, species_id)
+    COUNTER_WRITER.mark()
 
 
-def append_bbs_message(msg):
-    file_exists = os.path.exists(BBS_FILE)
-    with open(BBS_FILE, 'a', newline='', encoding='utf-8') as f:
-        writer = csv.DictWriter(f, fieldnames=['ts', 'user', 'text'])
-        if not file_exists:
-            writer.writeheader()
-        writer.writerow(msg)
+def current_search_counts():
+    # 今の1時間の分。時間の切り替えで0に戻った枠は表に残るので除く
+    counts = {k: v for k, v in COUNTERS.items('search:').items() if v}
+    if _LOCAL_SEARCH_COUNTS:
+        with _LOCAL_SEARCH_LOCK:
+            search_stats.add_counts(counts, _LOCAL_SEARCH_COUNTS.get(search_stats.hour_of(), {}))
+    return counts
 
 
-# ---- カウンタ等（data/ から読み込み） ----
-VISITOR_COUNT = int(load_json(VISITOR_FILE, {}).get('count', 0) or 0)
+# 過ぎた時間の検索回数（search_stats.py 参照）。直近30日分をメモリに持ち、それより古い分はファイルに残る
+SEARCH_HISTORY = SearchHistory(os.path.join(DATA_DIR, 'search_history'))
+# 順位を出す期間（時間数）
+SEARCH_WINDOWS = {"day": 24, "week": 7 * 24, "month": 30 * 24}
 
-_search_data = load_json(SEARCH_FILE, {})
-CURRENT_WEEK_ID = _search_data.get('week_id')
-SEARCH_COUNTS = _search_data.get('counts', {}) if isinstance(_search_data.get('counts', {}), dict) else {}
-SEARCH_COUNTS = {k: int(v) for k, v in SEARCH_COUNTS.items() if isinstance(k, str)}
 
-BBS_MESSAGES = load_bbs_messages()  # {'user': '...', 'text': '...', 'ts': '...'}
+def search_counts(hours=SEARCH_WINDOWS["week"]):
+    """直近 hours 時間（今の1時間を含む）の種ごとの検索回数"""
+    return SEARCH_HISTORY.window(hours, current_search_counts())
 
-USERS = load_json(USERS_FILE, {})
-if not isinstance(USERS, dict):
-    USERS = {}
 
+# 増分はイベントとして溜めておき、5秒ごと（または100件たまったら）ログへまとめて追記する
+COUNTER_WRITER = WriteBehind(COUNTER_LOG.flush, interval=5.0, max_pending=100, name="counter-writer")
+# ユーザー情報・お気に入りの保存はメモリ（USERS・FAVORITES）を更新した後、専用のスレッドで順に行う
+USER_WRITER = BackgroundWriter(max_pending=1000, name="user-writer")
 
-def week_id_today():
-    # ISO週番号（年-週）
-    today = datetime.date.today()
-    iso = today.isocalendar()  # (year, week, weekday)
-    return f"{iso[0]}-W{iso[1]:02d}"
+# 談話室：メモリには最新 BBS_PAGE_SIZE 件だけを置く（古い投稿は /bbs?page=N で保存先から読む）
+BBS_PAGE_SIZE = 50
+BBS_MESSAGES = deque(STORAGE.recent_bbs_messages(BBS_PAGE_SIZE), maxlen=BBS_PAGE_SIZE)  # {'user': '...', 'text': '...', 'ts': '...'}
+BBS_SEEN_TOTAL = STORAGE.bbs_count()
+BBS_LOCK = threading.Lock()
 
+USERS = STORAGE.load_users()
 
-def save_visitor_count():
-    save_json(VISITOR_FILE, {'count': VISITOR_COUNT})
 
+def recent_bbs_messages(total):
+    """最新の投稿（新しい順）。保存先の件数が変わっていれば（他のワーカの投稿も含め）読み直す"""
+    global BBS_SEEN_TOTAL
+    with BBS_LOCK:
+        if total != BBS_SEEN_TOTAL:
+            BBS_MESSAGES.clear()
+            BBS_MESSAGES.extend(STORAGE.recent_bbs_messages(BBS_PAGE_SIZE))
+            BBS_SEEN_TOTAL = total
+        return list(reversed(BBS_MESSAGES))
 
-def save_search_counts():
-    save_json(SEARCH_FILE, {'week_id': CURRENT_WEEK_ID, 'counts': SEARCH_COUNTS})
 
+# (週ID, 次の週が始まる時刻)。週が変わるまでは計算し直さない
+_WEEK_MEMO = (None, None)
 
-def reset_weekly_counts_if_needed():
-    global CURRENT_WEEK_ID, SEARCH_COUNTS
-    wid = week_id_today()
-    if CURRENT_WEEK_ID != wid:
-        CURRENT_WEEK_ID = wid
-        SEARCH_COUNTS = {}
-        save_search_counts()
+
+def week_id_today():
+    # ISO週番号（年-週）
+    global _WEEK_MEMO
+    wid, until = _WEEK_MEMO
+    now = datetime.datetime.now()
+    if wid is None or now >= until:
+        today = now.date()
+        iso = today.isocalendar()  # (year, week, weekday)
+        wid = f"{iso[0]}-W{iso[1]:02d}"
+        monday = today - datetime.timedelta(days=iso[2] - 1)
+        until = datetime.datetime.combine(monday + datetime.timedelta(days=7), datetime.time())
+        _WEEK_MEMO = (wid, until)
+    return wid
+
+
+def archive_search_counts(hour, counts):
+    try:
+        SEARCH_HISTORY.archive(hour, counts)
+    except OSError:
+        app.logger.exception("検索回数の履歴を保存できませんでした")
+
+
+def roll_search_hour_if_needed():
+    hour = search_stats.hour_of()
+    if _LOCAL_SEARCH_COUNTS:
+        with _LOCAL_SEARCH_LOCK:
+            past = [h for h in _LOCAL_SEARCH_COUNTS if h < hour]
+            past = {h: _LOCAL_SEARCH_COUNTS.pop(h) for h in past}
+        for h, counts in past.items():
+            archive_search_counts(h, counts)
+    # 複数のワーカが同時に気づいても、切り替えるのは最初の1回だけ
+    try:
+        taken = COUNTERS.set_and_take('hour', hour, 'search:')
+    except CounterTableFull:
+        # 時の枠が無い古い表がいっぱいの場合。切り替えずに今の枠で数え続ける
+        log_counter_table_full()
+        return
+    if taken is None:
+        return
+    previous, counts = taken
+    COUNTER_LOG.record(counter_log.HOUR, str(hour), 0)
+    COUNTER_WRITER.mark()
+    if not previous:
+        # 週ごとに数えていた頃の表を引き継いだ場合は、その週の最後の1時間の分として残す
+        # （今週なら直前の1時間の分になる）。どの週の分か分からなければ捨てる
+        week = COUNTERS.get('week')
+        previous = search_stats.week_last_hour(f"{week // 100}-W{week % 100:02d}") if week else None
+        if previous is None:
+            return
+    archive_search_counts(min(previous, hour - 1), counts)
 
 
 def touch_visit():
     """同一ブラウザ（セッション）を1訪問として数える簡易実装"""
-    global VISITOR_COUNT
     if not session.get('counted_visit', False):
-        VISITOR_COUNT += 1
+        COUNTERS.add('visitor')
         session['counted_visit'] = True
-        save_visitor_count()
+        COUNTER_LOG.record(counter_log.VISIT)
+        COUNTER_WRITER.mark()
 
 
 def is_logged_in():
@@ -653,10 +381,6 @@ def get_user_record(username):
     return rec if isinstance(rec, dict) else None
 
 
-def save_users():
-    save_json(USERS_FILE, USERS)
-
-
 def normalize_favorites(favs):
     if not isinstance(favs, list):
         favs = []
@@ -669,25 +393,40 @@ def normalize_favorites(favs):
     return out
 
 
+# お気に入りの索引（ユーザー → 種の集合、種 → 人数）。起動時に全ユーザー分を一度だけ読み込み、
+# 以降は追加・削除のたびにその1件分だけ更新する
+FAVORITES = FavoriteIndex()
+for _username, _rec in USERS.items():
+    if isinstance(_rec, dict):
+        FAVORITES.load(_username, normalize_favorites(_rec.get("favorites", [])))
+
+
 def user_favorites(username):
-    rec = get_user_record(username)
-    if not rec:
-        return []
-    favs = normalize_favorites(rec.get("favorites", []))
-    if favs != rec.get("favorites", []):
-        rec["favorites"] = favs
-        USERS[username] = rec
-        save_users()
-    return favs
+    return FAVORITES.favorites(username)
 
 
-def set_user_favorites(username, favs):
+def save_user_favorites(username):
+    """索引上のお気に入りをユーザーの記録に反映して保存する"""
     rec = get_user_record(username)
     if not rec:
         return
-    rec["favorites"] = normalize_favorites(favs)
+    rec["favorites"] = FAVORITES.favorites(username)
     USERS[username] = rec
-    save_users()
+    USER_WRITER.submit(STORAGE.set_user_favorites, username, list(rec["favorites"]))
+
+
+def top_favorited_species(limit=5):
+    # お気に入りの人数上位（カタログから消えた種は除く）
+    by_id = CATALOG.by_id
+    top = []
+    for sid, cnt in FAVORITES.ranking():
+        if sid in by_id:
+            s = dict(by_id[sid])
+            s["fav_count"] = cnt
+            top.append(s)
+            if len(top) >= limit:
+                break
+    return top
 
 
 def validate_username(username):
@@ -704,79 +443,271 @@ def validate_username(username):
     return True, ""
 
 
+# ---- リクエストごとの前処理 ----
+# ページを表示するルートでは、訪問数・検索回数の時間の切り替え・ログイン情報の準備をここで1回だけ行い、
+# 結果を g に置く（g.user / g.logged_in / g.favorites）。
+
+# ページではないので訪問数を数えないエンドポイント（入力補完・新着配信・グラフ画像など）
+PASSIVE_ENDPOINTS = {
+    "suggest", "bbs_stream", "stats_search_chart", "metrics_endpoint", "admin_profiles", "admin_profile",
+}
+# 静的ファイルはセッションにも触れない（触れると Vary: Cookie が付き、共有キャッシュが効かなくなる）
+STATIC_ENDPOINTS = {"static", "asset"}
+
+ROUTE_TIMINGS = RouteTimings()
+
+# ---- プロファイル（profiling.py 参照） ----
+# PROFILING=1 のときだけ有効。
+#   X-Profile: <PROFILE_SECRET> を付けたリクエスト … cProfile で全関数を記録する
+#   それ以外のリクエストの PROFILE_SAMPLE_RATE の割合 … スタックのサンプリングだけ（軽い）
+# 結果は PROFILE_DIR（既定 data/profiles/）に新しい PROFILE_KEEP 件まで残し、/admin/profiles で一覧できる
+app.config["PROFILING"] = os.environ.get("PROFILING", "0") == "1"
+app.config["PROFILE_SECRET"] = os.environ.get("PROFILE_SECRET", "")
+app.config["PROFILE_SAMPLE_RATE"] = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+# 管理用のページ（/admin/...）を見られるユーザー名（カンマ区切り）
+app.config["ADMIN_USERS"] = {u for u in os.environ.get("ADMIN_USERS", "").split(",") if u}
+PROFILES = ProfileStore(
+    os.environ.get("PROFILE_DIR") or os.path.join(DATA_DIR, "profiles"),
+    keep=int(os.environ.get("PROFILE_KEEP", 100)),
+)
+SAMPLER = StackSampler(interval=0.005)
+
+
+def profile_secret_given():
+    secret = app.config["PROFILE_SECRET"]
+    given = request.headers.get("X-Profile")
+    return bool(secret and given and hmac.compare_digest(given, secret))
+
+
+def start_profile():
+    """このリクエストのプロファイルを取るなら始め、g.profile に (ID, 種類, 記録中のもの) を置く"""
+    if profile_secret_given():
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            return  # 他のスレッドで cProfile が動いている（Python 3.12 以降は同時に1つだけ）
+        g.profile = (PROFILES.new_id(), "cprofile", profiler)
+    elif random.random() < app.config["PROFILE_SAMPLE_RATE"]:
+        ident = threading.get_ident()
+        SAMPLER.start(ident)
+        g.profile = (PROFILES.new_id(), "sampled", ident)
+
+
+def finish_profile(endpoint, elapsed):
+    profile_id, kind, target = g.pop("profile")
+    meta = {
+        "endpoint": endpoint,
+        "method": request.method,
+        "path": request.full_path.rstrip("?"),
+        "elapsed_ms": round(elapsed * 1000, 2),
+        "time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    try:
+        if kind == "cprofile":
+            target.disable()
+            PROFILES.save_cprofile(profile_id, target, meta)
+        else:
+            samples = SAMPLER.stop(target)
+            if samples:  # サンプリング間隔より短く終わったリクエストは残さない
+                PROFILES.save_samples(profile_id, samples, meta)
+    except OSError:
+        app.logger.exception("プロファイルを保存できませんでした")
+
+
+@app.before_request
+def prepare_request():
+    # g・request はアクセスのたびにプロキシを辿るので、ローカル変数で組み立ててから置く
+    endpoint = request.endpoint
+    if endpoint in STATIC_ENDPOINTS:
+        return
+    if app.config["PROFILING"]:
+        start_profile()
+    started = time.perf_counter()
+    user = current_user()
+    logged_in = is_logged_in()
+    g.user = user
+    g.logged_in = logged_in
+    g.favorites = user_favorites(user) if logged_in else []
+    if endpoint is not None and endpoint not in PASSIVE_ENDPOINTS:
+        touch_visit()
+        roll_search_hour_if_needed()
+    g.started = started
+    g.setup_time = time.perf_counter() - started
+
+
+@app.after_request
+def note_response(response):
+    # 件数は teardown_request で数える（例外が外まで伝わって after_request が呼ばれない場合も数えるため）
+    g.response_status = response.status_code
+    profile = g.get("profile")
+    if profile is not None and profile[1] == "cprofile":
+        # 指定して取ったプロファイルは、どれが自分のものか分かるよう ID を返す
+        response.headers["X-Profile-Id"] = profile[0]
+    return response
+
+
+@app.teardown_request
+def record_route_timing(exc=None):
+    if not g.get("counted"):
+        # 応答を作れなかったリクエストは 500 として数える。ストリーミングの2回目の呼び出しでは数えない
+        g.counted = True
+        REQUEST_COUNT.inc(request.endpoint or "(not found)", request.method, g.get("response_status", 500))
+    if g.pop("streaming", False):
+        return  # 応答を返した時点（本文はまだ送っていない）
+    started = g.pop("started", None)
+    endpoint = request.endpoint or "(not found)"
+    elapsed = time.perf_counter() - started if started is not None else 0.0
+    if started is not None:
+        ROUTE_TIMINGS.record(endpoint, elapsed, g.get("setup_time", 0.0))
+        REQUEST_SECONDS.observe(elapsed, endpoint, request.method)
+    # 前処理の途中で例外になった場合も、始めたプロファイルは必ず止める
+    if "profile" in g:
+        finish_profile(endpoint, elapsed)
+
+
+# テンプレートの描画時間。描画の中で別のテンプレートを描くこともあるので、開始時刻は積んでおく
+@before_render_template.connect_via(app)
+def start_template_timer(sender, template, context, **extra):
+    g.setdefault("template_started", []).append(time.perf_counter())
+
+
+@template_rendered.connect_via(app)
+def record_template_timing(sender, template, context, **extra):
+    stack = g.get("template_started")
+    if stack:
+        TEMPLATE_SECONDS.observe(time.perf_counter() - stack.pop(), template.name or "(string)")
+
+
 def common_context():
-    favs = user_favorites(current_user()) if is_logged_in() else []
     return {
-        "login_user": current_user(),
-        "logged_in": is_logged_in(),
-        "visitor_count": VISITOR_COUNT,
-        "total_species": len(SPECIES),
-        "favorites_count": len(favs),
-        "week_id": CURRENT_WEEK_ID or week_id_today(),
+        "login_user": g.user,
+        "logged_in": g.logged_in,
+        "visitor_count": visitor_count(),
+        "total_species": len(CATALOG.species),
+        "favorites_count": len(g.favorites),
+        "week_id": week_id_today(),
     }
 
 
 def pick_today_species():
     # 日付から決定的に1種を選ぶ（サーバ再起動に依存しない）
-    idx = datetime.date.today().toordinal() % len(SPECIES)
-    return SPECIES[idx]
+    species = CATALOG.species
+    idx = datetime.date.today().toordinal() % len(species)
+    return species[idx]
 
 
-def top_week_species(limit=3):
-    # 週の検索回数上位（同数なら種名で安定ソート）
-    items = [(sid, cnt) for sid, cnt in SEARCH_COUNTS.items() if sid in SPECIES_BY_ID]
-    items.sort(key=lambda t: (-t[1], SPECIES_BY_ID[t[0]]["jp"]))
+def top_searched_species(limit=3, hours=SEARCH_WINDOWS["week"]):
+    # 直近 hours 時間の検索回数上位（同数なら種名で安定ソート）
+    by_id = CATALOG.by_id
+    items = [(sid, cnt) for sid, cnt in search_counts(hours).items() if sid in by_id]
+    items.sort(key=lambda t: (-t[1], by_id[t[0]]["jp"]))
     top = []
     for sid, cnt in items[:limit]:
-        s = dict(SPECIES_BY_ID[sid])
+        s = dict(by_id[sid])
         s["count"] = cnt
         top.append(s)
     return top
 
 
+def trending_species(limit=5, hours=SEARCH_WINDOWS["day"], baseline_hours=SEARCH_WINDOWS["week"]):
+    # 直近 hours 時間の検索回数が、その前の baseline_hours 時間のペースより伸びている種
+    by_id = CATALOG.by_id
+    recent = search_counts(hours)
+    baseline = SEARCH_HISTORY.before(baseline_hours, hours)
+    out = []
+    for sid, score, cnt, expected in search_stats.trending(recent, baseline, hours, baseline_hours):
+        if sid not in by_id:
+            continue
+        s = dict(by_id[sid])
+        s["count"] = cnt
+        s["expected"] = expected
+        s["score"] = score
+        out.append(s)
+        if len(out) >= limit:
+            break
+    return out
+
+
+# ---- パスワード ----
+# ハッシュの計算はリクエストのスレッドではなく PASSWORD_HASH_THREADS 本のプールで行う（passwords.py 参照）。
+# PASSWORD_HASH_METHOD は werkzeug の形式（"scrypt"、"scrypt:65536:8:1"、"pbkdf2:sha256:600000" など）。
+# 変えると、各ユーザーの次のログイン時に新しい強さでハッシュし直す
+app.config["PASSWORD_HASH_METHOD"] = os.environ.get("PASSWORD_HASH_METHOD", "scrypt")
+app.config["PASSWORD_HASH_THREADS"] = int(os.environ.get("PASSWORD_HASH_THREADS", 2))
+PASSWORD_HASHER = PasswordHasher(
+    app.config["PASSWORD_HASH_METHOD"],
+    max_workers=app.config["PASSWORD_HASH_THREADS"],
+    max_pending=int(os.environ.get("PASSWORD_HASH_MAX_PENDING", 32)),
+)
+# ユーザー名ごとに5回・IP ごとに20回、5分以内に失敗したら、それより前の失敗が5分を過ぎるまで断る
+LOGIN_THROTTLE = LoginThrottle(user_limit=5, ip_limit=20, window=300.0, max_keys=10000)
+
+
+def update_password_hash(username, old_hash, new_hash):
+    """ログイン時のハッシュし直しの結果を反映する（その間にパスワードが変わっていなければ）"""
+    rec = get_user_record(username)
+    if rec is not None and rec.get("pw_hash") == old_hash:
+        rec["pw_hash"] = new_hash
+        USER_WRITER.submit(STORAGE.save_user, username, dict(rec))
+
+
 @app.route("/login", methods=["GET", "POST"])
 def login():
-    touch_visit()
-    reset_weekly_counts_if_needed()
-
     # 既にログイン済みならマイページへ
-    if is_logged_in():
+    if g.logged_in:
         return redirect(url_for("mypage"))
 
-
-
     message = ""
+    status = 200
     if request.method == "POST":
         username = (request.form.get("username", "") or "").strip()
         pw = request.form.get("password", "") or ""
-
+        ip = request.remote_addr or ""
 
         session["user_prefill"] = username
 
         rec = get_user_record(username)
         pw_hash = (rec or {}).get("pw_hash", "")
-        if rec and pw_hash and check_password_hash(pw_hash, pw):
-            session["user"] = username
-            session["logged_in"] = True
-            return redirect(url_for("home"))
+        wait = LOGIN_THROTTLE.retry_after(username, ip)
+        if wait:
+            # ハッシュの計算をする前に断る（総当たりに CPU を使わせない）
+            message = f"ログインの失敗が続いたため、しばらく受け付けません。{int(wait) + 1}秒ほど後にもう一度お試しください。"
+            status = 429
         else:
-            message = "ユーザー名またはパスワードが違います。"
+            try:
+                ok = bool(rec and pw_hash and PASSWORD_HASHER.verify(
+                    pw_hash, pw, rehashed=lambda new_hash: update_password_hash(username, pw_hash, new_hash)
+                ))
+            except HasherBusy:
+                ok = None
+            if ok:
+                LOGIN_THROTTLE.succeeded(username)
+                session["user"] = username
+                session["logged_in"] = True
+                return redirect(url_for("home"))
+            elif ok is None:
+                message = "ただいま混み合っています。少し待ってからもう一度お試しください。"
+                status = 503
+            else:
+                LOGIN_THROTTLE.failed(username, ip)
+                message = "ユーザー名またはパスワードが違います。"
 
     user_prefill = session.get("user_prefill", "")
-    return render_template(
+    resp = make_response(render_template(
         "login.html",
         user_prefill=user_prefill,
         message=message,
         **common_context(),
-    )
+    ), status)
+    if status != 200:
+        resp.headers["Retry-After"] = str(int(wait) + 1 if status == 429 else 1)
+    return resp
 
 
 @app.route("/register", methods=["GET", "POST"])
 def register():
-    touch_visit()
-    reset_weekly_counts_if_needed()
-
-    if is_logged_in():
+    if g.logged_in:
         return redirect(url_for("mypage"))
 
     message = ""
@@ -797,13 +728,22 @@ def register():
         elif pw != pw2:
             message = "パスワード（確認）が一致しません。"
         else:
-            USERS[username] = {
-                "pw_hash": generate_password_hash(pw),
-                "created_at": datetime.date.today().strftime("%Y-%m-%d"),
-                "favorites": [],
-            }
-            save_users()
-            return redirect(url_for("login"))
+            try:
+                rec = {
+                    "pw_hash": PASSWORD_HASHER.hash(pw),
+                    "created_at": datetime.date.today().strftime("%Y-%m-%d"),
+                    "favorites": [],
+                }
+            except HasherBusy:
+                rec = None
+            if rec is None:
+                message = "ただいま混み合っています。少し待ってからもう一度お試しください。"
+            # ハッシュの計算中に同じ名前で登録されていないか確かめてから入れる
+            elif USERS.setdefault(username, rec) is not rec:
+                message = "そのユーザー名は既に使用されています。別のユーザー名にしてください。"
+            else:
+                USER_WRITER.submit(STORAGE.save_user, username, dict(rec))
+                return redirect(url_for("login"))
 
     user_prefill = session.get("user_prefill", "")
     return render_template(
@@ -816,29 +756,23 @@ def register():
 
 @app.route("/mypage")
 def mypage():
-    touch_visit()
-    reset_weekly_counts_if_needed()
-    if not is_logged_in():
+    if not g.logged_in:
         return redirect(url_for("login"))
 
-    username = current_user()
+    username = g.user
     rec = get_user_record(username) or {}
-    favs = user_favorites(username)
 
     return render_template(
         "mypage.html",
         username=username,
         created_at=rec.get("created_at", ""),
-        favorites_count_user=len(favs),
+        favorites_count_user=len(g.favorites),
         **common_context(),
     )
 
 
 @app.route("/logout")
 def logout():
-    touch_visit()
-    reset_weekly_counts_if_needed()
-
     counted = bool(session.get("counted_visit", False))
     session.clear()
     # 訪問者数の多重加算を避けるため、訪問カウントのフラグは保持
@@ -849,106 +783,221 @@ def logout():
 
 @app.route("/")
 def home():
-    touch_visit()
-    reset_weekly_counts_if_needed()
-
     today = pick_today_species()
-    top = top_week_species(limit=5)
+    top = top_searched_species(limit=5)
 
     return render_template(
         "home.html",
         today_species=today,
         top_week=top,
+        top_favorited=top_favorited_species(limit=5),
         **common_context(),
     )
 
 
+def run_search(cat, q, mode):
+    """検索を実行し、(種 id のリスト, {id: スニペット}) を返す"""
+    snippets = {}
+    if mode == "text":
+        ids = []
+        for sid, _, offsets in cat.text_index.search(q):
+            ids.append(sid)
+            snippets[sid] = cat.text_index.snippet(sid, offsets)
+    else:
+        ids = cat.name_index.search(q)
+        if mode == "fuzzy":
+            exact = set(ids)
+            ids += [sid for sid, _ in cat.fuzzy_index.search(q) if sid not in exact]
+    return ids, snippets
+
+
+def cached_search(cat, q, mode):
+    """検索結果の id と描画済みの結果一覧を LRU キャッシュから返す（無ければ作る）
+
+    キーは (カタログの digest, モード, 小文字化した検索語)。カタログの内容が変われば digest が
+    変わるので、古いエントリは参照されないまま追い出される。
+    """
+    key = (cat.digest, mode, q.lower())
+    entry = SEARCH_CACHE.get(key)
+    if entry is None:
+        ids, snippets = run_search(cat, q, mode)
+        html = render_template(
+            "_search_result_list.html",
+            results=[cat.by_id[sid] for sid in ids],
+            snippets=snippets,
+        )
+        entry = {"ids": ids, "html": split_markup(html)}
+        SEARCH_CACHE.put(key, entry)
+    return entry
+
+
 @app.route("/search")
 def search():
-    touch_visit()
-    reset_weekly_counts_if_needed()
-
     q = request.args.get("q", "").strip()
-    results = []
-    if q:
-        q_lower = q.lower()
-        for s in SPECIES:
-            hay = f'{s["jp"]} {s["en"]} {s["sci"]}'.lower()
-            if q_lower in hay:
-                results.append(s)
-
-    return render_template(
+    # mode=fuzzy：英名・学名の誤字を許容（部分一致したものを先に並べる）
+    # mode=text ：分布・生態の本文を全文検索（BM25 順、一致箇所をスニペット表示）
+    mode = request.args.get("mode", "")
+    if mode not in ("fuzzy", "text"):
+        mode = ""
+    cat = CATALOG
+
+    # 未ログインの再訪問は、ヘッダ表示（訪問者数・週）まで同じなら 304 で返す
+    etag = None
+    if not g.logged_in:
+        etag = page_etag(cat, "search", mode, q)
+        if etag_matches(etag):
+            resp = app.response_class(status=304)
+            resp.set_etag(etag)
+            return resp
+
+    entry = cached_search(cat, q, mode) if q else {"ids": [], "html": ()}
+
+    resp = make_response(stream_page(
         "search_results.html",
         q=q,
-        results=results,
+        mode=mode,
+        result_count=len(entry["ids"]),
+        results_html=entry["html"],
         **common_context(),
-    )
+    ))
+    if etag:
+        resp.set_etag(etag)
+        resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
+
+
+@app.route("/api/suggest")
+def suggest():
+    """検索窓の入力補完（JSON）。訪問数のカウントはしない"""
+    q = request.args.get("q", "").strip()
+    try:
+        limit = int(request.args.get("limit", 8))
+    except ValueError:
+        limit = 8
+    limit = max(1, min(limit, 20))
+
+    items = []
+    cat = CATALOG
+    for sid, label in cat.suggester.suggest(q, limit=limit):
+        s = cat.by_id[sid]
+        items.append({
+            "id": sid,
+            "label": label,
+            "jp": s["jp"],
+            "en": s["en"],
+            "sci": s["sci"],
+            "url": url_for("species_detail", species_id=sid),
+        })
+    return jsonify({"q": q, "suggestions": items})
+
+
+def species_fragments(cat, sid):
+    """種の詳細ページの共通部分（見出し・基本情報・本文）を描画済みの Markup で返す
+
+    本文（分布・生態）は長く、描画の大半を占める。カタログの版ごとに1回だけ描いて使い回す。
+    """
+    key = (cat.version, "species", sid)
+    entry = FRAGMENT_CACHE.get(key)
+    if entry is None:
+        sp = cat.by_id[sid]
+        entry = {
+            name: Markup(get_template_attribute("_species_fragments.html", name)(sp))
+            for name in ("header", "facts", "sections")
+        }
+        FRAGMENT_CACHE.put(key, entry)
+    return entry
+
+
+def species_table(cat):
+    """収録一覧の表を描画済みの Markup（split_markup で分けたもの）で返す（カタログの版ごとに1回だけ描く）"""
+    key = (cat.version, "data")
+    html = FRAGMENT_CACHE.get(key)
+    if html is None:
+        html = split_markup(render_template("_species_table.html", species=cat.species))
+        FRAGMENT_CACHE.put(key, html)
+    return html
+
+
+def page_etag(cat, *parts):
+    """ページの強い ETag
+
+    カタログの内容（digest）と、ページ内で人によって変わる部分（ヘッダの表示・parts）から作る。
+    """
+    key = "|".join(str(p) for p in (
+        cat.digest, g.user, len(g.favorites), visitor_count(), week_id_today(), *parts
+    ))
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def conditional_page(cat, etag, render):
+    """If-None-Match が一致すれば 304、そうでなければ render() の結果を返す
+
+    Last-Modified はカタログの更新時刻。ページにはヘッダの訪問者数など日時では表せない部分が
+    あるので、判定は ETag で行う（両方を受け取ったブラウザは If-None-Match も送ってくる）。
+    """
+    if etag_matches(etag):
+        resp = app.response_class(status=304)
+    else:
+        resp = make_response(render())
+    resp.set_etag(etag)
+    if cat.modified is not None:
+        resp.last_modified = cat.modified
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
 
 
 @app.route("/species/<species_id>")
 def species_detail(species_id):
-    touch_visit()
-    reset_weekly_counts_if_needed()
-
-    s = SPECIES_BY_ID.get(species_id)
+    cat = CATALOG
+    s = cat.by_id.get(species_id)
     if s is None:
         return render_template("not_found.html", **common_context()), 404
 
-    # 検索結果から遷移した場合のみカウント（今週の検索回数）
+    # 検索結果から遷移した場合のみカウント（時間ごとの検索回数）
     if request.args.get("from", "") == "search":
-        SEARCH_COUNTS[species_id] = SEARCH_COUNTS.get(species_id, 0) + 1
-        save_search_counts()
+        count_search(species_id)
+        if SEARCH_CHART is not None:
+            SEARCH_CHART.changed()
 
-    favs = user_favorites(current_user()) if is_logged_in() else []
-    is_fav = species_id in favs
+    is_fav = g.logged_in and FAVORITES.has(g.user, species_id)
+    fav_count = FAVORITES.count(species_id)
 
-    return render_template(
+    return conditional_page(cat, page_etag(cat, species_id, is_fav, fav_count), lambda: render_template(
         "species_detail.html",
         sp=s,
+        fragments=species_fragments(cat, species_id),
         is_fav=is_fav,
+        fav_count=fav_count,
         **common_context(),
-    )
+    ))
 
 
 @app.route("/favorite/<species_id>", methods=["POST"])
 def favorite_add(species_id):
-    touch_visit()
-    reset_weekly_counts_if_needed()
-    if not is_logged_in():
+    if not g.logged_in:
         return redirect(url_for("login"))
 
-    if species_id in SPECIES_BY_ID:
-        username = current_user()
-        favs = user_favorites(username)
-        if species_id not in favs:
-            favs.append(species_id)
-            set_user_favorites(username, favs)
+    if species_id in CATALOG.by_id and FAVORITES.add(g.user, species_id):
+        save_user_favorites(g.user)
 
     return redirect(url_for("species_detail", species_id=species_id))
 
 
 @app.route("/favorite_remove/<species_id>", methods=["POST"])
 def favorite_remove(species_id):
-    touch_visit()
-    reset_weekly_counts_if_needed()
-    if not is_logged_in():
+    if not g.logged_in:
         return redirect(url_for("login"))
 
-    username = current_user()
-    favs = user_favorites(username)
-    favs = [x for x in favs if x != species_id]
-    set_user_favorites(username, favs)
+    if FAVORITES.remove(g.user, species_id):
+        save_user_favorites(g.user)
 
     return redirect(url_for("favorites"))
 
 
 @app.route("/favorites")
 def favorites():
-    touch_visit()
-    reset_weekly_counts_if_needed()
-
-    favs = user_favorites(current_user()) if is_logged_in() else []
-    fav_species = [SPECIES_BY_ID[sid] for sid in favs if sid in SPECIES_BY_ID]
+    by_id = CATALOG.by_id
+    fav_species = [by_id[sid] for sid in g.favorites if sid in by_id]
 
     return render_template(
         "favorites.html",
@@ -959,87 +1008,281 @@ def favorites():
 
 @app.route("/bbs", methods=["GET", "POST"])
 def bbs():
-    touch_visit()
-    reset_weekly_counts_if_needed()
-
     if request.method == "POST":
-        if not is_logged_in():
+        if not g.logged_in:
             return redirect(url_for("login"))
 
         text = request.form.get("message", "").strip()
         if text:
             ts = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            BBS_MESSAGES.append({"user": current_user(), "text": text, "ts": ts})
-            append_bbs_message({"ts": ts, "user": current_user(), "text": text})
+            STORAGE.append_bbs_message({"ts": ts, "user": g.user, "text": text})
         # POST後はredirect（リロード多重投稿を防ぐ）
         return redirect(url_for("bbs"))
 
-    # 最新が上になるよう表示
-    msgs = list(reversed(BBS_MESSAGES[-50:]))
+    # 最新が上になるよう表示（1ページ目はメモリ上の最新分から）
+    try:
+        page = max(1, int(request.args.get("page", 1)))
+    except ValueError:
+        page = 1
+    total = STORAGE.bbs_count()
+    pages = max(1, (total + BBS_PAGE_SIZE - 1) // BBS_PAGE_SIZE)
+    if page == 1:
+        msgs = recent_bbs_messages(total)
+    else:
+        msgs = STORAGE.bbs_page(page, BBS_PAGE_SIZE)
     return render_template(
         "bbs.html",
         messages=msgs,
+        page=page,
+        pages=pages,
+        total=total,
+        page_size=BBS_PAGE_SIZE,
         **common_context(),
     )
 
 
+# 談話室の新着配信（Server-Sent Events）。
+# 接続を張りっぱなしにするとワーカのスレッドを1本ずつ占有してしまうので、新着を送ったら
+# すぐに閉じ、ブラウザの EventSource に retry 後の再接続（Last-Event-ID 付き）を任せる。
+BBS_STREAM_RETRY_MS = 3000
+
+
+def sse_event(data=None, event_id=None, event=None, retry=None):
+    lines = []
+    if retry is not None:
+        lines.append(f"retry: {retry}")
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event is not None:
+        lines.append(f"event: {event}")
+    if data is not None:
+        lines.append("data: " + json.dumps(data, ensure_ascii=False))
+    return "\n".join(lines) + "\n\n"
+
+
+@app.route("/bbs/stream")
+def bbs_stream():
+    """Last-Event-ID（投稿の通し番号）より後の投稿だけを送って閉じる"""
+    total = STORAGE.bbs_count()
+    last = request.headers.get("Last-Event-ID") or request.args.get("after", "")
+    try:
+        last = int(last)
+    except ValueError:
+        last = None
+
+    chunks = [sse_event(retry=BBS_STREAM_RETRY_MS)]
+    if last is None or last > total:
+        # 初回接続：過去の投稿は送らず、現在の位置だけを伝える
+        chunks.append(sse_event(event_id=total, event="hello", data={"total": total}))
+    elif total > last:
+        # 新しい順に並んだ最新分から、未送信のものを古い順に送る（最大 BBS_PAGE_SIZE 件）
+        recent = recent_bbs_messages(total)
+        new = min(total - last, len(recent))
+        for i in range(new - 1, -1, -1):
+            chunks.append(sse_event(recent[i], event_id=total - i, event="message"))
+
+    resp = app.response_class("".join(chunks), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+
 @app.route('/stats')
 def stats():
     """サイト内の簡易統計（加点要素：追加ルート + 2変数以上渡し）"""
-    touch_visit()
-    reset_weekly_counts_if_needed()
-
-    top10 = top_week_species(limit=10)
-    total_searches = sum(SEARCH_COUNTS.values())
-    bbs_total = len(BBS_MESSAGES)
+    rankings = [
+        (label, top_searched_species(limit=10, hours=SEARCH_WINDOWS[key]))
+        for key, label in (("day", "直近24時間"), ("week", "直近7日間"), ("month", "直近30日間"))
+    ]
+    total_searches = sum(search_counts().values())
+    bbs_total = STORAGE.bbs_count()
     now_str = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-    chart_available = (plt is not None)
+    chart_available = SEARCH_CHART is not None
 
     return render_template(
         'stats.html',
-        top10=top10,
+        rankings=rankings,
+        top10=rankings[1][1],
+        trending=trending_species(limit=10),
+        top_favorited=top_favorited_species(limit=10),
         total_searches=total_searches,
         bbs_total=bbs_total,
+        unsaved_changes=COUNTER_WRITER.pending + USER_WRITER.pending,
         now_str=now_str,
         chart_available=chart_available,
+        route_timings=ROUTE_TIMINGS.snapshot(),
         **common_context(),
     )
 
 
-@app.route('/stats/search_chart.png')
-def stats_search_chart():
-    """今週の検索回数トップをグラフPNGで返す（matplotlib が無い場合は 404）"""
-    if plt is None:
-        abort(404)
+def search_chart_version():
+    # 過ぎた時間の分は時かリングの中身が変わるまで同じで、今の1時間の分は増える一方なので、
+    # 合計が変われば中身も変わっている
+    return (search_stats.hour_of(), SEARCH_HISTORY.ring.version,
+            sum(current_search_counts().values()), CATALOG.version)
 
-    top10 = top_week_species(limit=10)
-    if not top10:
-        abort(404)
+
+def render_search_chart(top10, fmt):
+    """直近7日間の検索回数トップの棒グラフを描き、画像のバイト列を返す
+
+    pyplot の状態を使わず Figure を直接作るので、バックグラウンドのスレッドからも描ける。
+    SVG は文字をパスに変換せずテキストのまま埋め込む（小さく速い・ブラウザのフォントで表示）。
+    """
+    Figure = charts.load_figure(
+        font_dir=os.path.join(app.root_path, "static", "fonts"),
+        font_cache=os.path.join(DATA_DIR, "chart_font.json"),
+    )
+    import matplotlib
 
     labels = [s['jp'] for s in top10]
     values = [s.get('count', 0) for s in top10]
 
-    fig = plt.figure(figsize=(9, 4.5))
+    fig = Figure(figsize=(9, 4.5))
     ax = fig.add_subplot(111)
     ax.bar(range(len(values)), values)
     ax.set_xticks(range(len(labels)))
     ax.set_xticklabels(labels, rotation=45, ha='right')
     ax.set_ylabel('回')
-    ax.set_title('今週の検索回数トップ（上位10）')
+    ax.set_title('直近7日間の検索回数トップ（上位10）')
     fig.tight_layout()
 
     buf = BytesIO()
-    fig.savefig(buf, format='png')
-    plt.close(fig)
-    buf.seek(0)
-    return send_file(buf, mimetype='image/png')
+    if fmt == 'svg':
+        with matplotlib.rc_context({'svg.fonttype': 'none', 'svg.hashsalt': 'search-chart'}):
+            fig.savefig(buf, format='svg')
+    else:
+        fig.savefig(buf, format='png')
+    return buf.getvalue()
+
+
+def timed_search_chart(top10, fmt):
+    with CHART_SECONDS.time(fmt):
+        return render_search_chart(top10, fmt)
+
+
+# 検索回数が変わるたびに描くのではなく、描いた画像を search_chart_version() の値ごとに持っておく
+SEARCH_CHART = ChartCache(
+    search_chart_version,
+    lambda: top_searched_species(limit=10),
+    timed_search_chart,
+    name="search-chart",
+) if charts.matplotlib_installed() else None
+
+
+@app.route('/stats/search_chart.<fmt>')
+def stats_search_chart(fmt):
+    """直近7日間の検索回数トップのグラフ（png / svg）を返す（matplotlib が無い場合は 404）"""
+    if SEARCH_CHART is None or fmt not in CHART_MIMETYPES:
+        abort(404)
+
+    img = SEARCH_CHART.get(fmt)
+    if img.body is None:
+        abort(404)
+
+    if etag_matches(img.etag):
+        resp = app.response_class(status=304)
+    else:
+        resp = app.response_class(img.body, mimetype=CHART_MIMETYPES[fmt])
+    resp.set_etag(img.etag)
+    # 少しの間はそのまま使わせ、その後は ETag で確かめさせる（変わっていなければ 304）
+    resp.headers["Cache-Control"] = "public, max-age=30"
+    return resp
+
+
 @app.route("/data")
 def data():
     """収録リスト（確認用）"""
-    touch_visit()
-    reset_weekly_counts_if_needed()
-    return render_template("data.html", species=SPECIES, **common_context())
+    cat = CATALOG
+    return conditional_page(cat, page_etag(cat, "data"), lambda: stream_page(
+        "data.html",
+        table_html=species_table(cat),
+        **common_context(),
+    ))
+
+
+# ---- /metrics ----
+# METRICS_TOKEN を設定した場合は Authorization: Bearer <トークン> が必要
+app.config["METRICS_TOKEN"] = os.environ.get("METRICS_TOKEN", "")
+CACHES = {"search": SEARCH_CACHE, "fragment": FRAGMENT_CACHE}
+
+METRICS.gauge("cetacean_users", "登録ユーザー数（USERS）", lambda: len(USERS))
+METRICS.gauge("cetacean_bbs_messages_in_memory", "メモリ上の談話室の投稿数（BBS_MESSAGES）", lambda: len(BBS_MESSAGES))
+METRICS.gauge("cetacean_bbs_messages", "談話室の投稿の総数（最後に確かめた時点）", lambda: BBS_SEEN_TOTAL)
+METRICS.gauge("cetacean_search_count_keys", "直近7日間に検索された種の数（検索回数の表の大きさ）", lambda: len(search_counts()))
+METRICS.gauge("cetacean_catalog_species", "カタログの種の数", lambda: len(CATALOG.species))
+METRICS.gauge("cetacean_pending_writes", "まだ保存していない変更の数", lambda: {
+    ("counters",): COUNTER_WRITER.pending,
+    ("users",): USER_WRITER.pending,
+}, ("writer",))
+METRICS.gauge("cetacean_cache_entries", "キャッシュの件数", lambda: {
+    (name,): len(c) for name, c in CACHES.items()
+}, ("cache",))
+METRICS.gauge("cetacean_cache_hits_total", "キャッシュの命中数", lambda: {
+    (name,): c.hits for name, c in CACHES.items()
+}, ("cache",), kind="counter")
+METRICS.gauge("cetacean_cache_misses_total", "キャッシュの外れ数", lambda: {
+    (name,): c.misses for name, c in CACHES.items()
+}, ("cache",), kind="counter")
+METRICS.gauge("cetacean_cache_hit_ratio", "キャッシュの命中率（起動から）", lambda: {
+    (name,): c.stats()["hit_ratio"] for name, c in CACHES.items()
+}, ("cache",))
+METRICS.gauge("cetacean_login_throttled_total", "ログインの失敗が多すぎて断った回数",
+              lambda: LOGIN_THROTTLE.rejected, kind="counter")
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    token = app.config["METRICS_TOKEN"]
+    if token and not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        abort(401)
+    resp = app.response_class(METRICS.render(), mimetype="text/plain")
+    resp.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
+
+
+# ---- 管理用：プロファイルの一覧 ----
+def admin_allowed():
+    """ADMIN_USERS のユーザーでログインしているか、X-Profile に PROFILE_SECRET が付いていれば True"""
+    return (g.logged_in and g.user in app.config["ADMIN_USERS"]) or profile_secret_given()
+
+
+@app.route("/admin/profiles")
+def admin_profiles():
+    if not app.config["PROFILING"]:
+        abort(404)
+    if not admin_allowed():
+        abort(403)
+    return render_template(
+        "admin_profiles.html",
+        profiles=PROFILES.recent(limit=100),
+        sample_rate=app.config["PROFILE_SAMPLE_RATE"],
+        keep=PROFILES.keep,
+        **common_context(),
+    )
+
+
+@app.route("/admin/profiles/<profile_id>")
+def admin_profile(profile_id):
+    """プロファイルの本体をダウンロードする（?view=1 なら要約をテキストで表示）"""
+    if not app.config["PROFILING"]:
+        abort(404)
+    if not admin_allowed():
+        abort(403)
+    meta = PROFILES.get(profile_id)
+    if meta is None:
+        abort(404)
+    if not request.args.get("view"):
+        return send_from_directory(PROFILES.directory, meta["file"], as_attachment=True)
+    if meta["kind"] == "cprofile":
+        out = StringIO()
+        stats = pstats.Stats(PROFILES.path(profile_id, "cprofile"), stream=out)
+        stats.sort_stats("cumulative").print_stats(40)
+        text = out.getvalue()
+    else:
+        with open(PROFILES.path(profile_id, "sampled"), encoding="utf-8") as f:
+            text = f.read()
+    return app.response_class(text, mimetype="text/plain")
 
 
 if __name__ == "__main__":
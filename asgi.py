@@ -0,0 +1,276 @@
+# 鯨類まとめサイト - ASGI で動かすための入口
+#
+#   python asgi.py [--host 127.0.0.1] [--port 8000] [--threads N]    # uvicorn で起動
+#   uvicorn asgi:application --workers 4                             # 複数ワーカ
+#
+# 接続の受け付け・送受信はイベントループ（1スレッド）が行い、Flask の処理（テンプレートの
+# 描画・保存先への読み書き）は上限つきのスレッドプール（ASGI_THREADS 本）で実行する。
+# 遅いディスク書き込みがあっても、待たされるのはプールの1本だけで、他の接続の受け付けや
+# 送信は止まらない。
+#
+# 談話室の新着配信（/bbs/stream）だけはイベントループ上で直接扱い、接続を張ったまま
+# 新着を送り続ける（同期モードのように再接続を繰り返さず、待機中の購読者はスレッドを使わない）。
+# 保存先の件数の確認は全購読者で1つのタスクが行う。
+
+import asyncio
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import app as flask_app
+
+# 描画は GIL を握るので、コア数より大幅に多くしてもイベントループの手が回らなくなるだけ
+# （既定は ThreadPoolExecutor と同じ「コア数 + 4、最大 32」）
+ASGI_THREADS = int(os.environ.get("ASGI_THREADS", min(32, (os.cpu_count() or 1) + 4)))
+# 新着の確認間隔（秒）と、接続を保つためのコメント行を送る間隔（秒）
+BBS_POLL_INTERVAL = 0.5
+BBS_KEEPALIVE = 15.0
+
+
+class WSGIBridge:
+    """WSGI アプリ（Flask）をスレッドプールで実行し、ASGI の応答として返す
+
+    応答の本文は WSGI アプリが出した塊ごとに送る（ストリーミングのページもそのまま流れる）。
+    送信が終わるまで次の塊を作らないので、遅いクライアントがいてもメモリに溜め込まない。
+    """
+
+    def __init__(self, wsgi_app, executor):
+        self.wsgi_app = wsgi_app
+        self.executor = executor
+
+    async def __call__(self, scope, receive, send):
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self._run, loop, scope, bytes(body), send)
+
+    def _run(self, loop, scope, body, send):
+        """プールのスレッドで実行する"""
+        def call(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and started:
+                raise exc_info[1].with_traceback(exc_info[2])
+            started[:] = [{
+                "type": "http.response.start",
+                "status": int(status.split(" ", 1)[0]),
+                "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers],
+            }]
+
+        result = self.wsgi_app(environ(scope, body), start_response)
+        try:
+            sent_start = False
+            for chunk in result:
+                if not chunk:
+                    continue
+                if not sent_start:
+                    call(started[0])
+                    sent_start = True
+                call({"type": "http.response.body", "body": chunk, "more_body": True})
+            if not sent_start:
+                call(started[0])
+            call({"type": "http.response.body", "body": b""})
+        finally:
+            # Flask はここで後片付け（teardown_request など）を行う
+            close = getattr(result, "close", None)
+            if close is not None:
+                close()
+
+
+def environ(scope, body):
+    """ASGI の scope から WSGI の environ を作る"""
+    import io
+
+    server = scope.get("server") or ("localhost", 80)
+    env = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_TYPE":
+            env["CONTENT_TYPE"] = value
+        elif name != "CONTENT_LENGTH":
+            key = "HTTP_" + name
+            env[key] = env[key] + "," + value if key in env else value
+    return env
+
+
+class BBSFeed:
+    """談話室の新着を購読者全員に配る（保存先の件数は1つのタスクだけが確かめる）"""
+
+    def __init__(self, executor):
+        self.executor = executor
+        self.total = None
+        self.recent = []  # 新しい順（app.recent_bbs_messages と同じ）
+        self._changed = None
+        self._started = None
+        self._task = None
+
+    async def start(self):
+        """最初の購読者が来たときに件数を読み、確認のタスクを始める（同時に来ても1回だけ）"""
+        if self._started is None:
+            self._started = asyncio.ensure_future(self._start())
+        await self._started
+
+    async def _start(self):
+        loop = asyncio.get_running_loop()
+        self.total = await loop.run_in_executor(self.executor, flask_app.STORAGE.bbs_count)
+        self.recent = await loop.run_in_executor(self.executor, flask_app.recent_bbs_messages, self.total)
+        self._changed = asyncio.Condition()
+        self._task = asyncio.create_task(self._poll())
+
+    async def _poll(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(BBS_POLL_INTERVAL)
+            try:
+                total = await loop.run_in_executor(self.executor, flask_app.STORAGE.bbs_count)
+                if total != self.total:
+                    self.recent = await loop.run_in_executor(
+                        self.executor, flask_app.recent_bbs_messages, total
+                    )
+                    self.total = total
+                    async with self._changed:
+                        self._changed.notify_all()
+            except Exception:
+                flask_app.app.logger.exception("談話室の新着を確認できませんでした")
+
+    async def wait(self, timeout):
+        """新着があるか timeout 秒たつまで待つ"""
+        async with self._changed:
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def since(self, last):
+        """通し番号 last より後の投稿を古い順に [(番号, 投稿), ...] で返す（最大で最新ページ分）"""
+        total, recent = self.total, self.recent
+        new = min(total - last, len(recent))
+        return [(total - i, recent[i]) for i in range(new - 1, -1, -1)]
+
+
+async def bbs_stream(scope, receive, send, feed):
+    """/bbs/stream を接続したまま配信する（送るイベントは同期モードと同じ）"""
+    await feed.start()
+    headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+    last = headers.get("last-event-id") or parse_qs(scope["query_string"].decode("latin-1")).get("after", [""])[0]
+    try:
+        last = int(last)
+    except ValueError:
+        last = None
+
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"text/event-stream; charset=utf-8"), (b"cache-control", b"no-cache")],
+    })
+    first = flask_app.sse_event(retry=flask_app.BBS_STREAM_RETRY_MS)
+    if last is None or last > feed.total:
+        last = feed.total
+        first += flask_app.sse_event(event_id=last, event="hello", data={"total": last})
+    await send({"type": "http.response.body", "body": first.encode("utf-8"), "more_body": True})
+
+    async def pump(last):
+        while True:
+            if feed.total > last:
+                chunks = []
+                for event_id, msg in feed.since(last):
+                    chunks.append(flask_app.sse_event(msg, event_id=event_id, event="message"))
+                last = feed.total
+                body = "".join(chunks)
+            else:
+                await feed.wait(BBS_KEEPALIVE)
+                if feed.total > last:
+                    continue
+                body = ": keepalive\n\n"
+            await send({"type": "http.response.body", "body": body.encode("utf-8"), "more_body": True})
+
+    async def watch():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    # 切断されたら（待機中でも）すぐに送信をやめる
+    tasks = {asyncio.create_task(pump(last)), asyncio.create_task(watch())}
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+    for task in done:
+        exc = None if task.cancelled() else task.exception()
+        # OSError は送信中に切断されただけ
+        if exc is not None and not isinstance(exc, OSError):
+            raise exc
+
+
+def create_app(threads=ASGI_THREADS):
+    executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="asgi")
+    bridge = WSGIBridge(flask_app.app.wsgi_app, executor)
+    # 新着の確認はページの処理の順番待ちに並ばないよう、専用のスレッドで行う
+    feed = BBSFeed(ThreadPoolExecutor(max_workers=1, thread_name_prefix="asgi-bbs"))
+
+    async def application(scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    # 溜まっている保存処理を書き出してから終わる
+                    await asyncio.get_running_loop().run_in_executor(executor, flask_app.USER_WRITER.drain)
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        if scope["type"] != "http":
+            return
+        if scope["path"] == "/bbs/stream":
+            await bbs_stream(scope, receive, send, feed)
+        else:
+            await bridge(scope, receive, send)
+
+    return application
+
+
+application = create_app()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit("ASGI モードには uvicorn が必要です：pip install uvicorn")
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8000)
+    ap.add_argument("--threads", type=int, default=ASGI_THREADS, help="Flask の処理を実行するスレッド数")
+    args = ap.parse_args()
+    uvicorn.run(create_app(args.threads), host=args.host, port=args.port)
@@ -0,0 +1,135 @@
+# 鯨類まとめサイト - 静的ファイルのビルド（内容ハッシュ付きの名前・事前圧縮）
+#
+# static/ 以下のファイルを、内容のハッシュを名前に含めたコピーとして static/dist/ に書き出し、
+# 圧縮の効く種類は .gz（brotli モジュールがあれば .br も）を作っておく。
+# 名前が内容で決まるので、ブラウザには「変わらない」（immutable）として長期間キャッシュさせられる。
+# 対応表は static/dist/manifest.json。原本の方が新しければ起動時に作り直す。
+#
+#   python assets.py   # 手動でビルドだけ行う
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, "static")
+DIST_DIR = os.path.join(STATIC_DIR, "dist")
+MANIFEST_FILE = os.path.join(DIST_DIR, "manifest.json")
+
+MANIFEST_VERSION = 1
+# 事前圧縮する拡張子（画像・フォントは既に圧縮済みなので対象外）
+COMPRESSIBLE = {".css", ".js", ".svg", ".json", ".txt", ".html"}
+# 優先する順（Accept-Encoding で両方を受け付けるなら br を返す）
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+log = logging.getLogger(__name__)
+
+
+def _sources(static_dir):
+    """static/ 以下の原本（dist/ を除く）を相対パス（/ 区切り）で返す"""
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != os.path.join(static_dir, "dist"))
+        for name in sorted(files):
+            if name.startswith("."):
+                continue
+            path = os.path.join(root, name)
+            yield os.path.relpath(path, static_dir).replace(os.sep, "/"), path
+
+
+def _write(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def build(static_dir=STATIC_DIR, dist_dir=DIST_DIR):
+    """ハッシュ付きのコピーと圧縮版を書き出し、対応表を返す"""
+    files = {}
+    for name, path in _sources(static_dir):
+        with open(path, "rb") as f:
+            data = f.read()
+        stem, ext = os.path.splitext(name)
+        hashed = f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+        out = os.path.join(dist_dir, *hashed.split("/"))
+        os.makedirs(os.path.dirname(out), exist_ok=True)
+        encodings = []
+        if not os.path.exists(out):
+            _write(out, data)
+        if ext in COMPRESSIBLE:
+            # mtime=0 にして、同じ内容からは同じ .gz ができるようにする
+            gz = gzip.compress(data, compresslevel=9, mtime=0)
+            if len(gz) < len(data):
+                _write(out + ".gz", gz)
+                encodings.append("gzip")
+            if brotli is not None:
+                br = brotli.compress(data, quality=11)
+                if len(br) < len(data):
+                    _write(out + ".br", br)
+                    encodings.append("br")
+        files[name] = {
+            "path": hashed,
+            "mtime_ns": os.stat(path).st_mtime_ns,
+            "encodings": encodings,
+        }
+    manifest = {"version": MANIFEST_VERSION, "files": files}
+    os.makedirs(dist_dir, exist_ok=True)
+    _write(os.path.join(dist_dir, "manifest.json"),
+           json.dumps(manifest, ensure_ascii=False, indent=1).encode("utf-8"))
+    return manifest
+
+
+def load_manifest(dist_dir=DIST_DIR):
+    try:
+        with open(os.path.join(dist_dir, "manifest.json"), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def _stale(manifest, static_dir):
+    """原本の追加・削除・更新があれば True"""
+    files = manifest["files"]
+    seen = 0
+    for name, path in _sources(static_dir):
+        entry = files.get(name)
+        if entry is None or os.stat(path).st_mtime_ns != entry["mtime_ns"]:
+            return True
+        seen += 1
+    return seen != len(files)
+
+
+def ensure_built(static_dir=STATIC_DIR, dist_dir=DIST_DIR):
+    """対応表が無いか古ければビルドし直し、対応表を返す"""
+    manifest = load_manifest(dist_dir)
+    if manifest is None or _stale(manifest, static_dir):
+        try:
+            manifest = build(static_dir, dist_dir)
+        except OSError:
+            # 書き込めない環境では、ハッシュ無しの通常の static 配信で動かす
+            log.exception("静的ファイルをビルドできませんでした")
+            return None
+    return manifest
+
+
+def pick_encoding(entry, accept_encodings):
+    """Accept-Encoding で受け付けられる事前圧縮版を選ぶ（(Content-Encoding, 拡張子) か None）"""
+    for encoding, suffix in ENCODINGS:
+        if encoding in entry["encodings"] and accept_encodings[encoding]:
+            return encoding, suffix
+    return None
+
+
+if __name__ == "__main__":
+    m = build()
+    print(f"{len(m['files'])} 個のファイルを {DIST_DIR} に書き出しました。")
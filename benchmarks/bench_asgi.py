@@ -0,0 +1,218 @@
+"""同期モード（werkzeug のスレッド）と ASGI モード（uvicorn + asgi.py）の負荷比較
+
+    python benchmarks/bench_asgi.py [--clients 32] [--subscribers 200] [--seconds 5]
+
+一時ディレクトリのデータでサーバを別プロセスとして起動し、次の負荷を同時にかける。
+  clients     … ページ（トップ・種の詳細・収録一覧・談話室）を取得し続けるクライアント
+  subscribers … 談話室の新着配信（/bbs/stream）を購読し続けるクライアント
+  posts       … 0.2 秒ごとに談話室へ投稿（保存先に直接追記。サーバはほかのワーカの投稿と同じく件数の変化で気づく）
+ページの処理件数・応答時間（p50/p95）、サーバのスレッド数の最大値、
+新着が購読者に届くまでの時間（中央値・p95）を表示する。
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SYNC_SERVER = (
+    "import logging, sys; import app; from werkzeug.serving import run_simple; "
+    "logging.getLogger('werkzeug').setLevel(logging.ERROR); "
+    "run_simple('127.0.0.1', int(sys.argv[1]), app.app, threaded=True)"
+)
+MODES = {
+    "sync": lambda port, threads: [sys.executable, "-c", SYNC_SERVER, str(port)],
+    "asgi": lambda port, threads: [sys.executable, os.path.join(ROOT, "asgi.py"), "--port", str(port)]
+    + (["--threads", str(threads)] if threads else []),
+}
+POST_INTERVAL = 0.2
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_ready(port, proc, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("サーバが起動できませんでした")
+        try:
+            get(port, "/")
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("サーバの起動を待ちきれませんでした")
+
+
+def get(port, url):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    try:
+        conn.request("GET", url)
+        resp = conn.getresponse()
+        resp.read()
+        return resp.status
+    finally:
+        conn.close()
+
+
+def thread_count(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("Threads:"):
+                return int(line.split()[1])
+    return 0
+
+
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def page_client(port, urls, stop, latencies, errors):
+    for url in urls:
+        if stop.is_set():
+            return
+        start = time.perf_counter()
+        try:
+            if get(port, url) != 200:
+                errors.append(url)
+                continue
+        except OSError:
+            errors.append(url)
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+def subscriber(port, stop, delays, retry):
+    """EventSource と同じく、切れたら retry 秒後に Last-Event-ID を付けて繋ぎ直す"""
+    last = None
+    while not stop.is_set():
+        try:
+            sock = socket.create_connection(("127.0.0.1", port), timeout=1)
+        except OSError:
+            time.sleep(retry)
+            continue
+        header = f"Last-Event-ID: {last}\r\n" if last is not None else ""
+        sock.sendall(f"GET /bbs/stream HTTP/1.1\r\nHost: localhost\r\n{header}Connection: close\r\n\r\n".encode())
+        buf = b""
+        try:
+            while not stop.is_set():
+                try:
+                    data = sock.recv(65536)
+                except socket.timeout:
+                    continue
+                if not data:
+                    break
+                buf += data
+                while b"\n\n" in buf:
+                    event, buf = buf.split(b"\n\n", 1)
+                    for line in event.decode("utf-8", "replace").splitlines():
+                        if line.startswith("id: "):
+                            last = int(line[4:])
+                        elif line.startswith("data: "):
+                            msg = json.loads(line[6:])
+                            if isinstance(msg, dict) and "text" in msg:
+                                delays.append(time.time() - float(msg["text"]))
+        except OSError:
+            pass
+        finally:
+            sock.close()
+        stop.wait(retry)
+
+
+def poster(storage, stop):
+    while not stop.wait(POST_INTERVAL):
+        storage.append_bbs_message({"ts": time.strftime("%Y-%m-%d %H:%M:%S"), "user": "bench", "text": repr(time.time())})
+
+
+def run(mode, args, data_dir, species_ids):
+    from storage import open_storage
+
+    port = free_port()
+    env = dict(os.environ, DATA_DIR=data_dir)
+    proc = subprocess.Popen(MODES[mode](port, args.threads), cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_ready(port, proc)
+        urls = ["/", "/data", "/bbs"] + [f"/species/{sid}" for sid in species_ids]
+        stop = threading.Event()
+        latencies, errors, delays = [], [], []
+        threads = [threading.Thread(target=subscriber, args=(port, stop, delays, args.retry), daemon=True)
+                   for _ in range(args.subscribers)]
+        threads += [threading.Thread(target=page_client,
+                                     args=(port, itertools.cycle(urls[i:] + urls[:i]), stop, latencies, errors),
+                                     daemon=True)
+                    for i in range(args.clients)]
+        threads.append(threading.Thread(target=poster, args=(open_storage("file", data_dir), stop), daemon=True))
+        for t in threads:
+            t.start()
+        peak_threads = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < args.seconds:
+            peak_threads = max(peak_threads, thread_count(proc.pid))
+            time.sleep(0.1)
+        elapsed = time.perf_counter() - start
+        stop.set()
+        for t in threads:
+            t.join(timeout=5)
+        return {
+            "rps": len(latencies) / elapsed,
+            "p50": percentile(latencies, 0.5) * 1000,
+            "p95": percentile(latencies, 0.95) * 1000,
+            "errors": len(errors),
+            "threads": peak_threads,
+            "delivered": len(delays),
+            "delay50": percentile(delays, 0.5) * 1000,
+            "delay95": percentile(delays, 0.95) * 1000,
+        }
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--clients", type=int, default=32, help="ページを取得し続けるクライアント数")
+    ap.add_argument("--subscribers", type=int, default=200, help="新着配信を購読するクライアント数")
+    ap.add_argument("--seconds", type=float, default=5.0)
+    ap.add_argument("--threads", type=int, help="ASGI モードのスレッドプールの大きさ（既定は asgi.py の既定）")
+    ap.add_argument("--retry", type=float, default=3.0, help="購読が切れてから繋ぎ直すまでの秒数")
+    args = ap.parse_args()
+
+    try:
+        import uvicorn  # noqa: F401
+    except ImportError:
+        sys.exit("ASGI モードの計測には uvicorn が必要です：pip install uvicorn")
+    from catalog import load_source
+
+    species_ids = [s["id"] for s in load_source()][:20]
+    print(f"clients={args.clients} subscribers={args.subscribers} {args.seconds:.0f}s")
+    print(f"{'mode':<6} {'req/s':>8} {'p50':>8} {'p95':>8} {'err':>5} {'threads':>8}"
+          f" {'delivered':>10} {'delay p50':>10} {'delay p95':>10}")
+    for mode in MODES:
+        tmp = tempfile.mkdtemp()
+        try:
+            r = run(mode, args, tmp, species_ids)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        print(f"{mode:<6} {r['rps']:>8.0f} {r['p50']:>6.1f}ms {r['p95']:>6.1f}ms {r['errors']:>5}"
+              f" {r['threads']:>8} {r['delivered']:>10} {r['delay50']:>8.0f}ms {r['delay95']:>8.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
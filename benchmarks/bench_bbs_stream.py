@@ -0,0 +1,113 @@
+"""談話室の新着配信（/bbs/stream）に同時に何人の購読者がつながっていられるかの計測
+
+    python benchmarks/bench_bbs_stream.py [--subscribers 200 1000 3000] [--retry-ms 3000]
+
+一時ディレクトリのデータで実サーバ（werkzeug、スレッド方式）を起動し、EventSource と同じ
+「受け取ったら切断 → retry 後に Last-Event-ID 付きで再接続」を行う購読者を asyncio で
+大量に動かす。投稿を流して、全員に届くまでの遅れとサーバのスレッド数を表示する。
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+async def subscriber(port, retry, last_id, received, stop):
+    # 実際のブラウザと同じく、接続のタイミングは人ごとにばらける
+    await asyncio.sleep(random.random() * retry)
+    while not stop.is_set():
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(
+                f"GET /bbs/stream HTTP/1.1\r\nHost: localhost\r\nLast-Event-ID: {last_id}\r\n"
+                "Connection: close\r\n\r\n".encode()
+            )
+            data = await reader.read()
+            writer.close()
+        except OSError:
+            await asyncio.sleep(retry)
+            continue
+        now = time.perf_counter()
+        for line in data.decode("utf-8", "replace").splitlines():
+            if line.startswith("id: "):
+                last_id = int(line[4:])
+                received.setdefault(last_id, []).append(now)
+        await asyncio.sleep(retry)
+
+
+async def run_level(port, storage, n, retry, posts):
+    stop = asyncio.Event()
+    received = {}
+    start_id = storage.bbs_count()
+    tasks = [
+        asyncio.create_task(subscriber(port, retry, start_id, received, stop))
+        for _ in range(n)
+    ]
+    await asyncio.sleep(retry * 1.5)  # 全員が一巡するのを待つ
+    sent = {}
+    peak_threads = threading.active_count()
+    for i in range(posts):
+        storage.append_bbs_message({"ts": time.strftime("%Y-%m-%d %H:%M:%S"), "user": "bench", "text": f"post {i}"})
+        sent[start_id + i + 1] = time.perf_counter()
+        for _ in range(int(retry * 10)):
+            await asyncio.sleep(0.1)
+            peak_threads = max(peak_threads, threading.active_count())
+    await asyncio.sleep(retry * 2)
+    stop.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    lags = []
+    delivered = 0
+    for mid, t_sent in sent.items():
+        got = received.get(mid, [])
+        delivered += len(got)
+        lags.extend(t - t_sent for t in got)
+    lags.sort()
+    p50 = lags[len(lags) // 2] if lags else float("nan")
+    p95 = lags[int(len(lags) * 0.95)] if lags else float("nan")
+    ratio = delivered / (n * posts)
+    print(f"{n:>7} {ratio:>9.1%} {p50:>9.2f} {p95:>9.2f} {peak_threads:>9}")
+    return ratio
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--subscribers", type=int, nargs="+", default=[200, 1000, 3000])
+    ap.add_argument("--retry-ms", type=int, default=None, help="既定はアプリの BBS_STREAM_RETRY_MS")
+    ap.add_argument("--posts", type=int, default=3)
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    shutil.copy(os.path.join(ROOT, "data", "bbs_messages.csv"), tmp)
+    os.environ["DATA_DIR"] = tmp
+    import app as app_module
+    from werkzeug.serving import make_server
+
+    retry_ms = args.retry_ms or app_module.BBS_STREAM_RETRY_MS
+    app_module.BBS_STREAM_RETRY_MS = retry_ms
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, app_module.app, threaded=True)
+    server.socket.listen(1024)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    print(f"retry={retry_ms} ms, posts per level={args.posts}")
+    print(f"{'subs':>7} {'delivered':>9} {'p50 lag':>9} {'p95 lag':>9} {'threads':>9}")
+    try:
+        for n in args.subscribers:
+            asyncio.run(run_level(server.port, app_module.STORAGE, n, retry_ms / 1000, args.posts))
+    finally:
+        server.shutdown()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""大きなページ（/data・幅広い検索）の配信の計測：まとめて送る場合とストリーミング＋gzip の比較
+
+    python benchmarks/bench_html.py [--scale 50] [--requests 20]
+
+data/species.json の種を N 倍に水増ししたカタログに差し替え、次の2通りで同じページを取得する。
+  buffered … ページ全体を組み立ててから非圧縮で送る（STREAM_PAGES=0, COMPRESS_LEVEL=0）
+  streamed … 描画しながら塊ごとに gzip で送る（既定の設定）
+1リクエストあたりのメモリ確保のピーク（tracemalloc）と、実サーバに対する
+最初の1バイトまでの時間（TTFB）・全体の時間・転送量（中央値）を表示する。
+"""
+import argparse
+import logging
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MODES = {
+    "buffered": {"STREAM_PAGES": False, "COMPRESS_LEVEL": 0},
+    "streamed": {"STREAM_PAGES": True, "COMPRESS_LEVEL": 6},
+}
+
+
+def scaled_species(load_source, scale):
+    out = []
+    for i in range(scale):
+        for s in load_source():
+            s = dict(s)
+            s["id"] = f"{s['id']}_{i}"
+            if i:
+                s["sci"] = f"{s['sci']} var{i}"
+            out.append(s)
+    return out
+
+
+def peak_memory(client, url):
+    """1リクエスト（本文を最後まで読む）の間に確保されたメモリのピーク（バイト）"""
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        resp = client.get(url, headers={"Accept-Encoding": "gzip"}, buffered=False)
+        for _ in resp.response:
+            pass
+        resp.close()
+        return tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+
+
+def fetch(port, url):
+    """(TTFB 秒, 全体の秒, 受信バイト数)"""
+    sock = socket.create_connection(("127.0.0.1", port))
+    start = time.perf_counter()
+    sock.sendall(
+        f"GET {url} HTTP/1.1\r\nHost: localhost\r\nAccept-Encoding: gzip\r\nConnection: close\r\n\r\n".encode()
+    )
+    first = None
+    total = 0
+    while True:
+        data = sock.recv(65536)
+        if not data:
+            break
+        if first is None:
+            first = time.perf_counter()
+        total += len(data)
+    end = time.perf_counter()
+    sock.close()
+    return first - start, end - start, total
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--scale", type=int, default=50)
+    ap.add_argument("--requests", type=int, default=20, help="ページ・方式ごとの取得回数")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ["DATA_DIR"] = tmp
+    import app as app_module
+    from catalog import Catalog, load_source
+    from werkzeug.serving import make_server
+
+    species = scaled_species(load_source, args.scale)
+    # 版数を進めておく（部品・検索のキャッシュは版数ごとなので、元のカタログの分と混ざらない）
+    app_module.CATALOG = Catalog(species, version=app_module.CATALOG.version + 1)
+    urls = ["/data", "/search?q=whale", "/search?q=dolphin&mode=text"]
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = app_module.app.test_client()
+
+    print(f"{len(species)} 種, 各 {args.requests} 回の中央値")
+    print(f"{'page':<30} {'mode':<9} {'peak mem':>10} {'TTFB':>9} {'total':>9} {'bytes':>10}")
+    try:
+        for url in urls:
+            for mode, config in MODES.items():
+                app_module.app.config.update(config)
+                client.get(url)  # キャッシュを温めておく
+                mem = median([peak_memory(client, url) for _ in range(max(3, args.requests // 4))])
+                runs = [fetch(server.port, url) for _ in range(args.requests)]
+                print(f"{url:<30} {mode:<9} {mem / 1024:>8.0f}KB"
+                      f" {median([r[0] for r in runs]) * 1000:>7.1f}ms"
+                      f" {median([r[1] for r in runs]) * 1000:>7.1f}ms"
+                      f" {median([r[2] for r in runs]):>10}")
+    finally:
+        server.shutdown()
+        app_module.COUNTER_WRITER.close()  # 一時ディレクトリを消す前に書き出しておく
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""ログインの処理件数と、ログインが集中したときの検索（/search）の応答時間の計測
+
+    python benchmarks/bench_login.py [--logins 16] [--seconds 5] [--method scrypt]
+
+一時ディレクトリのデータでサーバ（werkzeug のスレッド）を起動し、ユーザーを登録したうえで
+  idle    … 検索だけ（基準）
+  inline  … ログインと同数のハッシュ用スレッド（リクエストのスレッドでその場で計算するのと同じ）
+  pool=N  … ハッシュ用スレッドを N 本に絞る（既定の設定）
+の各場合に、ログインし続けるクライアント（--logins 本）と検索し続けるクライアントを同時に走らせ、
+ログインの件数・断った件数（503）と、検索の応答時間（中央値・p95）を表示する。
+"""
+import argparse
+import http.client
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PASSWORD = "bench-password"
+
+
+def request(port, method, url, body=None):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    try:
+        headers = {"Content-Type": "application/x-www-form-urlencoded"} if body else {}
+        conn.request(method, url, body=body, headers=headers)
+        resp = conn.getresponse()
+        resp.read()
+        return resp.status
+    finally:
+        conn.close()
+
+
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def login_client(port, username, stop, results):
+    body = urlencode({"username": username, "password": PASSWORD})
+    while not stop.is_set():
+        results.append(request(port, "POST", "/login", body))
+
+
+def search_client(port, stop, latencies):
+    queries = ["/search?q=whale", "/search?q=dolphin", "/search?q=%E3%82%AF%E3%82%B8%E3%83%A9"]
+    i = 0
+    while not stop.is_set():
+        start = time.perf_counter()
+        request(port, "GET", queries[i % len(queries)])
+        latencies.append(time.perf_counter() - start)
+        i += 1
+
+
+def run(port, users, seconds):
+    stop = threading.Event()
+    statuses, latencies = [], []
+    threads = [threading.Thread(target=login_client, args=(port, u, stop, statuses)) for u in users]
+    threads.append(threading.Thread(target=search_client, args=(port, stop, latencies)))
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    return statuses, latencies
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--logins", type=int, default=16, help="同時にログインし続けるクライアント数")
+    ap.add_argument("--seconds", type=float, default=5.0, help="各場合の計測時間")
+    ap.add_argument("--method", default="scrypt", help="PASSWORD_HASH_METHOD")
+    ap.add_argument("--pools", type=int, nargs="+", default=[1, 2], help="比べるハッシュ用スレッド数")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ["DATA_DIR"] = tmp
+    os.environ["PASSWORD_HASH_METHOD"] = args.method
+    import app as app_module
+    from passwords import PasswordHasher
+    from werkzeug.serving import make_server
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.port
+
+    users = [f"bench{i}" for i in range(args.logins)]
+    for u in users:
+        body = urlencode({"username": u, "password": PASSWORD, "password2": PASSWORD})
+        assert request(port, "POST", "/register", body) == 302, u
+
+    cases = [("idle", None)] + [("inline", args.logins)] + [(f"pool={n}", n) for n in args.pools]
+    print(f"{args.method}, {args.logins} 本のログインクライアント, 各 {args.seconds:.0f} 秒")
+    print(f"{'case':<8} {'logins/s':>9} {'503':>6} {'search/s':>9} {'p50':>9} {'p95':>9}")
+    try:
+        for name, workers in cases:
+            if workers:
+                app_module.PASSWORD_HASHER = PasswordHasher(args.method, max_workers=workers,
+                                                            max_pending=app_module.PASSWORD_HASHER.max_pending)
+            statuses, latencies = run(port, users if workers else [], args.seconds)
+            logins = statuses.count(302)
+            print(f"{name:<8} {logins / args.seconds:>9.1f} {statuses.count(503):>6}"
+                  f" {len(latencies) / args.seconds:>9.1f}"
+                  f" {percentile(latencies, 0.5) * 1000:>7.1f}ms {percentile(latencies, 0.95) * 1000:>7.1f}ms")
+    finally:
+        server.shutdown()
+        app_module.COUNTER_WRITER.close()  # 一時ディレクトリを消す前に書き出しておく
+        app_module.USER_WRITER.close()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
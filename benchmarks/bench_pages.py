@@ -0,0 +1,72 @@
+"""種の詳細ページ・収録一覧（/data）のスループット計測
+
+    python benchmarks/bench_pages.py [--seconds 3]
+
+一時ディレクトリのデータで app を読み込み、テストクライアントから同じページを繰り返し
+取得して 1 秒あたりの処理件数を表示する。
+  uncached … 毎回部品のキャッシュを空にする（ページ全体を毎回描画する従来の動き）
+  cached   … 共通部分は描画済みの HTML を使い、人によって変わる部分だけ描画する
+  304      … ETag 付きの再訪問（If-None-Match が一致して本文を返さない）
+"""
+import argparse
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def throughput(client, urls, seconds, before=None, headers=None):
+    n = 0
+    urls = itertools.cycle(urls)
+    deadline = time.perf_counter() + seconds
+    start = time.perf_counter()
+    while time.perf_counter() < deadline:
+        if before is not None:
+            before()
+        url = next(urls)
+        resp = client.get(url, headers=headers(url) if headers else None)
+        assert resp.status_code in (200, 304), (url, resp.status_code)
+        n += 1
+    return n / (time.perf_counter() - start)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--seconds", type=float, default=3.0, help="各計測の時間")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ["DATA_DIR"] = tmp
+    import app as app_module
+
+    client = app_module.app.test_client()
+    pages = {
+        "species": [f"/species/{s['id']}" for s in app_module.CATALOG.species],
+        "data": ["/data"],
+    }
+    etags = {}
+    for urls in pages.values():
+        for url in urls:
+            etags[url] = client.get(url).headers["ETag"]
+
+    print(f"{'page':<10} {'uncached':>10} {'cached':>10} {'304':>10}   (req/s)")
+    try:
+        for name, urls in pages.items():
+            uncached = throughput(client, urls, args.seconds, before=app_module.FRAGMENT_CACHE.clear)
+            cached = throughput(client, urls, args.seconds)
+            revalidated = throughput(client, urls, args.seconds, headers=lambda u: {"If-None-Match": etags[u]})
+            print(f"{name:<10} {uncached:>10.0f} {cached:>10.0f} {revalidated:>10.0f}"
+                  f"   cached ×{cached / uncached:.2f}, 304 ×{revalidated / uncached:.2f}")
+    finally:
+        app_module.COUNTER_WRITER.close()  # 一時ディレクトリを消す前に書き出しておく
+        app_module.USER_WRITER.close()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
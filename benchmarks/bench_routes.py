@@ -0,0 +1,319 @@
+"""ルートごとの負荷試験（実際に近いアクセスの混ざり方）と、基準値との比較
+
+    python benchmarks/bench_routes.py [--users 10000] [--bbs 100000] [--scale 10]
+                                      [--concurrency 8] [--requests 1000] [--rounds 3] [--server]
+                                      [--baseline benchmarks/routes_baseline.json] [--save-baseline]
+
+synthetic.py の合成データ（ユーザー・談話室の投稿・水増ししたカタログ）を一時ディレクトリに作り、
+ログイン済みの利用者 --concurrency 人が MIX の割合でページを取得・投稿し続ける。
+既定は Flask のテストクライアント、--server を付けると実際のサーバ（werkzeug のスレッド）に HTTP で送る。
+ルートごとの処理件数（req/s）と応答時間（p50/p95/p99）を、--rounds 回のうち最も良かった値で表示する。
+
+--save-baseline で結果を基準値として保存し、以降は基準値と比べて
+p50/p95（件数の少ないルートは p50 のみ）が --tolerance（既定 30%）を超えて遅くなったルート、または全体の req/s が
+同じだけ下がった場合に、一覧を表示して終了コード 1 で終わる（条件が違う基準値とは比べない）。
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import quote, urlencode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import synthetic  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(ROOT, "benchmarks", "routes_baseline.json")
+# (表示名, 重み)。お気に入りは追加と解除を同じ割合にして件数を一定に保つ
+MIX = [
+    ("GET /", 20),
+    ("GET /search", 25),
+    ("GET /species/<id>?from=search", 25),
+    ("GET /bbs", 10),
+    ("POST /bbs", 3),
+    ("POST /favorite/<id>", 4),
+    ("POST /favorite_remove/<id>", 4),
+    ("GET /stats/search_chart.png", 2),
+]
+OK_STATUS = {200, 302, 304}
+# 基準値との比較で、これ未満の差（ミリ秒）は揺らぎとして無視する
+SLACK_MS = 1.0
+# 1回あたりの件数がこれ未満のルートは p95 が揺れやすいので、p50 だけで比べる
+MIN_P95_SAMPLES = 100
+
+
+def build_request(label, rng, ctx):
+    """(メソッド, URL, フォーム) を返す"""
+    sid = rng.choice(ctx["species_ids"])
+    if label == "GET /":
+        return "GET", "/", None
+    if label == "GET /search":
+        return "GET", "/search?q=" + quote(rng.choice(ctx["terms"])), None
+    if label == "GET /species/<id>?from=search":
+        return "GET", f"/species/{sid}?from=search", None
+    if label == "GET /bbs":
+        return "GET", "/bbs", None
+    if label == "POST /bbs":
+        return "POST", "/bbs", {"message": " ".join(rng.choice(synthetic.WORDS) for _ in range(5))}
+    if label == "POST /favorite/<id>":
+        return "POST", f"/favorite/{sid}", {}
+    if label == "POST /favorite_remove/<id>":
+        return "POST", f"/favorite_remove/{sid}", {}
+    if label == "GET /stats/search_chart.png":
+        return "GET", "/stats/search_chart.png", None
+    raise ValueError(label)
+
+
+class TestClientDriver:
+    """Flask のテストクライアント（セッションに直接ログイン状態を書き込む）"""
+
+    def __init__(self, app_module, username):
+        self.client = app_module.app.test_client()
+        with self.client.session_transaction() as sess:
+            sess["user"] = username
+            sess["logged_in"] = True
+
+    def request(self, method, url, form):
+        resp = self.client.open(url, method=method, data=form)
+        resp.close()
+        return resp.status_code
+
+
+class ServerDriver:
+    """実際のサーバに HTTP で送る（/login でログインしてセッションの Cookie を持ち回る）"""
+
+    def __init__(self, port, username):
+        self.port = port
+        self.cookie = None
+        status = self.request("POST", "/login", {"username": username, "password": synthetic.PASSWORD})
+        if status != 302 or self.cookie is None:
+            raise RuntimeError(f"{username} でログインできませんでした（{status}）")
+
+    def request(self, method, url, form):
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+        try:
+            headers = {}
+            body = None
+            if form is not None:
+                body = urlencode(form)
+                headers["Content-Type"] = "application/x-www-form-urlencoded"
+            if self.cookie:
+                headers["Cookie"] = self.cookie
+            conn.request(method, url, body=body, headers=headers)
+            resp = conn.getresponse()
+            resp.read()
+            set_cookie = resp.getheader("Set-Cookie")
+            if set_cookie:
+                self.cookie = set_cookie.split(";", 1)[0]
+            return resp.status
+        finally:
+            conn.close()
+
+
+def worker(driver, labels, weights, rng, ctx, budget, results, lock):
+    while True:
+        with lock:
+            if budget[0] <= 0:
+                return
+            budget[0] -= 1
+        label = rng.choices(labels, weights)[0]
+        method, url, form = build_request(label, rng, ctx)
+        start = time.perf_counter()
+        try:
+            status = driver.request(method, url, form)
+        except OSError:
+            status = None
+        elapsed = time.perf_counter() - start
+        results.append((label, elapsed, status in OK_STATUS))
+
+
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def summarize(results, elapsed):
+    routes = {}
+    for label, _ in MIX:
+        times = [t for lb, t, _ in results if lb == label]
+        if not times:
+            continue
+        routes[label] = {
+            "count": len(times),
+            "rps": len(times) / elapsed,
+            "p50_ms": percentile(times, 0.50) * 1000,
+            "p95_ms": percentile(times, 0.95) * 1000,
+            "p99_ms": percentile(times, 0.99) * 1000,
+            "errors": sum(1 for lb, _, ok in results if lb == label and not ok),
+        }
+    return {"total_rps": len(results) / elapsed, "routes": routes}
+
+
+def best_of(rounds):
+    """各項目について最も良かった回の値を取る（他の処理に割り込まれた回の揺らぎを除く）"""
+    best = {"total_rps": max(r["total_rps"] for r in rounds), "routes": {}}
+    for label, _ in MIX:
+        per_route = [r["routes"][label] for r in rounds if label in r["routes"]]
+        if not per_route:
+            continue
+        best["routes"][label] = {
+            "count": sum(r["count"] for r in per_route),
+            "rps": max(r["rps"] for r in per_route),
+            **{key: min(r[key] for r in per_route) for key in ("p50_ms", "p95_ms", "p99_ms")},
+            "errors": sum(r["errors"] for r in per_route),
+        }
+    return best
+
+
+def compare(summary, baseline, tolerance, rounds):
+    """基準値より悪くなった項目の説明の一覧"""
+    problems = []
+    limit = 1 + tolerance
+    if summary["total_rps"] < baseline["total_rps"] / limit:
+        problems.append(f"全体: {summary['total_rps']:.0f} req/s（基準 {baseline['total_rps']:.0f}）")
+    for label, base in baseline["routes"].items():
+        cur = summary["routes"].get(label)
+        if cur is None:
+            continue
+        keys = ("p50_ms", "p95_ms") if cur["count"] >= MIN_P95_SAMPLES * rounds else ("p50_ms",)
+        for key in keys:
+            if cur[key] > base[key] * limit + SLACK_MS:
+                problems.append(f"{label}: {key[:3]} {cur[key]:.1f}ms（基準 {base[key]:.1f}ms）")
+        if cur["errors"] > base["errors"]:
+            problems.append(f"{label}: エラー {cur['errors']} 件（基準 {base['errors']} 件）")
+    return problems
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=10000, help="合成ユーザー数")
+    ap.add_argument("--bbs", type=int, default=100000, help="合成した談話室の投稿数")
+    ap.add_argument("--scale", type=int, default=10, help="カタログを何倍にするか")
+    ap.add_argument("--concurrency", type=int, default=8, help="同時に操作する利用者の数")
+    ap.add_argument("--requests", type=int, default=1000, help="1回の計測のリクエスト数")
+    ap.add_argument("--rounds", type=int, default=3, help="計測の回数（項目ごとに最も良かった回の値を使う）")
+    ap.add_argument("--server", action="store_true", help="実際のサーバに HTTP で送る")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--baseline", default=DEFAULT_BASELINE)
+    ap.add_argument("--save-baseline", action="store_true", help="今回の結果を基準値として保存する")
+    ap.add_argument("--tolerance", type=float, default=0.3, help="基準値から許す悪化の割合")
+    args = ap.parse_args()
+
+    config = {k: getattr(args, k) for k in ("users", "bbs", "scale", "concurrency", "requests", "rounds", "server", "seed")}
+    tmp = tempfile.mkdtemp()
+    os.environ["DATA_DIR"] = tmp
+    os.environ["PASSWORD_HASH_METHOD"] = synthetic.PASSWORD_HASH_METHOD
+    species = synthetic.species(args.scale)
+    species_ids = [s["id"] for s in species]
+    print(f"合成データを作成中（{args.users} 人・{args.bbs} 件の投稿・{len(species)} 種）...", flush=True)
+    usernames = synthetic.write_data_dir(tmp, args.users, args.bbs, species_ids, seed=args.seed)
+    if len(usernames) < args.concurrency:
+        sys.exit("--users は --concurrency 以上にしてください")
+
+    import app as app_module
+    from catalog import Catalog
+
+    # 版数を進めて、元のカタログの分のキャッシュと混ざらないようにする
+    app_module.CATALOG = Catalog(species, version=app_module.CATALOG.version + 1)
+    labels = [label for label, _ in MIX]
+    weights = [w for _, w in MIX]
+    if app_module.SEARCH_CHART is None:
+        print("matplotlib が無いため、グラフのルートは計測しません。")
+        weights[labels.index("GET /stats/search_chart.png")] = 0
+    ctx = {
+        "species_ids": species_ids,
+        # 和名と英名の最後の語（"whale" など、多くの種に当たる語も混ざる）
+        "terms": sorted({s["jp"] for s in species[:200]} | {w for s in species[:200] for w in s["en"].split()[-1:]}),
+    }
+
+    server = None
+    try:
+        rng = random.Random(args.seed)
+        users = rng.sample(usernames, args.concurrency)
+        if args.server:
+            from werkzeug.serving import make_server
+
+            logging.getLogger("werkzeug").setLevel(logging.ERROR)
+            server = make_server("127.0.0.1", 0, app_module.app, threaded=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            drivers = [ServerDriver(server.port, u) for u in users]
+        else:
+            drivers = [TestClientDriver(app_module, u) for u in users]
+
+        # 各ルートを1回ずつ通してキャッシュ・索引を温めておく
+        for label, weight in zip(labels, weights):
+            if weight:
+                drivers[0].request(*build_request(label, rng, ctx))
+
+        rounds = []
+        for n in range(args.rounds):
+            results, lock, budget = [], threading.Lock(), [args.requests]
+            threads = [
+                threading.Thread(target=worker, args=(d, labels, weights, random.Random(args.seed + n * 1000 + i),
+                                                      ctx, budget, results, lock))
+                for i, d in enumerate(drivers)
+            ]
+            start = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            rounds.append(summarize(results, time.perf_counter() - start))
+        summary = best_of(rounds)
+    finally:
+        if server is not None:
+            server.shutdown()
+        app_module.COUNTER_WRITER.close()  # 一時ディレクトリを消す前に書き出しておく
+        app_module.USER_WRITER.close()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    print(f"{'route':<32} {'count':>6} {'req/s':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'err':>5}")
+    for label, r in summary["routes"].items():
+        print(f"{label:<32} {r['count']:>6} {r['rps']:>8.1f} {r['p50_ms']:>7.1f}ms"
+              f" {r['p95_ms']:>7.1f}ms {r['p99_ms']:>7.1f}ms {r['errors']:>5}")
+    total = sum(r["count"] for r in summary["routes"].values())
+    print(f"{'全体':<30} {total:>6} {summary['total_rps']:>8.1f}   （{args.rounds} 回のうち最も良い値）")
+
+    record = {
+        "config": config,
+        "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        **summary,
+    }
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False, indent=1)
+        print(f"基準値を {args.baseline} に保存しました。")
+        return
+    try:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    except OSError:
+        print(f"基準値（{args.baseline}）がありません。--save-baseline で保存できます。")
+        return
+    if baseline.get("config") != config:
+        print("基準値とは条件（--users など）が違うため、比較しません。")
+        return
+    if baseline.get("machine") != record["machine"]:
+        print("注意：基準値は別の環境で計測されています。")
+    problems = compare(summary, baseline, args.tolerance, args.rounds)
+    if problems:
+        print(f"基準値より {args.tolerance:.0%} を超えて悪くなりました：")
+        for p in problems:
+            print("  " + p)
+        sys.exit(1)
+    print("基準値との比較：問題なし")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""検索インデックスのベンチマーク
+
+    python benchmarks/bench_search.py [--scale N]
+
+data/species.json の種を N 倍に水増ししたカタログで、各インデックスの構築時間と
+検索1回あたりの所要時間（中央値 / 95パーセンタイル）を表示する。
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalog import load_source  # noqa: E402
+from search_index import NameIndex, PrefixSuggester, FuzzyNameIndex, FullTextIndex  # noqa: E402
+
+QUERIES = {
+    NameIndex: ["シャチ", "orca", "whale", "クジラ", "balaenoptera", "d"],
+    PrefixSuggester: ["シ", "ba", "balaenoptera m", "killer"],
+    FuzzyNameIndex: ["Delphinapterous", "belga", "humpbak whale", "orca"],
+    FullTextIndex: ["エコーロケーション", "北極海", "サケ", "Arctic cod", "妊娠期間"],
+}
+
+
+def scaled_catalog(scale):
+    out = []
+    for i in range(scale):
+        for s in load_source():
+            s = dict(s)
+            s["id"] = f"{s['id']}_{i}"
+            if i:
+                s["sci"] = f"{s['sci']} var{i}"
+            out.append(s)
+    return out
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run_queries(index, queries, repeat):
+    if isinstance(index, PrefixSuggester):
+        fn = index.suggest
+    else:
+        fn = index.search
+    samples = []
+    for _ in range(repeat):
+        for q in queries:
+            t0 = time.perf_counter()
+            fn(q)
+            samples.append(time.perf_counter() - t0)
+    return samples
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--scale", type=int, default=100, help="カタログを何倍にするか")
+    ap.add_argument("--repeat", type=int, default=20)
+    args = ap.parse_args()
+
+    catalog = scaled_catalog(args.scale)
+    print(f"catalog: {len(catalog)} entries")
+    print(f"{'index':<16} {'build ms':>10} {'p50 us':>10} {'p95 us':>10}")
+    for cls, queries in QUERIES.items():
+        t0 = time.perf_counter()
+        index = cls(catalog)
+        build = time.perf_counter() - t0
+        samples = run_queries(index, queries, args.repeat)
+        print(f"{cls.__name__:<16} {build * 1e3:>10.1f} "
+              f"{percentile(samples, 0.5) * 1e6:>10.1f} {percentile(samples, 0.95) * 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""共有カウンタ表・カウンタログの複数プロセス同時書き込みの確認とベンチマーク
+
+    python benchmarks/bench_shared_counters.py [--procs 8] [--incs 20000]
+
+各プロセスが同じ表の同じキー（と散らしたキー）を加算し、最後に合計が
+プロセス数 × 回数 と一致するかを確かめる（一致しなければ終了コード 1）。
+同じことをイベントログ（CounterLog）にも行い、復元した値を確かめる。
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from counter_log import CounterLog, SEARCH, VISIT  # noqa: E402
+from shared_counters import SharedCounters  # noqa: E402
+
+
+def hammer_table(path, incs, start):
+    counters = SharedCounters(path)
+    start.wait()
+    for i in range(incs):
+        counters.add("visitor")
+        counters.add(f"search:sp{i % 50}")
+        # 加算の合間にロックなしの読み取りも混ぜる
+        if i % 100 == 0:
+            counters.get("visitor")
+            counters.items("search:")
+    counters.close()
+
+
+def hammer_log(directory, incs, start):
+    log = CounterLog(directory, compact_every=500)
+    start.wait()
+    for i in range(incs):
+        log.record(VISIT)
+        log.record(SEARCH, f"sp{i % 50}")
+        if i % 97 == 0:
+            log.flush()
+    log.flush()
+
+
+def run(target, arg, procs, incs):
+    start = multiprocessing.Event()
+    workers = [multiprocessing.Process(target=target, args=(arg, incs, start)) for _ in range(procs)]
+    for w in workers:
+        w.start()
+    t0 = time.perf_counter()
+    start.set()
+    for w in workers:
+        w.join()
+    return time.perf_counter() - t0
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--procs", type=int, default=8)
+    ap.add_argument("--incs", type=int, default=20000)
+    args = ap.parse_args()
+    expected = args.procs * args.incs
+    ok = True
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "counters.shm")
+        SharedCounters(path).close()  # 先に作っておく
+        elapsed = run(hammer_table, path, args.procs, args.incs)
+        counters = SharedCounters(path)
+        visitor = counters.get("visitor")
+        search_total = sum(counters.items("search:").values())
+        ops = expected * 2 / elapsed
+        print(f"shared table: visitor={visitor} search={search_total} expected={expected} "
+              f"({ops:,.0f} add/s with {args.procs} procs)")
+        ok &= visitor == expected and search_total == expected
+        t0 = time.perf_counter()
+        for _ in range(100000):
+            counters.get("visitor")
+        print(f"shared table: lock-free get {(time.perf_counter() - t0) / 100000 * 1e6:.2f} us")
+        counters.close()
+
+        directory = os.path.join(tmp, "counters")
+        CounterLog(directory)
+        run(hammer_log, directory, args.procs, args.incs // 10)
+        state = CounterLog(directory).state()
+        expected_log = args.procs * (args.incs // 10)
+        print(f"event log: visitor={state['visitor']} search={sum(state['search'].values())} "
+              f"expected={expected_log}")
+        ok &= state["visitor"] == expected_log and sum(state["search"].values()) == expected_log
+
+    print("OK" if ok else "NG: 値が一致しません")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
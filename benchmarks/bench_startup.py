@@ -0,0 +1,124 @@
+"""起動時間のベンチマーク（予算を超えたら終了コード 1）
+
+    python benchmarks/bench_startup.py [--runs N] [--budget-ms MS] [--top N]
+
+新しいプロセスで app を import してから最初のレスポンス（GET /）を返すまでの時間を
+N 回測り、中央値を予算と比べる。あわせて python -X importtime の結果から、
+import に時間のかかっているパッケージ（上位）を表示する。
+起動時に読み込まれてはいけない重いモジュール（matplotlib・pandas）が
+読み込まれていた場合も失敗とする。
+
+データは一時ディレクトリに複製した data/ を使う（本番データは書き換えない）。
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 起動時に読み込まれてはいけないモジュール（グラフを描くときに初めて読み込む）
+LAZY_MODULES = ["matplotlib", "pandas"]
+
+# 子プロセスで実行するコード：import と最初のレスポンスまでの時間を JSON で出力する
+CHILD = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+resp = app.app.test_client().get("/")
+t2 = time.perf_counter()
+print(json.dumps({
+    "import_ms": (t1 - t0) * 1000,
+    "first_response_ms": (t2 - t1) * 1000,
+    "status": resp.status_code,
+    "loaded": [m for m in %r if m in sys.modules],
+}))
+"""
+
+
+def run_child(env, importtime=False):
+    cmd = [sys.executable]
+    if importtime:
+        cmd += ["-X", "importtime"]
+    cmd += ["-c", CHILD % (LAZY_MODULES,)]
+    out = subprocess.run(cmd, cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1]), out.stderr
+
+
+def import_breakdown(stderr, top):
+    """-X importtime の出力から、パッケージ（最上位の名前）ごとの import 時間（ミリ秒）を返す
+
+    各モジュール自身の時間（self）をパッケージ単位で合計するので、入れ子を二重に数えない。
+    """
+    totals = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or line.count("|") != 2:
+            continue
+        own, _, name = line[len("import time:"):].split("|")
+        if not own.strip().isdigit():
+            continue  # 見出し行
+        package = name.strip().split(".")[0]
+        totals[package] = totals.get(package, 0) + int(own) / 1000
+    return sorted(totals.items(), key=lambda t: -t[1])[:top]
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=500.0,
+                        help="import から最初のレスポンスまでの中央値の上限")
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_startup_")
+    try:
+        data_dir = os.path.join(tmp, "data")
+        shutil.copytree(os.path.join(ROOT, "data"), data_dir)
+        env = dict(os.environ, DATA_DIR=data_dir)
+
+        # 1回目は .pyc・species.bin・フォント設定などのキャッシュ作成を含むので別に表示する
+        cold, _ = run_child(env)
+        print(f"初回（キャッシュ作成込み）: import {cold['import_ms']:.0f} ms"
+              f" + 最初のレスポンス {cold['first_response_ms']:.0f} ms")
+
+        totals, results = [], []
+        for _ in range(args.runs):
+            r, _ = run_child(env)
+            results.append(r)
+            totals.append(r["import_ms"] + r["first_response_ms"])
+        print(f"{args.runs} 回の中央値: import {median([r['import_ms'] for r in results]):.0f} ms"
+              f" + 最初のレスポンス {median([r['first_response_ms'] for r in results]):.0f} ms"
+              f" = {median(totals):.0f} ms（予算 {args.budget_ms:.0f} ms）")
+
+        _, stderr = run_child(env, importtime=True)
+        print(f"\nimport 時間の内訳（パッケージごと、上位 {args.top}）")
+        for name, ms in import_breakdown(stderr, args.top):
+            print(f"  {name:<30} {ms:8.1f} ms")
+
+        failed = False
+        if any(r["status"] != 200 for r in results):
+            print("\n失敗：GET / が 200 を返しませんでした")
+            failed = True
+        loaded = sorted({m for r in results for m in r["loaded"]})
+        if loaded:
+            print(f"\n失敗：起動時に読み込まれています：{', '.join(loaded)}")
+            failed = True
+        if median(totals) > args.budget_ms:
+            print(f"\n失敗：予算 {args.budget_ms:.0f} ms を超えました")
+            failed = True
+        sys.exit(1 if failed else 0)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""ベンチマーク用の合成データ（大量のユーザー・談話室の投稿・水増ししたカタログ）
+
+    python benchmarks/synthetic.py OUT_DIR [--users 100000] [--bbs 1000000] [--seed 1]
+
+OUT_DIR に users.json と bbs_messages.csv を書き出す（DATA_DIR=OUT_DIR で app を起動すれば読み込まれる）。
+カタログは data/species.json から読むので、水増しした種は species() で作って app.CATALOG を差し替える。
+ユーザーのパスワードは全員 PASSWORD で、ハッシュは PASSWORD_HASH_METHOD の強さで1回だけ計算して使い回す
+（app 側も同じ PASSWORD_HASH_METHOD で起動すれば、ログイン時のハッシュし直しは起きない）。
+"""
+import argparse
+import csv
+import datetime
+import json
+import os
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PASSWORD = "synthetic-pw"
+# ログインを計測したいわけではないので、既定は軽いハッシュにしておく
+PASSWORD_HASH_METHOD = "pbkdf2:sha256:1000"
+
+WORDS = [
+    "クジラ", "イルカ", "シャチ", "ザトウクジラ", "見ました", "かわいい", "大きい", "潜水",
+    "ジャンプ", "whale", "dolphin", "orca", "今日", "海", "ツアー", "写真", "鳴き声", "群れ",
+]
+
+
+def species(scale, source=None):
+    """data/species.json の種を scale 倍にする（id と学名に番号を付けて重複させない）"""
+    from catalog import load_source
+
+    base = source if source is not None else load_source()
+    out = []
+    for i in range(scale):
+        for s in base:
+            s = dict(s)
+            s["id"] = f"{s['id']}_{i}" if i else s["id"]
+            if i:
+                s["sci"] = f"{s['sci']} var{i}"
+            out.append(s)
+    return out
+
+
+def users(n, species_ids, max_favorites=10, seed=1, method=PASSWORD_HASH_METHOD):
+    """username -> ユーザー情報（users.json と同じ形）"""
+    from werkzeug.security import generate_password_hash
+
+    rng = random.Random(seed)
+    pw_hash = generate_password_hash(PASSWORD, method)
+    start = datetime.date(2020, 1, 1)
+    out = {}
+    for i in range(n):
+        k = rng.randint(0, min(max_favorites, len(species_ids)))
+        out[f"user{i:07d}"] = {
+            "pw_hash": pw_hash,
+            "created_at": (start + datetime.timedelta(days=rng.randrange(2000))).strftime("%Y-%m-%d"),
+            "favorites": rng.sample(species_ids, k),
+        }
+    return out
+
+
+def bbs_messages(n, usernames, seed=1):
+    """古い順に投稿を作る（本文には改行・引用符も混ぜる）"""
+    rng = random.Random(seed)
+    ts = datetime.datetime(2024, 1, 1)
+    for _ in range(n):
+        ts += datetime.timedelta(seconds=rng.randint(1, 600))
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 12)))
+        if rng.random() < 0.05:
+            text += '\n"引用"'
+        yield {"ts": ts.strftime("%Y-%m-%d %H:%M:%S"), "user": rng.choice(usernames), "text": text}
+
+
+def write_data_dir(data_dir, n_users=0, n_bbs=0, species_ids=None, seed=1):
+    """data_dir に users.json と bbs_messages.csv を書き出し、作ったユーザー名の一覧を返す"""
+    from storage import BBS_FIELDS
+
+    os.makedirs(data_dir, exist_ok=True)
+    if species_ids is None:
+        species_ids = [s["id"] for s in species(1)]
+    recs = users(n_users, species_ids, seed=seed)
+    with open(os.path.join(data_dir, "users.json"), "w", encoding="utf-8") as f:
+        json.dump(recs, f, ensure_ascii=False)
+    names = list(recs) or ["guest"]
+    if n_bbs:
+        # 索引（.idx）は起動後の最初の読み込みで作られる
+        with open(os.path.join(data_dir, "bbs_messages.csv"), "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=BBS_FIELDS)
+            writer.writeheader()
+            writer.writerows(bbs_messages(n_bbs, names, seed=seed))
+    return list(recs)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("out_dir")
+    ap.add_argument("--users", type=int, default=100000)
+    ap.add_argument("--bbs", type=int, default=1000000)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    write_data_dir(args.out_dir, args.users, args.bbs, seed=args.seed)
+    print(f"{args.out_dir} に {args.users} 人・{args.bbs} 件の投稿を書き出しました。"
+          f"（PASSWORD_HASH_METHOD={PASSWORD_HASH_METHOD} で起動してください）")
+
+
+if __name__ == "__main__":
+    main()
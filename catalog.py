@@ -0,0 +1,277 @@
+# 鯨類まとめサイト - 種カタログの読み込み・コンパイル・差し替え
+#
+# 編集用の原本は data/species.json。起動時や変更検知時に、レコードごとに
+# 位置を引ける読み取り専用のバイナリ（data/species.bin）へコンパイルし、
+# それを mmap で読む（同じマシン上のワーカ間ではページキャッシュを共有できる）。
+# 読み込み後も mmap は開いたままにし、各レコードは参照されたときにオフセット表から
+# 取り出して dict にする（プロセスごとに全種の dict を持ち続けない）。
+#
+#   python catalog.py   # 手動でコンパイルだけ行う
+
+import datetime
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from collections.abc import Mapping, Sequence
+
+from search_index import NameIndex, PrefixSuggester, FuzzyNameIndex, FullTextIndex
+from shared_counters import KEY_MAX
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE_FILE = os.path.join(BASE_DIR, "data", "species.json")
+COMPILED_FILE = os.path.join(BASE_DIR, "data", "species.bin")
+
+# 形式：マジック(4) 形式版(u32) 件数(u32) | オフセット表 (件数+1)×u64 | レコード（UTF-8 JSON）
+MAGIC = b"CETC"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<4sII")
+_OFFSET = struct.Struct("<Q")
+
+log = logging.getLogger(__name__)
+
+# 種 id の長さの上限（UTF-8 のバイト数）。検索回数は共有カウンタ表のキー "search:<id>" で数えるため
+ID_MAX_BYTES = KEY_MAX - len("search:")
+
+
+class CatalogError(Exception):
+    pass
+
+
+def validate_species(species):
+    if not isinstance(species, list):
+        raise CatalogError("カタログは種の配列である必要があります。")
+    seen = set()
+    for s in species:
+        sid = s.get("id") if isinstance(s, dict) else None
+        if not isinstance(sid, str) or not sid:
+            raise CatalogError("id の無い種があります。")
+        if len(sid.encode("utf-8")) > ID_MAX_BYTES:
+            raise CatalogError(f"id が長すぎます（{ID_MAX_BYTES} バイトまで）：{sid}")
+        if sid in seen:
+            raise CatalogError(f"id が重複しています：{sid}")
+        seen.add(sid)
+        for key in ("jp", "en", "sci"):
+            if not isinstance(s.get(key, ""), str):
+                raise CatalogError(f"{sid} の {key} が文字列ではありません。")
+    return species
+
+
+def load_source(path=SOURCE_FILE):
+    with open(path, encoding="utf-8") as f:
+        return validate_species(json.load(f))
+
+
+def compile_catalog(src=SOURCE_FILE, dst=COMPILED_FILE):
+    """原本をバイナリへコンパイルし、os.replace で置き換える（読み込み中の mmap は旧版のまま有効）"""
+    species = load_source(src)
+    records = [json.dumps(s, ensure_ascii=False, separators=(",", ":")).encode("utf-8") for s in species]
+    base = _HEADER.size + _OFFSET.size * (len(records) + 1)
+    offsets = [base]
+    for r in records:
+        offsets.append(offsets[-1] + len(r))
+
+    tmp = f"{dst}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(records)))
+        for off in offsets:
+            f.write(_OFFSET.pack(off))
+        for r in records:
+            f.write(r)
+    os.replace(tmp, dst)
+    return len(records)
+
+
+class CompiledCatalog:
+    """コンパイル済みカタログを mmap で開き、i 番目のレコードだけを取り出せるようにしたもの"""
+
+    def __init__(self, path=COMPILED_FILE):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self._mm.close()
+            raise CatalogError(f"形式の異なるカタログです：{path}")
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def _offset(self, i):
+        return _OFFSET.unpack_from(self._mm, _HEADER.size + _OFFSET.size * i)[0]
+
+    def record(self, i):
+        if not 0 <= i < self._count:
+            raise IndexError(i)
+        return json.loads(self._mm[self._offset(i):self._offset(i + 1)].decode("utf-8"))
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self.record(i)
+
+    def digest(self):
+        """ファイル内容のハッシュ（同じ内容ならワーカ・再起動をまたいでも同じ値）"""
+        return hashlib.sha1(self._mm).hexdigest()[:16]
+
+    def close(self):
+        self._mm.close()
+
+
+class SpeciesRecords(Sequence):
+    """コンパイル済みカタログの種の列。添字で参照されるたびに mmap から読んで dict にする
+
+    読んだ dict は持っておかないので、呼び出し側が書き換えてもカタログには影響しない。
+    mmap はこのオブジェクト（を持つ Catalog）が使われなくなるまで開いたまま
+    （原本の差し替えは os.replace なので、古い版の mmap も読める）。
+    """
+
+    def __init__(self, compiled):
+        self._compiled = compiled
+
+    def __len__(self):
+        return len(self._compiled)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._compiled.record(j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        return self._compiled.record(i)
+
+    def __iter__(self):
+        return iter(self._compiled)
+
+
+class RecordsById(Mapping):
+    """id -> 種。id から並び順を引き、レコードは SpeciesRecords から都度読む"""
+
+    def __init__(self, records, ids):
+        self._records = records
+        self._index = {sid: i for i, sid in enumerate(ids)}
+
+    def __getitem__(self, sid):
+        return self._records[self._index[sid]]
+
+    def __contains__(self, sid):
+        return sid in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+
+def _stat_key(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def ensure_compiled(src=SOURCE_FILE, dst=COMPILED_FILE):
+    """原本の方が新しければコンパイルし直す"""
+    src_key = _stat_key(src)
+    dst_key = _stat_key(dst)
+    if src_key is not None and (dst_key is None or src_key[2] > dst_key[2]):
+        compile_catalog(src, dst)
+
+
+class Catalog:
+    """カタログ1版分（種データと派生インデックス一式）
+
+    各ルートは app.CATALOG を一度だけ参照して使う。新しい版は別オブジェクトとして
+    組み立ててから参照を付け替えるので、読み手が新旧の混ざった状態を見ることはない。
+    """
+
+    def __init__(self, species, version=1, previous=None, digest=None, modified=None, rows=None):
+        # インデックスを作る間だけ全種を dict にしておく（SpeciesRecords なら以後は都度読む）。
+        # rows は読み込み時に検証のため読んだもの（あれば読み直さない）
+        if rows is None:
+            rows = list(species)
+        self.species = species
+        if isinstance(species, SpeciesRecords):
+            self.by_id = RecordsById(species, [s["id"] for s in rows])
+        else:
+            self.by_id = {s["id"]: s for s in rows}
+        # version はこのプロセス内の版数。digest・modified は内容から決まるので、
+        # ワーカ間で共通の検証子（ETag・Last-Modified）に使える
+        self.version = version
+        self.digest = digest or str(version)
+        self.modified = modified
+        if previous is not None:
+            # 名前インデックスは変更のあった種だけ索引し直す
+            self.name_index = previous.name_index.clone()
+            self.name_index.sync(rows)
+        else:
+            self.name_index = NameIndex(rows)
+        self.suggester = PrefixSuggester(rows)
+        self.fuzzy_index = FuzzyNameIndex(rows)
+        self.text_index = FullTextIndex(rows)
+
+
+class CatalogLoader:
+    """原本・コンパイル済みファイルの変更を検知して Catalog を作り直す"""
+
+    def __init__(self, src=SOURCE_FILE, dst=COMPILED_FILE, check_interval=2.0):
+        self.src = src
+        self.dst = dst
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._loaded_key = None
+        self._failed_key = None  # 読み込みに失敗した (原本, コンパイル済み) の状態。変わるまで試し直さない
+        self._next_check = 0.0
+
+    def load(self, previous=None):
+        ensure_compiled(self.src, self.dst)
+        key = _stat_key(self.dst)
+        compiled = CompiledCatalog(self.dst)
+        try:
+            rows = validate_species(list(compiled))
+        except CatalogError:
+            compiled.close()
+            raise
+        species = SpeciesRecords(compiled)
+        digest = compiled.digest()
+        version = previous.version + 1 if previous is not None else 1
+        modified = datetime.datetime.fromtimestamp(key[2] / 1e9, datetime.timezone.utc).replace(microsecond=0)
+        self._loaded_key = key
+        return Catalog(species, version=version, previous=previous, digest=digest, modified=modified, rows=rows)
+
+    def reload_if_changed(self, current):
+        """変更があれば新しい Catalog を、無ければ None を返す（確認は check_interval 秒ごと）"""
+        now = time.monotonic()
+        if now < self._next_check:
+            return None
+        if not self._lock.acquire(blocking=False):
+            return None  # 他のスレッドが確認中
+        try:
+            self._next_check = now + self.check_interval
+            if _stat_key(self.src) is None and _stat_key(self.dst) == self._loaded_key:
+                return None
+            key = (_stat_key(self.src), _stat_key(self.dst))
+            if key == self._failed_key:
+                return None
+            try:
+                ensure_compiled(self.src, self.dst)
+                if _stat_key(self.dst) == self._loaded_key:
+                    return None
+                return self.load(previous=current)
+            except (OSError, ValueError, CatalogError) as e:
+                # 編集途中の壊れた原本などは読み込まず、今の版を使い続ける。
+                # 同じファイルのまま何度も試したり記録したりしないよう、直されるまでは飛ばす
+                self._failed_key = key
+                log.warning("カタログを読み込めませんでした（ファイルが変わるまで今の版を使います）：%s", e)
+                return None
+        finally:
+            self._lock.release()
+
+
+if __name__ == "__main__":
+    n = compile_catalog()
+    print(f"{n} 種を {COMPILED_FILE} に書き出しました。")
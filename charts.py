@@ -0,0 +1,224 @@
+# 鯨類まとめサイト - グラフ描画（matplotlib の遅延読み込み）と描画済み画像のキャッシュ
+#
+# matplotlib は import だけで数百ミリ秒かかるので、起動時には読み込まず、
+# 最初にグラフを描くときに load_figure() で読み込む。
+
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+MIMETYPES = {
+    "png": "image/png",
+    "svg": "image/svg+xml",
+}
+
+
+# 日本語フォントの候補（static/fonts 内の同梱ファイル → japanize_matplotlib → システムのフォント名の順に試す）
+LOCAL_FONT_FILES = [
+    "ipaexg.ttf",
+    "ipag.ttf",
+    "NotoSansJP-Regular.otf",
+    "NotoSansCJKjp-Regular.otf",
+]
+SYSTEM_FONT_NAMES = [
+    "IPAexGothic",
+    "IPAGothic",
+    "Noto Sans CJK JP",
+    "Noto Sans JP",
+    "TakaoGothic",
+    "Yu Gothic",
+    "Meiryo",
+    "Hiragino Sans",
+    "MS Gothic",
+]
+
+_figure = None
+_figure_lock = threading.Lock()
+
+
+def matplotlib_installed():
+    """matplotlib が使えるか（import はしない）"""
+    return importlib.util.find_spec("matplotlib") is not None
+
+
+def load_figure(font_dir=None, font_cache=None):
+    """初回だけ matplotlib を読み込み、日本語フォントを設定して Figure クラスを返す
+
+    pyplot は使わない（グローバルな状態を持たず、GUI バックエンドも読み込まない）。
+    見つけたフォントは font_cache（JSON）に記録し、次回の起動では探さずに使う。
+    """
+    global _figure
+    if _figure is not None:
+        return _figure
+    with _figure_lock:
+        if _figure is None:
+            import matplotlib
+            from matplotlib.figure import Figure
+
+            _configure_japanese_font(matplotlib, font_dir, font_cache)
+            _figure = Figure
+    return _figure
+
+
+def _configure_japanese_font(matplotlib, font_dir, font_cache):
+    """日本語の文字化け（豆腐）を避けるためのフォント設定"""
+    matplotlib.rcParams["axes.unicode_minus"] = False
+    found = _read_font_cache(font_cache, matplotlib.__version__)
+    if found is None or not _apply_font(matplotlib, found):
+        found = _probe_font(matplotlib, font_dir)
+        _write_font_cache(font_cache, matplotlib.__version__, found)
+    if not found:
+        log.info("日本語フォントが見つかりません（グラフの日本語が表示されない場合があります）")
+
+
+def _apply_font(matplotlib, found):
+    """記録済みのフォントを設定する（ファイルが消えている等で使えなければ False）"""
+    from matplotlib import font_manager
+
+    if not found:
+        return True  # 前回探して見つからなかった
+    try:
+        if "file" in found:
+            font_manager.fontManager.addfont(found["file"])
+        elif "module" in found:
+            importlib.import_module(found["module"])
+        matplotlib.rcParams["font.family"] = found["family"]
+        return True
+    except Exception:
+        return False
+
+
+def _probe_font(matplotlib, font_dir):
+    """日本語フォントを探して設定し、見つけたものを返す（無ければ {}）"""
+    from matplotlib import font_manager
+
+    # 1) 同梱フォント（任意）を優先
+    for name in LOCAL_FONT_FILES if font_dir else []:
+        fp = os.path.join(font_dir, name)
+        if os.path.exists(fp):
+            try:
+                font_manager.fontManager.addfont(fp)
+                family = font_manager.FontProperties(fname=fp).get_name()
+                matplotlib.rcParams["font.family"] = family
+                return {"file": fp, "family": family}
+            except Exception:
+                pass
+
+    # 2) 追加モジュール（任意）：入っていれば日本語フォントを登録・設定してくれる
+    try:
+        import japanize_matplotlib  # noqa: F401
+        return {"module": "japanize_matplotlib", "family": matplotlib.rcParams["font.family"][0]}
+    except Exception:
+        pass
+
+    # 3) システムフォント名（環境差があるので複数候補）
+    for name in SYSTEM_FONT_NAMES:
+        try:
+            font_manager.findfont(name, fallback_to_default=False)
+            matplotlib.rcParams["font.family"] = name
+            return {"family": name}
+        except Exception:
+            continue
+    return {}
+
+
+def _read_font_cache(path, version):
+    if not path:
+        return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # matplotlib を入れ替えたら探し直す
+    if not isinstance(cached, dict) or cached.get("matplotlib") != version:
+        return None
+    return cached.get("font")
+
+
+def _write_font_cache(path, version, found):
+    if not path:
+        return
+    tmp = path + ".tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"matplotlib": version, "font": found}, f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except OSError:
+        log.warning("フォント設定を保存できませんでした：%s", path)
+
+
+class ChartImage:
+    """描画済みの画像1枚（body が None ならデータが無く、描くものが無い）"""
+
+    __slots__ = ("key", "body", "etag")
+
+    def __init__(self, key, body):
+        self.key = key
+        self.body = body
+        self.etag = hashlib.sha1(body).hexdigest()[:20] if body is not None else None
+
+
+class ChartCache:
+    """グラフ画像を形式（png / svg）ごとに1枚ずつ描いて持っておく
+
+    version() の値が変わらない間は同じバイト列を返す。変わった後は古い画像を返しつつ、
+    バックグラウンドのスレッドが load() → render(data, fmt) で描き直す。
+    リクエストの中で描くのは、その形式を初めて求められたときだけ。
+    """
+
+    def __init__(self, version, load, render, delay=1.0, name="chart-renderer"):
+        self._version = version
+        self._load = load
+        self._render = render
+        self.delay = delay
+        self.renders = 0
+        self._images = {}  # 形式 -> ChartImage
+        # matplotlib はスレッドセーフではないので、描くのは一度に1枚だけ
+        self._render_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def get(self, fmt):
+        key = self._version()
+        img = self._images.get(fmt)
+        if img is None:
+            return self._render_now(fmt, key)
+        if img.key != key:
+            self._wake.set()
+        return img
+
+    def changed(self):
+        """元データが変わったことを知らせる（一度でも求められた形式を裏で描き直す）"""
+        if self._images:
+            self._wake.set()
+
+    def _render_now(self, fmt, key):
+        with self._render_lock:
+            img = self._images.get(fmt)
+            if img is not None and img.key == key:
+                return img  # 待っている間に他のスレッドが描いた
+            data = self._load()
+            img = ChartImage(key, self._render(data, fmt) if data else None)
+            self._images[fmt] = img
+            self.renders += 1
+            return img
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            # 続けて来た変更は1回の描き直しにまとめる
+            time.sleep(self.delay)
+            self._wake.clear()
+            for fmt in list(self._images):
+                try:
+                    self._render_now(fmt, self._version())
+                except Exception:
+                    log.exception("グラフの描き直しに失敗しました（%s）", fmt)
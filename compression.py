@@ -0,0 +1,77 @@
+# 鯨類まとめサイト - テキスト応答の gzip 圧縮（ストリーミング応答にも対応）
+#
+# after_request から compress_response() を呼ぶ。まとめて作った応答は丸ごと圧縮し、
+# ストリーミング応答は届いた塊ごとに圧縮して Z_SYNC_FLUSH で送り出す（ブラウザは
+# 届いた分から表示できる）。静的ファイルは assets.py で事前圧縮してあるので対象外。
+
+import zlib
+
+COMPRESSIBLE_TYPES = {
+    "text/html",
+    "text/css",
+    "text/plain",
+    "text/javascript",
+    "application/javascript",
+    "application/json",
+    "application/xml",
+    "image/svg+xml",
+}
+
+# gzip 形式（zlib のヘッダではなく gzip のヘッダ・トレーラを付ける）
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def gzip_etag(etag):
+    """圧縮した表現の ETag（圧縮前とはバイト列が違うので別の値にする）"""
+    return etag + "-gzip"
+
+
+def _gzip_chunks(chunks, level, close):
+    co = zlib.compressobj(level, zlib.DEFLATED, _GZIP_WBITS)
+    try:
+        for chunk in chunks:
+            out = co.compress(chunk) + co.flush(zlib.Z_SYNC_FLUSH)
+            if out:
+                yield out
+        yield co.flush()
+    finally:
+        if close is not None:
+            close()
+
+
+def compress_response(response, accept_encodings, level=6, min_size=1024):
+    """受け付けられるなら response の本文を gzip にする（response をそのまま返す）
+
+    level が 0 以下なら何もしない。長さが分かっていて min_size バイト未満の応答は圧縮しない
+    （小さい応答は圧縮しても縮まないうえ、手間の方が大きい）。
+    """
+    if level <= 0 or response.status_code < 200 or response.status_code in (204, 304):
+        return response
+    if response.direct_passthrough or "Content-Encoding" in response.headers:
+        return response
+    if response.mimetype not in COMPRESSIBLE_TYPES:
+        return response
+    # 圧縮するかどうかが Accept-Encoding で変わることを、途中のキャッシュに知らせる
+    response.vary.add("Accept-Encoding")
+    if not accept_encodings["gzip"]:
+        return response
+    # エラーページなど、ストリーミング扱いでも長さが分かっている小さな応答はそのまま
+    if response.content_length is not None and response.content_length < min_size:
+        return response
+
+    if response.is_streamed:
+        original = response.response
+        response.response = _gzip_chunks(response.iter_encoded(), level, getattr(original, "close", None))
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        co = zlib.compressobj(level, zlib.DEFLATED, _GZIP_WBITS)
+        response.set_data(co.compress(data) + co.flush())
+
+    response.headers["Content-Encoding"] = "gzip"
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(gzip_etag(etag), weak)
+    return response
@@ -0,0 +1,234 @@
+# 鯨類まとめサイト - カウンタのイベントログ（追記のみ）＋スナップショット
+#
+# data/counters/
+#   snapshot.json        … ある時点までのイベントを畳み込んだ状態（next_segment 以降は未反映）
+#   events-000001.log    … イベントの追記ログ。1行1イベント「時刻<TAB>種類<TAB>キー<TAB>増分」
+#
+# 起動時は snapshot.json を読み、next_segment 以降のログを順に適用して状態を復元する。
+# 古いセグメントは圧縮後も消さずに残す（1時間ごとのリセットで消える検索回数の生の履歴になる。
+# 時間ごとの集計は search_stats.py が別に保存する）。
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from search_stats import week_last_hour
+
+try:
+    import fcntl
+except ImportError:  # Windows：プロセス間の排他は行わない（単一プロセス前提）
+    fcntl = None
+
+SNAPSHOT_NAME = "snapshot.json"
+LOCK_NAME = "lock"
+
+# イベントの種類
+VISIT = "visit"    # 訪問者数 +増分
+SEARCH = "search"  # 種 id の検索回数（今の1時間の分） +増分
+HOUR = "hour"      # 時間の切り替え（キーは新しい時 = エポック秒 // 3600。検索回数を0に戻す）
+WEEK = "week"      # 旧形式の週の切り替え（古いログの読み込み用。検索回数を0に戻す）
+
+
+def empty_state():
+    return {"visitor": 0, "hour": None, "search": {}}
+
+
+def apply_event(state, kind, key, delta):
+    if kind == VISIT:
+        state["visitor"] += delta
+    elif kind == SEARCH:
+        state["search"][key] = state["search"].get(key, 0) + delta
+    elif kind == HOUR:
+        state["hour"] = int(key)
+        state["search"] = {}
+    elif kind == WEEK:
+        # 以降の検索回数はその週のもの。週の最後の1時間の分として履歴に残るようにする
+        state["hour"] = week_last_hour(key)
+        state["search"] = {}
+
+
+def _segment_name(seq):
+    return f"events-{seq:06d}.log"
+
+
+def _ends_with_newline(path):
+    """ファイルが空か、改行で終わっていれば True"""
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0:
+                return True
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+    except FileNotFoundError:
+        return True
+
+
+def _parse_line(line):
+    parts = line.rstrip("\n").split("\t")
+    if len(parts) != 4 or not line.endswith("\n"):
+        return None  # 書き込み途中で落ちた最終行など
+    try:
+        return int(parts[0]), parts[1], parts[2], int(parts[3])
+    except ValueError:
+        return None
+
+
+class CounterLog:
+    """カウンタの増分を追記ログとして記録し、ときどきスナップショットへ圧縮する
+
+    record() はメモリ上の状態を更新して書き込み待ちに積むだけで、ファイルへの追記は
+    flush() でまとめて行う（persistence.WriteBehind から呼ぶ想定）。
+    複数のワーカプロセスが同じディレクトリに書いてもよいよう、追記と圧縮は
+    ロックファイル（fcntl が使える環境のみ）で排他する。
+    """
+
+    def __init__(self, directory, seed=None, compact_every=10000):
+        self.directory = directory
+        self.compact_every = compact_every
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()     # メモリ上の状態・書き込み待ち用
+        self._io_lock = threading.Lock()  # ファイル操作用
+        self._buffer = []
+        self._since_compact = 0
+        with self._exclusive():
+            self._state = self._recover(seed)
+
+    @contextmanager
+    def _exclusive(self):
+        """同じプロセス内のスレッド間・プロセス間の両方で排他する"""
+        with self._io_lock:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.directory, LOCK_NAME), "a") as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    # ---- 復元 ----
+
+    def _segments(self):
+        out = []
+        for name in os.listdir(self.directory):
+            if name.startswith("events-") and name.endswith(".log"):
+                try:
+                    out.append(int(name[len("events-"):-len(".log")]))
+                except ValueError:
+                    continue
+        return sorted(out)
+
+    def _read_snapshot(self):
+        with open(os.path.join(self.directory, SNAPSHOT_NAME), encoding="utf-8") as f:
+            snap = json.load(f)
+        state = snap["state"]
+        state.setdefault("search", {})
+        state.setdefault("visitor", 0)
+        state.setdefault("hour", None)
+        return state, snap["next_segment"]
+
+    def _replay(self, state, first, stop=None):
+        """セグメント first 以降（stop の手前まで）のイベントを state に適用し、適用件数を返す"""
+        n = 0
+        for seq in self._segments():
+            if seq < first or (stop is not None and seq >= stop):
+                continue
+            with open(os.path.join(self.directory, _segment_name(seq)), encoding="utf-8") as f:
+                for line in f:
+                    ev = _parse_line(line)
+                    if ev is not None:
+                        apply_event(state, *ev[1:])
+                        n += 1
+        return n
+
+    def _recover(self, seed):
+        if not os.path.exists(os.path.join(self.directory, SNAPSHOT_NAME)):
+            # 初回：旧形式のファイルから作った状態を起点にする
+            self._write_snapshot(seed if seed is not None else empty_state(), 1)
+        state, first = self._read_snapshot()
+        self._since_compact = self._replay(state, first)
+        return state
+
+    # ---- 記録 ----
+
+    def state(self):
+        """このプロセスから見た状態の複製を返す（起動時の復元値 + このプロセスでの増分）"""
+        with self._lock:
+            return {
+                "visitor": self._state["visitor"],
+                "hour": self._state["hour"],
+                "search": dict(self._state["search"]),
+            }
+
+    def record(self, kind, key="", delta=1):
+        line = f"{int(time.time())}\t{kind}\t{key}\t{delta}\n"
+        with self._lock:
+            apply_event(self._state, kind, key, delta)
+            self._buffer.append(line)
+
+    @property
+    def pending(self):
+        return len(self._buffer)
+
+    def flush(self):
+        """書き込み待ちのイベントを最新のセグメントへ追記し、必要なら圧縮する"""
+        with self._lock:
+            lines, self._buffer = self._buffer, []
+        with self._exclusive():
+            if lines:
+                # 他のプロセスが圧縮して新しいセグメントに切り替えている場合があるので毎回調べる
+                segments = self._segments()
+                segment = segments[-1] if segments else 1
+                path = os.path.join(self.directory, _segment_name(segment))
+                try:
+                    data = "".join(lines)
+                    if not _ends_with_newline(path):
+                        # 書き込み途中で落ちた最終行に続けて書くと、次の行まで読めなくなるので改行で区切る
+                        data = "\n" + data
+                    with open(path, "a", encoding="utf-8") as f:
+                        f.write(data)
+                except OSError:
+                    with self._lock:
+                        self._buffer[:0] = lines
+                    raise
+                self._since_compact += len(lines)
+            if self._since_compact >= self.compact_every:
+                self._compact()
+
+    def compact(self):
+        self.flush()
+        with self._exclusive():
+            self._compact()
+
+    def _compact(self):
+        """新しいセグメントに切り替え、それまでのログを畳み込んだスナップショットを書き出す
+
+        メモリ上の状態ではなくファイルから畳み込むので、他のプロセスの増分も漏れない。
+        """
+        segments = self._segments()
+        new = (segments[-1] if segments else 0) + 1
+        open(os.path.join(self.directory, _segment_name(new)), "a").close()
+        state, first = self._read_snapshot()
+        self._replay(state, first, stop=new)
+        self._write_snapshot(state, new)
+        self._since_compact = 0
+
+    def _write_snapshot(self, state, next_segment):
+        path = os.path.join(self.directory, SNAPSHOT_NAME)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"next_segment": next_segment, "state": state}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+
+    def history(self, kind=None):
+        """保存済みの全イベントを古い順に (時刻, 種類, キー, 増分) で返す"""
+        for seq in self._segments():
+            with open(os.path.join(self.directory, _segment_name(seq)), encoding="utf-8") as f:
+                for line in f:
+                    ev = _parse_line(line)
+                    if ev is not None and (kind is None or ev[1] == kind):
+                        yield ev
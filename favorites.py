@@ -0,0 +1,84 @@
+# 鯨類まとめサイト - お気に入りの索引（ユーザー → 種、種 → 人数）
+
+import threading
+
+
+class FavoriteIndex:
+    """ユーザーごとのお気に入りと、種ごとのお気に入り人数（逆引き）を一緒に持つ
+
+    ユーザーごとのお気に入りは dict（挿入順を保つ集合）で持つので、追加・削除・所属の確認は
+    どれも O(1)。人数は追加・削除のたびにその種の分だけ増減する（全ユーザーを走査しない）。
+    人気順の並びは、変更があった後に最初に求められたときだけ種の数だけを並べ直す。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_user = {}  # ユーザー名 -> {種 id: None}（登録順）
+        self._counts = {}  # 種 id -> お気に入りにしている人数
+        self._version = 0
+        self._ranking = (-1, [])  # (版数, [(種 id, 人数), ...] 人数の多い順)
+
+    def __contains__(self, username):
+        return username in self._by_user
+
+    def load(self, username, favs):
+        """ユーザーのお気に入りを丸ごと設定する（起動時の読み込み・一括の置き換え）"""
+        new = dict.fromkeys(favs)
+        with self._lock:
+            old = self._by_user.get(username, {})
+            for sid in old.keys() - new.keys():
+                self._decr(sid)
+            for sid in new.keys() - old.keys():
+                self._counts[sid] = self._counts.get(sid, 0) + 1
+            self._by_user[username] = new
+            self._version += 1
+
+    def add(self, username, sid):
+        """追加した場合は True（既にあれば False）"""
+        with self._lock:
+            favs = self._by_user.setdefault(username, {})
+            if sid in favs:
+                return False
+            favs[sid] = None
+            self._counts[sid] = self._counts.get(sid, 0) + 1
+            self._version += 1
+            return True
+
+    def remove(self, username, sid):
+        """削除した場合は True（無ければ False）"""
+        with self._lock:
+            favs = self._by_user.get(username)
+            if not favs or sid not in favs:
+                return False
+            del favs[sid]
+            self._decr(sid)
+            self._version += 1
+            return True
+
+    def _decr(self, sid):
+        n = self._counts.get(sid, 0) - 1
+        if n > 0:
+            self._counts[sid] = n
+        else:
+            self._counts.pop(sid, None)
+
+    def has(self, username, sid):
+        favs = self._by_user.get(username)
+        return bool(favs) and sid in favs
+
+    def favorites(self, username):
+        """登録順のお気に入り（未登録のユーザーは空）"""
+        return list(self._by_user.get(username, ()))
+
+    def count(self, sid):
+        return self._counts.get(sid, 0)
+
+    def ranking(self):
+        """[(種 id, 人数), ...] を人数の多い順（同数なら id 順）で返す"""
+        version, ranked = self._ranking
+        if version != self._version:
+            with self._lock:
+                version = self._version
+                ranked = sorted(self._counts.items(), key=lambda t: (-t[1], t[0]))
+            self._ranking = (version, ranked)
+        return ranked
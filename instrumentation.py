@@ -0,0 +1,44 @@
+# 鯨類まとめサイト - ルートごとの処理時間の集計
+
+import threading
+
+
+class RouteTimings:
+    """ルート（endpoint）ごとのリクエスト数・処理時間を集計する（スレッドセーフ）
+
+    setup は前処理（訪問数・週の切り替え・ログイン情報の準備）にかかった時間。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}  # endpoint -> [件数, 合計秒, 前処理の合計秒, 最大秒]
+
+    def record(self, endpoint, elapsed, setup=0.0):
+        with self._lock:
+            row = self._data.get(endpoint)
+            if row is None:
+                row = self._data[endpoint] = [0, 0.0, 0.0, 0.0]
+            row[0] += 1
+            row[1] += elapsed
+            row[2] += setup
+            if elapsed > row[3]:
+                row[3] = elapsed
+
+    def reset(self):
+        with self._lock:
+            self._data.clear()
+
+    def snapshot(self):
+        """endpoint 名順の集計結果（時間はミリ秒、前処理はマイクロ秒）"""
+        with self._lock:
+            rows = [(name, list(row)) for name, row in self._data.items()]
+        out = []
+        for name, (count, total, setup, peak) in sorted(rows):
+            out.append({
+                "endpoint": name,
+                "count": count,
+                "avg_ms": total / count * 1000,
+                "max_ms": peak * 1000,
+                "setup_us": setup / count * 1e6,
+            })
+        return out
@@ -0,0 +1,219 @@
+# 鯨類まとめサイト - Prometheus 形式のメトリクス（/metrics）
+#
+# リクエストのたびに更新する値（件数・ヒストグラム）は、スレッドごとに別の領域（shard）へ
+# 書き込むので、更新時にロックを取らない。各 shard を書くのはそのスレッドだけで、
+# /metrics の読み出し時に全 shard を合計する（終了したスレッドの分は合算して片付ける）。
+# 大きさ・キャッシュの命中率などは、読み出し時に関数を呼んで求める。
+
+import bisect
+import threading
+import time
+from functools import wraps
+
+# 秒。ページの処理時間向け
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 秒。ファイル・DB への読み書き向け（細かい方を多めに）
+IO_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _number(v):
+    if v == float("inf"):
+        return "+Inf"
+    if isinstance(v, float) and v.is_integer() and abs(v) < 1e15:
+        return str(int(v))
+    return repr(v)
+
+
+class _Sharded:
+    """スレッドごとの shard に行（ラベルの値の組 -> 数値のリスト）を持つ"""
+
+    kind = None
+    width = 1
+    MAX_SHARDS = 256
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._lock = threading.Lock()  # shard の登録・片付けのときだけ使う
+        self._shards = []  # [(スレッド, {ラベル: 行}), ...]
+        self._retired = {}  # 終了したスレッドの分の合計
+
+    def _row(self, labels):
+        rows = getattr(self._local, "rows", None)
+        if rows is None:
+            rows = self._local.rows = {}
+            with self._lock:
+                # リクエストごとにスレッドを作るサーバでは shard が増え続けるので、ときどき片付ける
+                if len(self._shards) >= self.MAX_SHARDS:
+                    self._retire()
+                self._shards.append((threading.current_thread(), rows))
+        row = rows.get(labels)
+        if row is None:
+            row = rows[labels] = [0] * self.width
+        return row
+
+    def collect(self):
+        """全スレッドの合計（ラベル -> 行）"""
+        with self._lock:
+            self._retire()
+            total = {labels: list(row) for labels, row in self._retired.items()}
+            for _, rows in self._shards:
+                # 書き込み中の shard を読むので、コピーしてから回す
+                self._merge(total, dict(rows))
+        return total
+
+    def _retire(self):
+        """終了したスレッドの shard を合計に移す（self._lock を持って呼ぶ）"""
+        live = []
+        for thread, rows in self._shards:
+            if thread.is_alive():
+                live.append((thread, rows))
+            else:
+                self._merge(self._retired, rows)
+        self._shards = live
+
+    @staticmethod
+    def _merge(into, rows):
+        for labels, row in rows.items():
+            acc = into.get(labels)
+            if acc is None:
+                into[labels] = list(row)
+            else:
+                for i, v in enumerate(row):
+                    acc[i] += v
+
+
+class Counter(_Sharded):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        self._row(labels)[0] += amount
+
+    def render(self):
+        yield from (f"{self.name}{_labels(self.labelnames, labels)} {_number(row[0])}"
+                    for labels, row in sorted(self.collect().items()))
+
+
+class Histogram(_Sharded):
+    """行は [各区間の件数..., +Inf の区間の件数, 合計, 件数]（区間ごとの件数は累積ではない）"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.width = len(self.buckets) + 3
+
+    def observe(self, value, *labels):
+        row = self._row(labels)
+        row[bisect.bisect_left(self.buckets, value)] += 1
+        row[-2] += value
+        row[-1] += 1
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        bounds = self.buckets + (float("inf"),)
+        for labels, row in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, n in zip(bounds, row):
+                cumulative += n
+                le = _labels(self.labelnames + ("le",), labels + (_number(float(bound)),))
+                yield f"{self.name}_bucket{le} {cumulative}"
+            base = _labels(self.labelnames, labels)
+            yield f"{self.name}_sum{base} {_number(row[-2])}"
+            yield f"{self.name}_count{base} {row[-1]}"
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+class Gauge:
+    """読み出し時に fn() を呼ぶ。fn は数値か {ラベルの値の組: 数値} を返す"""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, fn, labelnames=(), kind="gauge"):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labelnames = tuple(labelnames)
+        self.kind = kind
+
+    def render(self):
+        value = self.fn()
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        for labels, v in sorted(items):
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(v)}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name, help, fn, labelnames=(), kind="gauge"):
+        """kind="counter" にすると、増えるだけの値（キャッシュの命中数など）として出す"""
+        return self._add(Gauge(name, help, fn, labelnames, kind))
+
+    def render(self):
+        lines = []
+        for m in self._metrics:
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+def instrument(obj, names, histogram, *labels):
+    """obj のメソッド names を、処理時間を histogram（ラベル：メソッド名）に記録するものに置き換える"""
+    for name in names:
+        method = getattr(obj, name, None)
+        if method is None:
+            continue
+
+        def make(method, name):
+            @wraps(method)
+            def timed(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return method(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - started, *labels, name)
+            return timed
+
+        setattr(obj, name, make(method, name))
@@ -0,0 +1,139 @@
+# 鯨類まとめサイト - パスワードのハッシュ（リクエストのスレッドの外で実行）とログインの試行制限
+#
+# ハッシュの計算（既定の scrypt で 1 回 100ms 超）は上限つきのスレッドプールで行う。
+# hashlib の scrypt / pbkdf2 は計算中に GIL を手放すので、プールの本数を CPU の一部に
+# 抑えておけば、ログインが集中しても他のページの処理に CPU が残る。
+# プールの順番待ちが上限を超えたら HasherBusy を投げ、待たせずに断る。
+#
+# 強さ（PASSWORD_HASH_METHOD）を変えた場合は、次に正しくログインしたときに新しい強さで
+# ハッシュし直す（ログインの応答は待たせない）。
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+
+class HasherBusy(Exception):
+    """ハッシュの順番待ちが上限に達している"""
+
+
+def normalize_method(method):
+    """werkzeug の省略形（"scrypt" など）を、保存されるハッシュの先頭と同じ形にそろえる"""
+    name, *args = method.split(":")
+    if name == "scrypt" and not args:
+        return "scrypt:32768:8:1"
+    if name == "pbkdf2" and len(args) < 2:
+        return f"pbkdf2:{args[0] if args else 'sha256'}:{DEFAULT_PBKDF2_ITERATIONS}"
+    return method
+
+
+class PasswordHasher:
+    """ハッシュの作成・照合を上限つきのスレッドプールで行う
+
+    呼び出し側（リクエストのスレッド）は結果を待つが、待っている間は CPU を使わない。
+    同時に受け付けるのは実行中と順番待ちを合わせて max_pending 件まで。
+    """
+
+    def __init__(self, method="scrypt", max_workers=2, max_pending=32, name="password-hasher"):
+        self.method = normalize_method(method)
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def _call(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy()
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def hash(self, password):
+        return self._call(generate_password_hash, password, self.method).result()
+
+    def needs_rehash(self, pw_hash):
+        return pw_hash.split("$", 1)[0] != self.method
+
+    def verify(self, pw_hash, password, rehashed=None):
+        """照合結果を返す。一致して強さが古ければ、新しいハッシュをあとで rehashed(新しいハッシュ) に渡す"""
+        ok = self._call(check_password_hash, pw_hash, password).result()
+        if ok and rehashed is not None and self.needs_rehash(pw_hash):
+            try:
+                future = self._call(generate_password_hash, password, self.method)
+            except HasherBusy:
+                return ok  # 混んでいるときは次のログインに回す
+
+            def done(f):
+                if f.exception() is None:
+                    rehashed(f.result())
+
+            future.add_done_callback(done)
+        return ok
+
+
+class LoginThrottle:
+    """ユーザー名・IP アドレスごとのログイン失敗を数え、多すぎれば一定時間断る
+
+    失敗の時刻は窓（window 秒）の中の分だけを持ち、キーの数は max_keys 件までに抑える
+    （古いキーから捨てる）。ユーザー名ごとの上限は総当たり、IP ごとの上限は多数の
+    ユーザー名を試すリスト型攻撃への対策。
+    """
+
+    def __init__(self, user_limit=5, ip_limit=20, window=300.0, max_keys=10000):
+        self.limits = {"user": user_limit, "ip": ip_limit}
+        self.window = window
+        self.max_keys = max_keys
+        self._failures = OrderedDict()  # (種類, 値) -> [失敗時刻, ...]（古い順）
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def _recent(self, key, now):
+        times = self._failures.get(key)
+        if times is None:
+            return []
+        cutoff = now - self.window
+        while times and times[0] <= cutoff:
+            times.pop(0)
+        if not times:
+            del self._failures[key]
+        return times
+
+    def retry_after(self, username, ip, now=None):
+        """断る場合は再試行できるまでの秒数、受け付けるなら 0"""
+        now = time.monotonic() if now is None else now
+        wait = 0.0
+        with self._lock:
+            for key in (("user", username), ("ip", ip)):
+                times = self._recent(key, now)
+                limit = self.limits[key[0]]
+                if len(times) >= limit:
+                    wait = max(wait, times[-limit] + self.window - now)
+            if wait:
+                self.rejected += 1
+        return wait
+
+    def failed(self, username, ip, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            for key in (("user", username), ("ip", ip)):
+                times = self._recent(key, now)
+                times.append(now)
+                # 上限より古い分は判定に使わないので持たない
+                del times[:-self.limits[key[0]]]
+                self._failures[key] = times
+                self._failures.move_to_end(key)
+            while len(self._failures) > self.max_keys:
+                self._failures.popitem(last=False)
+
+    def succeeded(self, username):
+        with self._lock:
+            self._failures.pop(("user", username), None)
+
+    def stats(self):
+        return {"keys": len(self._failures), "max_keys": self.max_keys, "rejected": self.rejected}
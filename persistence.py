@@ -0,0 +1,118 @@
+# 鯨類まとめサイト - 書き込みの遅延・まとめ保存
+
+import atexit
+import logging
+import queue
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class WriteBehind:
+    """変更をメモリ上で数えておき、一定間隔または一定件数ごとにまとめて保存する
+
+    リクエスト側は mark() で「変更あり」を記録するだけで、ディスクへの書き込みは
+    バックグラウンドのスレッドが行う。プロセス終了時には残りを必ず書き出す。
+    """
+
+    def __init__(self, save, interval=5.0, max_pending=100, name="write-behind"):
+        self._save = save
+        self.interval = interval
+        self.max_pending = max_pending
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    @property
+    def pending(self):
+        """まだ保存されていない変更の件数"""
+        return self._pending
+
+    def mark(self, n=1):
+        with self._lock:
+            self._pending += n
+            full = self._pending >= self.max_pending
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        """未保存の変更があれば保存する（保存に失敗した分は次回に持ち越す）"""
+        with self._flush_lock:
+            with self._lock:
+                n = self._pending
+                self._pending = 0
+            if not n:
+                return 0
+            try:
+                self._save()
+            except Exception:
+                with self._lock:
+                    self._pending += n
+                log.exception("保存に失敗しました")
+                return 0
+            return n
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def close(self):
+        self._stopped = True
+        self._wake.set()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join(timeout=self.interval + 1)
+        self.flush()
+
+
+class BackgroundWriter:
+    """保存処理をキューに積み、専用のスレッドが積んだ順に実行する
+
+    メモリ上の値が正で、保存が多少遅れても困らないもの（ユーザー情報・お気に入り）に使う。
+    リクエストはディスクへの書き込みを待たない。キューが max_pending 件に達したら空きが
+    できるまで待つ（書き込みが追いつかないときにメモリを使い切らないための上限）。
+    プロセス終了時には残りをすべて実行する。
+    """
+
+    def __init__(self, max_pending=1000, name="background-writer"):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    @property
+    def pending(self):
+        """まだ実行されていない保存処理の件数"""
+        return self._queue.unfinished_tasks
+
+    def submit(self, save, *args):
+        self._queue.put((save, args))
+
+    def drain(self):
+        """積まれている保存処理がすべて終わるまで待つ"""
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                save, args = item
+                save(*args)
+            except Exception:
+                log.exception("保存に失敗しました")
+            finally:
+                self._queue.task_done()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            if self._thread is not threading.current_thread():
+                self._thread.join()
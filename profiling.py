@@ -0,0 +1,149 @@
+# 鯨類まとめサイト - リクエスト単位のプロファイル（必要なときだけ取る）
+#
+# 2通りの取り方がある。
+#   cProfile … 全関数の呼び出し回数・時間を記録する（重いので、指定されたリクエストだけ）
+#              結果は pstats 形式（.prof）。python -m pstats や snakeviz で開ける
+#   sampled  … StackSampler が一定間隔でスタックを覗くだけ（軽いので、一部のリクエストに常時使える）
+#              結果は collapsed stack 形式（.txt、1行が「呼び出し元;…;関数 回数」）。flamegraph.pl などで図にできる
+# 保存先のディレクトリには、各プロファイルの本体と、一覧用の情報（.json）を置く。
+
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def collapse(frame, max_depth=64):
+    """フレームから呼び出し元へ辿り、根元から順に ; で繋いだ1行にする"""
+    names = []
+    while frame is not None and len(names) < max_depth:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class StackSampler:
+    """登録されたスレッドのスタックを interval 秒ごとに数える（全スレッド分を1本のスレッドで）
+
+    対象が無い間は待機していて、CPU を使わない。
+    """
+
+    def __init__(self, interval=0.005, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._targets = {}  # スレッドID -> Counter(collapsed stack -> 回数)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self, ident):
+        with self._lock:
+            self._targets[ident] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def stop(self, ident):
+        """数え終えた結果（Counter）を返す"""
+        with self._lock:
+            return self._targets.pop(ident, Counter())
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                if not self._targets:
+                    self._wake.clear()
+                    continue
+                for ident, counts in self._targets.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        counts[collapse(frame, self.max_depth)] += 1
+            del frames
+
+
+class ProfileStore:
+    """プロファイルを directory に保存し、新しいものから keep 件だけ残す"""
+
+    SUFFIXES = {"cprofile": ".prof", "sampled": ".txt"}
+
+    def __init__(self, directory, keep=100):
+        self.directory = directory
+        self.keep = keep
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def new_id(self):
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+        return f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{seq:04d}"
+
+    def path(self, profile_id, kind):
+        return os.path.join(self.directory, profile_id + self.SUFFIXES[kind])
+
+    def save_cprofile(self, profile_id, profiler, meta):
+        os.makedirs(self.directory, exist_ok=True)
+        profiler.dump_stats(self.path(profile_id, "cprofile"))
+        self._save_meta(profile_id, "cprofile", meta)
+
+    def save_samples(self, profile_id, counts, meta):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.path(profile_id, "sampled"), "w", encoding="utf-8") as f:
+            for stack, n in counts.most_common():
+                f.write(f"{stack} {n}\n")
+        top = counts.most_common(1)[0][0].rsplit(";", 1)[-1] if counts else ""
+        self._save_meta(profile_id, "sampled", dict(meta, samples=sum(counts.values()), top=top))
+
+    def _save_meta(self, profile_id, kind, meta):
+        meta = dict(meta, id=profile_id, kind=kind, file=os.path.basename(self.path(profile_id, kind)))
+        tmp = os.path.join(self.directory, f".{profile_id}.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp, os.path.join(self.directory, profile_id + ".json"))
+        self._prune()
+
+    def _ids(self):
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        # ID は時刻から始まるので、名前の逆順が新しい順
+        return sorted((n[:-5] for n in names if n.endswith(".json") and not n.startswith(".")), reverse=True)
+
+    def _prune(self):
+        for profile_id in self._ids()[self.keep:]:
+            for suffix in (".json", *self.SUFFIXES.values()):
+                try:
+                    os.remove(os.path.join(self.directory, profile_id + suffix))
+                except OSError:
+                    pass
+
+    def recent(self, limit=100):
+        out = []
+        for profile_id in self._ids()[:limit]:
+            meta = self.get(profile_id)
+            if meta is not None:
+                out.append(meta)
+        return out
+
+    def get(self, profile_id):
+        """一覧用の情報（無ければ None）"""
+        if not profile_id or os.path.basename(profile_id) != profile_id or profile_id.startswith("."):
+            return None
+        try:
+            with open(os.path.join(self.directory, profile_id + ".json"), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
@@ -0,0 +1,452 @@
+# 鯨類まとめサイト - 検索用インデックス
+#
+# 種カタログ（catalog.py）から一度だけ構築し、リクエストごとの全件走査をなくすためのもの。
+# 標準ライブラリのみで動作する。
+
+import math
+from bisect import bisect_left
+
+
+def _name_fields(s):
+    return (s.get("jp", ""), s.get("en", ""), s.get("sci", ""))
+
+
+def _haystack(s):
+    # 旧実装（search() 内の線形走査）と同じ連結・小文字化
+    jp, en, sci = _name_fields(s)
+    return f"{jp} {en} {sci}".lower()
+
+
+def _bigrams(text):
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def _words(text):
+    # 英名・学名の単語（"Killer whale (Orca)" → killer / whale / orca）
+    out = []
+    word = []
+    for c in text.lower():
+        if c.isalnum():
+            word.append(c)
+        elif word:
+            out.append("".join(word))
+            word = []
+    if word:
+        out.append("".join(word))
+    return out
+
+
+class NameIndex:
+    """和名・英名・学名の転置インデックス
+
+    - 和名：文字バイグラム（全フィールドの連結文字列に対して張る）
+    - 英名・学名：単語の接頭辞トークン（順位付けに使う）
+    ヒット判定は旧実装と同じ「連結文字列への部分一致」で、バイグラムで候補を絞ってから確認する。
+    """
+
+    def __init__(self, species=()):
+        self._order = {}     # id -> カタログ内の並び順（同点時の安定ソート用）
+        self._keys = {}      # id -> 索引済みの名前（差分更新の判定用）
+        self._hay = {}       # id -> 連結・小文字化済みの文字列
+        self._names = {}     # id -> 小文字化した (jp, en, sci)
+        self._grams = {}     # バイグラム -> {id}
+        self._chars = {}     # 1文字 -> {id}（1文字検索用）
+        self._prefixes = {}  # 英名/学名の単語接頭辞 -> {id}
+        self.sync(species)
+
+    def __len__(self):
+        return len(self._hay)
+
+    def clone(self):
+        """複製を返す（複製側を sync してから差し替えれば、検索中の読み手に影響しない）"""
+        other = NameIndex.__new__(NameIndex)
+        other._order = dict(self._order)
+        other._keys = dict(self._keys)
+        other._hay = dict(self._hay)
+        other._names = dict(self._names)
+        for attr in ("_grams", "_chars", "_prefixes"):
+            setattr(other, attr, {k: set(v) for k, v in getattr(self, attr).items()})
+        return other
+
+    # ---- 構築・差分更新 ----
+
+    def _add(self, s):
+        sid = s["id"]
+        hay = _haystack(s)
+        self._keys[sid] = _name_fields(s)
+        self._hay[sid] = hay
+        self._names[sid] = tuple(x.lower() for x in _name_fields(s))
+        for g in _bigrams(hay):
+            self._grams.setdefault(g, set()).add(sid)
+        for c in set(hay):
+            self._chars.setdefault(c, set()).add(sid)
+        for p in self._prefix_tokens(s):
+            self._prefixes.setdefault(p, set()).add(sid)
+
+    def _remove(self, sid):
+        hay = self._hay.pop(sid, None)
+        if hay is None:
+            return
+        key = self._keys.pop(sid)
+        self._names.pop(sid, None)
+        for table, tokens in (
+            (self._grams, _bigrams(hay)),
+            (self._chars, set(hay)),
+            (self._prefixes, self._prefix_tokens({"en": key[1], "sci": key[2]})),
+        ):
+            for t in tokens:
+                ids = table.get(t)
+                if ids is None:
+                    continue
+                ids.discard(sid)
+                if not ids:
+                    del table[t]
+
+    @staticmethod
+    def _prefix_tokens(s):
+        out = set()
+        for w in _words(s.get("en", "")) + _words(s.get("sci", "")):
+            for i in range(1, len(w) + 1):
+                out.add(w[:i])
+        return out
+
+    def sync(self, species):
+        """カタログとの差分だけを索引し直す（追加・変更・削除された種のみ）"""
+        seen = set()
+        for pos, s in enumerate(species):
+            sid = s["id"]
+            seen.add(sid)
+            self._order[sid] = pos
+            if self._keys.get(sid) != _name_fields(s):
+                self._remove(sid)
+                self._add(s)
+        for sid in [sid for sid in self._hay if sid not in seen]:
+            self._remove(sid)
+            self._order.pop(sid, None)
+
+    # ---- 検索 ----
+
+    def _candidates(self, q):
+        if len(q) == 1:
+            return set(self._chars.get(q, ()))
+        postings = []
+        for g in _bigrams(q):
+            ids = self._grams.get(g)
+            if not ids:
+                return set()
+            postings.append(ids)
+        postings.sort(key=len)
+        out = set(postings[0])
+        for ids in postings[1:]:
+            out &= ids
+            if not out:
+                break
+        return out
+
+    def _rank(self, sid, q):
+        names = self._names[sid]
+        if q in names:
+            return 0  # 名前と完全一致
+        if any(n.startswith(q) for n in names):
+            return 1  # 名前の先頭一致
+        if sid in self._prefixes.get(q, ()):
+            return 2  # 英名・学名の単語の先頭一致
+        return 3      # その他の部分一致
+
+    def search(self, q):
+        """部分一致した種の id を順位順に返す"""
+        q = (q or "").lower()
+        if not q:
+            return []
+        hits = [sid for sid in self._candidates(q) if q in self._hay[sid]]
+        hits.sort(key=lambda sid: (self._rank(sid, q), self._order[sid]))
+        return hits
+
+
+class PrefixSuggester:
+    """入力補完用の接頭辞テーブル（ソート済み配列 + 二分探索）
+
+    名前全体の先頭一致を優先し、足りなければ英名・学名の単語の先頭一致で補う。
+    """
+
+    def __init__(self, species=()):
+        self.build(species)
+
+    def build(self, species):
+        names = []
+        words = []
+        for pos, s in enumerate(species):
+            for field in ("jp", "en", "sci"):
+                label = s.get(field, "")
+                if not label:
+                    continue
+                names.append((label.lower(), pos, s["id"], label))
+                for w in _words(label)[1:]:
+                    words.append((w, pos, s["id"], label))
+        names.sort()
+        words.sort()
+        # 参照の付け替えだけで切り替える（構築中の検索は旧テーブルを見る）
+        self._tables = (
+            ([t[0] for t in names], names),
+            ([t[0] for t in words], words),
+        )
+
+    def suggest(self, q, limit=8):
+        """q で始まる名前を最大 limit 件、(id, 表示名) で返す"""
+        q = (q or "").strip().lower()
+        if not q or limit <= 0:
+            return []
+        out = []
+        seen = set()
+        for keys, rows in self._tables:
+            i = bisect_left(keys, q)
+            while i < len(keys) and keys[i].startswith(q):
+                _, _, sid, label = rows[i]
+                i += 1
+                if sid in seen:
+                    continue
+                seen.add(sid)
+                out.append((sid, label))
+                if len(out) >= limit:
+                    return out
+        return out
+
+
+def _levenshtein(a, b, limit):
+    """編集距離（limit を超えることが確定した時点で limit + 1 を返す）"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        row_min = i
+        for j, cb in enumerate(b, 1):
+            d = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb))
+            cur.append(d)
+            if d < row_min:
+                row_min = d
+        if row_min > limit:
+            return limit + 1
+        prev = cur
+    return prev[-1]
+
+
+class BKTree:
+    """編集距離の BK-tree（三角不等式で枝刈りして近い語だけを辿る）"""
+
+    def __init__(self, words=()):
+        self._root = None
+        for w in words:
+            self.add(w)
+
+    def add(self, word):
+        if self._root is None:
+            self._root = (word, {})
+            return
+        node = self._root
+        while True:
+            w, children = node
+            d = _levenshtein(word, w, max(len(word), len(w)))
+            if d == 0:
+                return
+            child = children.get(d)
+            if child is None:
+                children[d] = (word, {})
+                return
+            node = child
+
+    def find(self, word, max_dist):
+        """word から距離 max_dist 以内の語を (語, 距離) で返す"""
+        if self._root is None:
+            return []
+        out = []
+        stack = [self._root]
+        while stack:
+            w, children = stack.pop()
+            # 枝刈りに使うため、上限は子の距離の範囲まで広げて測る
+            d = _levenshtein(word, w, max_dist + max(children, default=0))
+            if d <= max_dist:
+                out.append((w, d))
+            for cd, child in children.items():
+                if d - max_dist <= cd <= d + max_dist:
+                    stack.append(child)
+        return out
+
+
+class FuzzyNameIndex:
+    """英名・学名の単語に対する誤字許容検索"""
+
+    def __init__(self, species=()):
+        self.build(species)
+
+    @staticmethod
+    def max_distance(word):
+        # 短い語ほど許容する誤字を少なくする
+        if len(word) <= 3:
+            return 0
+        if len(word) <= 6:
+            return 1
+        return 2
+
+    def build(self, species):
+        token_ids = {}
+        order = {}
+        for pos, s in enumerate(species):
+            order[s["id"]] = pos
+            for w in _words(s.get("en", "")) + _words(s.get("sci", "")):
+                token_ids.setdefault(w, set()).add(s["id"])
+        tree = BKTree(sorted(token_ids))
+        self._token_ids, self._order, self._tree = token_ids, order, tree
+
+    def search(self, q):
+        """q の各単語が誤字の範囲で一致する種の id を (id, 距離合計) の近い順で返す"""
+        words = _words(q or "")
+        if not words:
+            return []
+        token_ids, order, tree = self._token_ids, self._order, self._tree
+        total = None
+        for w in words:
+            best = {}
+            for token, d in tree.find(w, self.max_distance(w)):
+                for sid in token_ids[token]:
+                    if d < best.get(sid, d + 1):
+                        best[sid] = d
+            if total is None:
+                total = best
+            else:
+                total = {sid: total[sid] + d for sid, d in best.items() if sid in total}
+            if not total:
+                return []
+        return sorted(total.items(), key=lambda t: (t[1], order[t[0]]))
+
+
+def _is_word_char(c):
+    return c.isascii() and c.isalnum()
+
+
+def _text_tokens(text):
+    """本文の分かち書き：英数字は単語、それ以外（日本語）は文字バイグラム
+
+    (トークン, 開始位置, 終了位置) を返す。位置はスニペット作成に使う。
+    """
+    out = []
+    i = 0
+    n = len(text)
+    while i < n:
+        c = text[i]
+        if _is_word_char(c):
+            j = i
+            while j < n and _is_word_char(text[j]):
+                j += 1
+            out.append((text[i:j].lower(), i, j))
+            i = j
+        elif c.isspace() or not c.isalnum():
+            i += 1
+        else:
+            j = i
+            while j < n and text[j].isalnum() and not _is_word_char(text[j]):
+                j += 1
+            if j - i == 1:
+                out.append((text[i], i, j))
+            for k in range(i, j - 1):
+                out.append((text[k:k + 2], k, k + 2))
+            i = j
+    return out
+
+
+class FullTextIndex:
+    """分布・生態の本文に対する BM25 全文検索
+
+    語ごとの出現位置を索引時に保存しておき、スニペットはその位置から切り出す。
+    """
+
+    FIELDS = ("distribution", "ecology")
+
+    def __init__(self, species=(), k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.build(species)
+
+    def build(self, species):
+        postings = {}  # 語 -> {id: [(フィールド, 開始, 終了), ...]}
+        lengths = {}
+        texts = {}
+        order = {}
+        for pos, s in enumerate(species):
+            sid = s["id"]
+            order[sid] = pos
+            texts[sid] = {f: s.get(f, "") or "" for f in self.FIELDS}
+            dl = 0
+            for f in self.FIELDS:
+                for tok, start, end in _text_tokens(texts[sid][f]):
+                    postings.setdefault(tok, {}).setdefault(sid, []).append((f, start, end))
+                    dl += 1
+            lengths[sid] = dl
+        avgdl = (sum(lengths.values()) / len(lengths)) if lengths else 0.0
+        self._postings, self._lengths, self._texts = postings, lengths, texts
+        self._order, self._avgdl = order, avgdl or 1.0
+
+    def _idf(self, df):
+        n = len(self._lengths)
+        return math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, q, limit=None):
+        """BM25 の点数順に (id, 点数, 一致位置のリスト) を返す"""
+        terms = {tok for tok, _, _ in _text_tokens(q or "")}
+        postings, lengths = self._postings, self._lengths
+        k1, b, avgdl = self.k1, self.b, self._avgdl
+        scores = {}
+        hits = {}
+        for t in terms:
+            docs = postings.get(t)
+            if not docs:
+                continue
+            idf = self._idf(len(docs))
+            for sid, offsets in docs.items():
+                tf = len(offsets)
+                norm = k1 * (1.0 - b + b * lengths[sid] / avgdl)
+                scores[sid] = scores.get(sid, 0.0) + idf * tf * (k1 + 1.0) / (tf + norm)
+                hits.setdefault(sid, []).extend(offsets)
+        ranked = sorted(scores.items(), key=lambda t: (-t[1], self._order[t[0]]))
+        if limit is not None:
+            ranked = ranked[:limit]
+        return [(sid, score, hits[sid]) for sid, score in ranked]
+
+    def snippet(self, sid, offsets, width=120):
+        """一致位置が最も密な範囲を切り出し、[(文字列, 一致かどうか), ...] で返す"""
+        if not offsets:
+            return []
+        best = None
+        for f in self.FIELDS:
+            # 重なり・隣接するバイグラムの位置はひとつにまとめる
+            spans = []
+            for start, end in sorted((st, e) for ff, st, e in offsets if ff == f):
+                if spans and start <= spans[-1][1]:
+                    spans[-1][1] = max(spans[-1][1], end)
+                else:
+                    spans.append([start, end])
+            k = 0
+            for i, (start, _) in enumerate(spans):
+                lo = max(0, start - width // 3)
+                k = max(k, i)
+                while k < len(spans) and spans[k][1] <= lo + width:
+                    k += 1
+                if best is None or k - i > best[0]:
+                    best = (k - i, f, lo, spans[i:k])
+        _, f, lo, spans = best
+        text = self._texts[sid][f]
+        hi = min(len(text), lo + width)
+        out = []
+        if lo > 0:
+            out.append(("…", False))
+        pos = lo
+        for start, end in spans:
+            if start > pos:
+                out.append((text[pos:start].replace("\n", " "), False))
+            out.append((text[start:end], True))
+            pos = end
+        if pos < hi:
+            out.append((text[pos:hi].replace("\n", " "), False))
+        if hi < len(text):
+            out.append(("…", False))
+        return out
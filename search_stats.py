@@ -0,0 +1,179 @@
+# 鯨類まとめサイト - 検索回数の時間ごとの集計（直近24時間・7日・30日の順位と急上昇）
+#
+# 検索回数は1時間（時 = エポック秒 // 3600）ごとの枠で数える。
+#   今の1時間   … 共有カウンタ表（shared_counters.py）の search:<種id>。全ワーカで共通
+#   過ぎた1時間 … 時間の切り替えに最初に気づいたワーカが共有カウンタ表から取り出し、
+#                 data/search_history/YYYY-MM.tsv に「時<TAB>種id<TAB>回数」で追記する
+# 各ワーカは追記されたファイルを前回の続きから読み、直近 HOURS 時間分だけを固定長のリング
+# （HourlyRing）に持つ。それより古い分はファイルに残る（メモリには載せない）。
+
+import datetime
+import os
+import threading
+import time
+
+# リングに持つ時間数（30日）
+HOURS = 30 * 24
+
+
+def hour_of(ts=None):
+    return int((time.time() if ts is None else ts) // 3600)
+
+
+def week_last_hour(week_id):
+    """ISO 週 id（"2026-W42"）の最後の1時間の時（週の区切りはローカル時刻）。読めなければ None
+
+    週ごとに数えていた頃の検索回数を、その週の分として履歴に残すのに使う。
+    """
+    try:
+        year, week = (int(x) for x in str(week_id).split("-W"))
+        monday = datetime.date.fromisocalendar(year, week, 1)
+    except ValueError:
+        return None
+    end = datetime.datetime.combine(monday + datetime.timedelta(days=7), datetime.time())
+    return hour_of(end.timestamp()) - 1
+
+
+def add_counts(into, counts):
+    for key, n in counts.items():
+        into[key] = into.get(key, 0) + n
+    return into
+
+
+class HourlyRing:
+    """直近 size 時間分の {キー: 回数} を時ごとに持つ固定長のリング"""
+
+    def __init__(self, size=HOURS):
+        self.size = size
+        self._hours = [None] * size
+        self._counts = [None] * size
+        self.version = 0  # 中身が変わるたびに増える
+
+    def add(self, hour, counts):
+        i = hour % self.size
+        if self._hours[i] != hour:
+            if self._hours[i] is not None and self._hours[i] > hour:
+                return  # リングより古い
+            self._hours[i] = hour
+            self._counts[i] = {}
+        add_counts(self._counts[i], counts)
+        self.version += 1
+
+    def totals(self, start, stop):
+        """start <= 時 < stop の合計"""
+        out = {}
+        for hour in range(max(start, stop - self.size), stop):
+            i = hour % self.size
+            if self._hours[i] == hour:
+                add_counts(out, self._counts[i])
+        return out
+
+
+class SearchHistory:
+    """過ぎた時間の検索回数を月ごとのファイルに追記し、直近の分をリングに持つ
+
+    他のワーカが追記した分は refresh_interval 秒に1回、ファイルの大きさを見て読み足す。
+    """
+
+    def __init__(self, directory, hours=HOURS, refresh_interval=5.0):
+        self.directory = directory
+        self.ring = HourlyRing(hours)
+        self.refresh_interval = refresh_interval
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._offsets = {}  # ファイル名 -> 読んだバイト数
+        self._refreshed = 0.0
+        self._memo = {}  # 時間数 -> (今の時, リングの版, 合計)
+        self.refresh()
+
+    @staticmethod
+    def _file_name(hour):
+        return time.strftime("%Y-%m", time.gmtime(hour * 3600)) + ".tsv"
+
+    def archive(self, hour, counts):
+        """過ぎた1時間分を追記する（時間を切り替えたワーカだけが呼ぶ）"""
+        lines = "".join(f"{hour}\t{key}\t{n}\n" for key, n in sorted(counts.items()) if n)
+        if lines:
+            # 1回の write で追記するので、他のワーカが読んでも行の途中で混ざらない
+            with open(os.path.join(self.directory, self._file_name(hour)), "a", encoding="utf-8") as f:
+                f.write(lines)
+        self.refresh(force=True)
+
+    def refresh(self, force=False):
+        """窓に入る月のファイルのうち、まだ読んでいない部分をリングに入れる"""
+        now = time.monotonic()
+        if not force and now - self._refreshed < self.refresh_interval:
+            return
+        with self._lock:
+            self._refreshed = now
+            stop = hour_of() + 1
+            names = sorted({self._file_name(h) for h in range(stop - self.ring.size, stop, 24)}
+                           | {self._file_name(stop - 1)})
+            for name in names:
+                self._read(name)
+
+    def _read(self, name):
+        path = os.path.join(self.directory, name)
+        offset = self._offsets.get(name, 0)
+        try:
+            if os.path.getsize(path) <= offset:
+                return
+            with open(path, "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except OSError:
+            return
+        # 書きかけの最終行は次回に回す
+        data = data[:data.rfind(b"\n") + 1]
+        self._offsets[name] = offset + len(data)
+        for line in data.decode("utf-8").splitlines():
+            parts = line.split("\t")
+            if len(parts) != 3:
+                continue
+            try:
+                self.ring.add(int(parts[0]), {parts[1]: int(parts[2])})
+            except ValueError:
+                continue
+
+    def window(self, hours, current=None, now_hour=None):
+        """直近 hours 時間（今の1時間を含む）の合計。current は今の1時間の分
+
+        過ぎた時間の分の合計は、時またはリングの中身が変わるまで使い回す。
+        """
+        self.refresh()
+        if now_hour is None:
+            now_hour = hour_of()
+        memo = self._memo.get(hours)
+        if memo is None or memo[:2] != (now_hour, self.ring.version):
+            with self._lock:
+                memo = (now_hour, self.ring.version, self.ring.totals(now_hour - hours + 1, now_hour))
+            self._memo[hours] = memo
+        return add_counts(dict(memo[2]), current or {})
+
+    def before(self, hours, skip, now_hour=None):
+        """直近 skip 時間より前の hours 時間分の合計（急上昇の比較の基準に使う）"""
+        self.refresh()
+        if now_hour is None:
+            now_hour = hour_of()
+        stop = now_hour - skip + 1
+        with self._lock:
+            return self.ring.totals(stop - hours, stop)
+
+
+def trending(recent, baseline, recent_hours, baseline_hours, min_count=3, prior=1.0):
+    """直近の回数が、それ以前のペースから見込まれる回数の何倍かで並べる
+
+    [(キー, 倍率, 直近の回数, 見込み), ...] を倍率の大きい順に返す。回数の少ないものが
+    偶然の1〜2回で上位に来ないよう、min_count 回未満は除き、両方に prior を足してから比べる。
+    """
+    scale = recent_hours / baseline_hours
+    out = []
+    for key, n in recent.items():
+        if n < min_count:
+            continue
+        expected = baseline.get(key, 0) * scale
+        score = (n + prior) / (expected + prior)
+        if score > 1:
+            out.append((key, score, n, expected))
+    out.sort(key=lambda t: (-t[1], -t[2], t[0]))
+    return out
@@ -0,0 +1,224 @@
+# 鯨類まとめサイト - ワーカプロセス間で共有するカウンタ表
+#
+# data/counters.shm を mmap し、同じマシン上の全ワーカが同じ表を読み書きする。
+#   読み取り … ロックなし（8バイト境界に揃えた整数を1回読むだけ）
+#   加算     … その枠だけをバイト範囲ロック（fcntl.lockf）して読み・足し・書き
+#   枠の追加 … 表全体のロック（ヘッダ部分のバイト範囲ロック）を取ってから
+#
+# fcntl の無い環境（Windows）では無名 mmap 上の同じ表をスレッドロックだけで扱う
+# （プロセス間では共有されない）。
+
+import mmap
+import os
+import struct
+import threading
+import zlib
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+MAGIC = b"CTRS"
+FORMAT_VERSION = 1
+
+# ヘッダ：マジック(4) 形式版(u32) 枠数(u32) 使用中の枠数(u32) … 64バイト
+_HEADER = struct.Struct("<4sIII")
+HEADER_SIZE = 64
+# 枠：キー長(1) キー(55) 値(i64) … 64バイト。値は8バイト境界に置く
+SLOT_SIZE = 64
+KEY_MAX = 55
+_VALUE = struct.Struct("<q")
+VALUE_OFFSET = 56
+
+_STRIPES = 64
+
+
+class CounterTableFull(Exception):
+    pass
+
+
+class SharedCounters:
+    """キー（文字列）→ 整数 の共有カウンタ表（開番地法のハッシュ表）"""
+
+    def __init__(self, path=None, slots=16384, seed=None):
+        self.path = path
+        self.slots = slots
+        self._size = HEADER_SIZE + SLOT_SIZE * slots
+        self._table_lock = threading.Lock()
+        self._stripes = [threading.Lock() for _ in range(_STRIPES)]
+        self._index = {}  # このプロセスで見つけたキー -> 枠番号
+        self._fd = None
+        if path is not None and fcntl is not None:
+            self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            with self._locked(0, HEADER_SIZE, self._table_lock):
+                if os.fstat(self._fd).st_size < self._size:
+                    os.ftruncate(self._fd, self._size)
+                self._mm = mmap.mmap(self._fd, self._size)
+                self._init_header(seed)
+        else:
+            self._mm = mmap.mmap(-1, self._size)
+            with self._table_lock:
+                self._init_header(seed)
+
+    def _init_header(self, seed):
+        magic, version, slots, _ = _HEADER.unpack_from(self._mm, 0)
+        if magic == MAGIC and version == FORMAT_VERSION and slots == self.slots:
+            return  # 他のワーカが作成済み
+        # 新規作成（形式が違う古い表は作り直す）。初期値は保存先の値から
+        self._mm[:] = bytes(self._size)
+        _HEADER.pack_into(self._mm, 0, MAGIC, FORMAT_VERSION, self.slots, 0)
+        for key, value in (seed or {}).items():
+            slot = self._insert(key)
+            _VALUE.pack_into(self._mm, self._value_offset(slot), value)
+
+    # ---- ロック ----
+
+    @contextmanager
+    def _locked(self, offset, length, thread_lock):
+        # lockf はプロセス単位のロックなので、同じプロセス内のスレッド間はスレッドロックで排他する
+        with thread_lock:
+            if self._fd is None:
+                yield
+                return
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, length, offset, os.SEEK_SET)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, length, offset, os.SEEK_SET)
+
+    # ---- 枠の検索・追加 ----
+
+    @staticmethod
+    def _slot_offset(slot):
+        return HEADER_SIZE + SLOT_SIZE * slot
+
+    def _value_offset(self, slot):
+        return self._slot_offset(slot) + VALUE_OFFSET
+
+    def _read_key(self, slot):
+        off = self._slot_offset(slot)
+        n = self._mm[off]
+        if not n:
+            return None
+        return self._mm[off + 1:off + 1 + n].decode("utf-8")
+
+    def _probe(self, key):
+        """キーの枠番号を返す（無ければ None）。ロックなしで辿る"""
+        slot = zlib.crc32(key.encode("utf-8")) % self.slots
+        for _ in range(self.slots):
+            found = self._read_key(slot)
+            if found is None:
+                return None
+            if found == key:
+                return slot
+            slot = (slot + 1) % self.slots
+        return None
+
+    def _insert(self, key):
+        """表全体のロックを取った状態で呼ぶ"""
+        raw = key.encode("utf-8")
+        if not 0 < len(raw) <= KEY_MAX:
+            raise ValueError(f"キーが長すぎます：{key}")
+        slot = zlib.crc32(raw) % self.slots
+        for _ in range(self.slots):
+            found = self._read_key(slot)
+            if found == key:
+                return slot
+            if found is None:
+                off = self._slot_offset(slot)
+                self._mm[off + 1:off + 1 + len(raw)] = raw
+                _VALUE.pack_into(self._mm, off + VALUE_OFFSET, 0)
+                # キー長を最後に書く（読み手は長さ0の枠を空とみなすので、途中の状態は見えない）
+                self._mm[off] = len(raw)
+                _, _, _, used = _HEADER.unpack_from(self._mm, 0)
+                struct.pack_into("<I", self._mm, 12, used + 1)
+                return slot
+            slot = (slot + 1) % self.slots
+        raise CounterTableFull(f"カウンタ表がいっぱいです（{self.slots} 枠）")
+
+    def _slot(self, key, create):
+        slot = self._index.get(key)
+        if slot is None:
+            slot = self._probe(key)
+            if slot is None:
+                if not create:
+                    return None
+                with self._locked(0, HEADER_SIZE, self._table_lock):
+                    slot = self._insert(key)
+            self._index[key] = slot
+        return slot
+
+    # ---- 読み書き ----
+
+    def get(self, key, default=0):
+        """ロックなしで現在値を読む"""
+        slot = self._slot(key, create=False)
+        if slot is None:
+            return default
+        return _VALUE.unpack_from(self._mm, self._value_offset(slot))[0]
+
+    def add(self, key, delta=1):
+        """原子的に加算し、加算後の値を返す"""
+        slot = self._slot(key, create=True)
+        off = self._value_offset(slot)
+        with self._locked(off, 8, self._stripes[slot % _STRIPES]):
+            value = _VALUE.unpack_from(self._mm, off)[0] + delta
+            _VALUE.pack_into(self._mm, off, value)
+        return value
+
+    def set(self, key, value):
+        slot = self._slot(key, create=True)
+        off = self._value_offset(slot)
+        with self._locked(off, 8, self._stripes[slot % _STRIPES]):
+            _VALUE.pack_into(self._mm, off, value)
+
+    def items(self, prefix=""):
+        """prefix で始まるキーの {キー（prefix を除く）: 値} を返す。ロックなし"""
+        _, _, _, used = _HEADER.unpack_from(self._mm, 0)
+        if used != len(self._index):
+            # 他のワーカが追加した枠を拾い直す
+            for slot in range(self.slots):
+                key = self._read_key(slot)
+                if key is not None:
+                    self._index[key] = slot
+        out = {}
+        for key, slot in list(self._index.items()):
+            if key.startswith(prefix):
+                out[key[len(prefix):]] = _VALUE.unpack_from(self._mm, self._value_offset(slot))[0]
+        return out
+
+    def set_and_take(self, key, value, prefix):
+        """key の値が value と異なれば value にし、prefix で始まる値をすべて取り出して0にする
+
+        時間の切り替えのように、複数のワーカが同時に気づいても一度だけ行いたい処理に使う。
+        切り替えた場合は (key の元の値（無ければ None）, {キー（prefix を除く）: 0にする前の値}) を、
+        既に value だった場合は None を返す。各枠は読むのと0にするのを同じロックの中で行うので、
+        同時に加算されても取り出した値と残った値の間で数え漏れない。
+        """
+        if self.get(key, None) == value:
+            return None
+        with self._locked(0, HEADER_SIZE, self._table_lock):
+            old = self.get(key, None)
+            if old == value:
+                return None
+            taken = {}
+            for name in self.items(prefix):
+                slot = self._index[prefix + name]
+                off = self._value_offset(slot)
+                with self._locked(off, 8, self._stripes[slot % _STRIPES]):
+                    n = _VALUE.unpack_from(self._mm, off)[0]
+                    _VALUE.pack_into(self._mm, off, 0)
+                if n:
+                    taken[name] = n
+            slot = self._insert(key)
+            _VALUE.pack_into(self._mm, self._value_offset(slot), value)
+            self._index[key] = slot
+        return old, taken
+
+    def close(self):
+        self._mm.close()
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
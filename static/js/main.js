@@ -19,7 +19,103 @@
     update();
   }
 
+  // ヘッダ検索窓の入力補完（打鍵ごとに送らないよう少し待ってから問い合わせる）
+  function setupSearchSuggest() {
+    var form = document.querySelector('.search-mini[data-suggest-url]');
+    if (!form || !window.fetch) return;
+    var input = form.querySelector('input[name="q"]');
+    var list = document.getElementById('search-suggest');
+    if (!input || !list) return;
+
+    var url = form.getAttribute('data-suggest-url');
+    var timer = null;
+    var lastQuery = '';
+
+    function render(items) {
+      list.innerHTML = '';
+      items.forEach(function (item) {
+        var opt = document.createElement('option');
+        opt.value = item.label;
+        opt.label = item.jp + ' / ' + item.sci;
+        list.appendChild(opt);
+      });
+    }
+
+    function fetchSuggest() {
+      var q = (input.value || '').trim();
+      if (q === lastQuery) return;
+      lastQuery = q;
+      if (!q) {
+        render([]);
+        return;
+      }
+      fetch(url + '?q=' + encodeURIComponent(q))
+        .then(function (res) { return res.ok ? res.json() : { suggestions: [] }; })
+        .then(function (data) {
+          // 応答待ちの間に入力が変わっていたら捨てる
+          if (q === lastQuery) render(data.suggestions || []);
+        })
+        .catch(function () {});
+    }
+
+    input.addEventListener('input', function () {
+      if (timer) clearTimeout(timer);
+      timer = setTimeout(fetchSuggest, 150);
+    });
+  }
+
+  // 談話室の新着を受け取って一覧の先頭に足す（サーバは送ったら切断し、EventSource が自動で再接続する）
+  function setupBbsLive() {
+    var list = document.getElementById('bbs-live');
+    if (!list || !window.EventSource) return;
+
+    function buildItem(m) {
+      var li = document.createElement('li');
+      li.className = 'bbs-item';
+      var card = document.createElement('div');
+      card.className = 'bbs-card';
+      var meta = document.createElement('div');
+      meta.className = 'bbs-meta';
+      var ts = document.createElement('span');
+      ts.className = 'mono';
+      ts.textContent = m.ts;
+      var user = document.createElement('span');
+      user.className = 'bbs-user';
+      user.textContent = m.user;
+      var text = document.createElement('div');
+      text.className = 'bbs-text';
+      text.textContent = m.text;
+      meta.appendChild(ts);
+      meta.appendChild(user);
+      card.appendChild(meta);
+      card.appendChild(text);
+      li.appendChild(card);
+      return li;
+    }
+
+    var source = new EventSource(list.getAttribute('data-stream-url'));
+    source.addEventListener('message', function (e) {
+      var m;
+      try {
+        m = JSON.parse(e.data);
+      } catch (err) {
+        return;
+      }
+      list.insertBefore(buildItem(m), list.firstChild);
+      list.hidden = false;
+      var empty = document.getElementById('bbs-empty');
+      if (empty) empty.remove();
+      // 1ページ分を超えた古いものは落とす
+      var max = list.getAttribute('data-page-size');
+      while (max && list.children.length > parseInt(max, 10)) {
+        list.removeChild(list.lastChild);
+      }
+    });
+  }
+
   document.addEventListener('DOMContentLoaded', function () {
     setupBbsCounter();
+    setupBbsLive();
+    setupSearchSuggest();
   });
 })();
@@ -0,0 +1,510 @@
+# 鯨類まとめサイト - 保存先（ファイル / SQLite）
+#
+# ユーザー・お気に入り・談話室・カウンタの読み書きはすべてここを通す。
+# どちらを使うかは app.config["STORAGE_BACKEND"]（環境変数 STORAGE_BACKEND）で選ぶ。
+#   file   … 従来どおり data/ 配下の JSON / CSV（既定）
+#   sqlite … data/cetacean.sqlite3（WAL モード）。初回に data/ のファイルから自動で取り込む
+#
+#   python storage.py migrate   # SQLite への取り込みだけを手動で行う
+
+import csv
+import io
+import json
+import os
+import sqlite3
+import struct
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows：プロセス間の排他は行わない
+    fcntl = None
+
+import counter_log
+from counter_log import CounterLog, apply_event, empty_state
+from search_stats import week_last_hour
+
+
+def load_json(path, default):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception:
+        return default
+
+
+def save_json(path, obj):
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(obj, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+_U64 = struct.Struct("<Q")
+BBS_FIELDS = ['ts', 'user', 'text']
+
+
+def _pread(fd, n, offset):
+    # os.pread は Windows に無いので lseek + read で代用（呼び出し側で排他済み）
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.read(fd, n)
+
+
+def _pwrite(fd, data, offset):
+    os.lseek(fd, offset, os.SEEK_SET)
+    os.write(fd, data)
+
+
+def _csv_rows(data):
+    return [
+        {'ts': row.get('ts', ''), 'user': row.get('user', ''), 'text': row.get('text', '')}
+        for row in csv.DictReader(io.StringIO(data.decode('utf-8'), newline=''), fieldnames=BBS_FIELDS)
+    ]
+
+
+class FileStorage:
+    """data/ 配下の JSON / CSV に保存する（従来の形式）
+
+    談話室の CSV には、各行の先頭バイト位置を並べた索引（bbs_messages.csv.idx）を横に置き、
+    任意のページを「索引から位置を読む → CSV を1回シークして読む」だけで取り出す。
+    """
+
+    name = "file"
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self.visitor_file = os.path.join(data_dir, 'visitor_count.json')
+        self.search_file = os.path.join(data_dir, 'search_counts.json')
+        self.bbs_file = os.path.join(data_dir, 'bbs_messages.csv')
+        self.bbs_index_file = self.bbs_file + '.idx'
+        self._bbs_lock = threading.Lock()
+        self.users_file = os.path.join(data_dir, 'users.json')
+        self.counter_dir = os.path.join(data_dir, 'counters')
+        self._users = {}
+
+    # ---- ユーザー・お気に入り ----
+
+    def load_users(self):
+        users = load_json(self.users_file, {})
+        if not isinstance(users, dict):
+            users = {}
+        self._users = users
+        # 書き出し中（別スレッド）に呼び出し側が人を増やしても壊れないよう、辞書は別にして返す
+        return dict(users)
+
+    def save_user(self, username, rec):
+        # JSON は1ファイルなので、1人分の変更でも全員分を書き直す
+        self._users[username] = dict(rec)
+        save_json(self.users_file, self._users)
+
+    def set_user_favorites(self, username, favs):
+        rec = self._users.get(username)
+        if isinstance(rec, dict):
+            rec["favorites"] = list(favs)
+            self.save_user(username, rec)
+
+    # ---- 談話室 ----
+
+    def load_bbs_messages(self):
+        """全件を読む（SQLite への取り込み用。通常の表示では使わない）"""
+        if not os.path.exists(self.bbs_file):
+            return []
+        try:
+            with open(self.bbs_file, newline='', encoding='utf-8') as f:
+                reader = csv.DictReader(f)
+                out = []
+                for row in reader:
+                    out.append({
+                        'ts': row.get('ts', ''),
+                        'user': row.get('user', ''),
+                        'text': row.get('text', ''),
+                    })
+                return out
+        except Exception:
+            return []
+
+    @contextmanager
+    def _bbs_locked(self):
+        # 同じプロセス内はスレッドロック、ワーカ間は索引ファイルの flock で排他する
+        with self._bbs_lock:
+            fd = os.open(self.bbs_index_file, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                yield fd
+            finally:
+                os.close(fd)  # close で flock も外れる
+
+    def _sync_bbs_index(self, fd):
+        """CSV のうち索引に未登録の行を索引に追加し、件数を返す
+
+        索引の先頭8バイトは「索引済みの CSV のバイト数」、以降は各行の開始位置（u64）。
+        """
+        try:
+            csv_size = os.path.getsize(self.bbs_file)
+        except OSError:
+            csv_size = 0
+        idx_size = os.fstat(fd).st_size
+        covered = _U64.unpack(_pread(fd, 8, 0))[0] if idx_size >= 8 else 0
+        if idx_size < 8 or csv_size < covered:
+            # 索引が無い・CSV が差し替えられた：最初から作り直す
+            os.ftruncate(fd, 0)
+            _pwrite(fd, _U64.pack(0), 0)
+            covered, idx_size = 0, 8
+        if csv_size > covered:
+            offsets = []
+            with open(self.bbs_file, 'rb') as f:
+                f.seek(covered)
+                pos = covered
+                if pos == 0:
+                    pos += len(f.readline())  # 見出し行
+                start, quotes = pos, 0
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break  # 書き込み途中の行は次回に回す
+                    quotes += line.count(b'"')
+                    pos += len(line)
+                    # 引用符が閉じていれば1行分（本文中の改行は引用符の内側にある）
+                    if quotes % 2 == 0:
+                        offsets.append(start)
+                        start, quotes = pos, 0
+            if offsets:
+                _pwrite(fd, b''.join(_U64.pack(o) for o in offsets), idx_size)
+                idx_size += 8 * len(offsets)
+            _pwrite(fd, _U64.pack(start), 0)
+        return (idx_size - 8) // 8
+
+    def bbs_count(self):
+        with self._bbs_locked() as fd:
+            return self._sync_bbs_index(fd)
+
+    def bbs_page(self, page, per_page):
+        """新しい順に並べたときの page ページ目（1始まり）を新しい順で返す"""
+        with self._bbs_locked() as fd:
+            count = self._sync_bbs_index(fd)
+            end = count - (page - 1) * per_page
+            start = max(0, end - per_page)
+            if end <= 0:
+                return []
+            raw = _pread(fd, 8 * (end - start + 1), 8 + 8 * start)
+            offsets = [_U64.unpack_from(raw, i * 8)[0] for i in range(len(raw) // 8)]
+            if len(offsets) == end - start:
+                offsets.append(_U64.unpack(_pread(fd, 8, 0))[0])  # 最終行の終わり
+        with open(self.bbs_file, 'rb') as f:
+            f.seek(offsets[0])
+            data = f.read(offsets[-1] - offsets[0])
+        return list(reversed(_csv_rows(data)))
+
+    def recent_bbs_messages(self, n):
+        """最新 n 件を古い順で返す"""
+        return list(reversed(self.bbs_page(1, n)))
+
+    def append_bbs_message(self, msg):
+        with self._bbs_locked() as fd:
+            file_exists = os.path.exists(self.bbs_file)
+            with open(self.bbs_file, 'a', newline='', encoding='utf-8') as f:
+                writer = csv.DictWriter(f, fieldnames=BBS_FIELDS)
+                if not file_exists:
+                    writer.writeheader()
+                writer.writerow(msg)
+            self._sync_bbs_index(fd)
+
+    # ---- カウンタ ----
+
+    def load_legacy_counters(self):
+        """旧形式（visitor_count.json / search_counts.json）の内容。イベントログが無い初回だけ使う"""
+        search_data = load_json(self.search_file, {})
+        counts = search_data.get('counts', {}) if isinstance(search_data.get('counts', {}), dict) else {}
+        return {
+            'visitor': int(load_json(self.visitor_file, {}).get('count', 0) or 0),
+            # 週ごとの検索回数は、最初の時間の切り替えでその週の最後の1時間の分として保存される
+            'hour': week_last_hour(search_data.get('week_id')),
+            'search': {k: int(v) for k, v in counts.items() if isinstance(k, str)},
+        }
+
+    def counter_store(self):
+        return CounterLog(self.counter_dir, seed=self.load_legacy_counters())
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username   TEXT PRIMARY KEY,
+    pw_hash    TEXT NOT NULL,
+    created_at TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS favorites (
+    username   TEXT NOT NULL REFERENCES users(username) ON DELETE CASCADE,
+    species_id TEXT NOT NULL,
+    pos        INTEGER NOT NULL,
+    PRIMARY KEY (username, species_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS favorites_by_species ON favorites(species_id);
+CREATE TABLE IF NOT EXISTS bbs_messages (
+    id   INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts   TEXT NOT NULL,
+    user TEXT NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS bbs_messages_by_user ON bbs_messages(user);
+CREATE TABLE IF NOT EXISTS counter_events (
+    id    INTEGER PRIMARY KEY,
+    ts    INTEGER NOT NULL,
+    kind  TEXT NOT NULL,
+    key   TEXT NOT NULL,
+    delta INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS counter_events_by_kind ON counter_events(kind, ts);
+CREATE TABLE IF NOT EXISTS counters (
+    name  TEXT NOT NULL,
+    key   TEXT NOT NULL,
+    value INTEGER NOT NULL,
+    PRIMARY KEY (name, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+) WITHOUT ROWID;
+"""
+
+# よく使う文はここにまとめ、sqlite3 の文キャッシュ（cached_statements）で再利用させる
+SQL_UPSERT_USER = (
+    "INSERT INTO users (username, pw_hash, created_at) VALUES (?, ?, ?) "
+    "ON CONFLICT(username) DO UPDATE SET pw_hash = excluded.pw_hash, created_at = excluded.created_at"
+)
+SQL_DELETE_FAVORITES = "DELETE FROM favorites WHERE username = ?"
+SQL_INSERT_FAVORITE = "INSERT OR IGNORE INTO favorites (username, species_id, pos) VALUES (?, ?, ?)"
+SQL_INSERT_BBS = "INSERT INTO bbs_messages (ts, user, text) VALUES (?, ?, ?)"
+SQL_INSERT_EVENT = "INSERT INTO counter_events (ts, kind, key, delta) VALUES (?, ?, ?, ?)"
+SQL_ADD_COUNTER = (
+    "INSERT INTO counters (name, key, value) VALUES (?, ?, ?) "
+    "ON CONFLICT(name, key) DO UPDATE SET value = value + excluded.value"
+)
+SQL_SET_META = "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)"
+# 談話室の投稿数は COUNT(*)（表全体を数える）を避け、投稿と同じトランザクションで meta に数えておく
+SQL_INIT_BBS_COUNT = "INSERT OR IGNORE INTO meta (key, value) SELECT 'bbs_count', COUNT(*) FROM bbs_messages"
+SQL_INCR_BBS_COUNT = "UPDATE meta SET value = value + ? WHERE key = 'bbs_count'"
+# 投稿は削除しないので id は連番。ページは新しい方からの id の範囲で引く（OFFSET で読み飛ばさない）
+SQL_BBS_PAGE = (
+    "SELECT ts, user, text FROM bbs_messages "
+    "WHERE id <= (SELECT MAX(id) FROM bbs_messages) - ? ORDER BY id DESC LIMIT ?"
+)
+
+# 他のワーカが data/ のファイルを取り込み終えるのを待つ時間（ミリ秒）
+MIGRATE_TIMEOUT_MS = 600000
+
+
+class SQLiteStorage:
+    """SQLite（WAL モード）に保存する。接続はスレッドごとに1本を使い回す"""
+
+    name = "sqlite"
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+            conn.execute(SQL_INIT_BBS_COUNT)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10.0, cached_statements=256)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def get_meta(self, key, default=None):
+        row = self._conn().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    # ---- ユーザー・お気に入り ----
+
+    def load_users(self):
+        conn = self._conn()
+        users = {}
+        for username, pw_hash, created_at in conn.execute(
+            "SELECT username, pw_hash, created_at FROM users"
+        ):
+            users[username] = {"pw_hash": pw_hash, "created_at": created_at, "favorites": []}
+        for username, species_id in conn.execute(
+            "SELECT username, species_id FROM favorites ORDER BY username, pos"
+        ):
+            if username in users:
+                users[username]["favorites"].append(species_id)
+        return users
+
+    def save_user(self, username, rec):
+        with self._conn() as conn:
+            conn.execute(SQL_UPSERT_USER, (username, rec.get("pw_hash", ""), rec.get("created_at", "")))
+            self._replace_favorites(conn, username, rec.get("favorites", []))
+
+    def set_user_favorites(self, username, favs):
+        # 変更のあったユーザーの行だけを書き換える
+        with self._conn() as conn:
+            self._replace_favorites(conn, username, favs)
+
+    @staticmethod
+    def _replace_favorites(conn, username, favs):
+        conn.execute(SQL_DELETE_FAVORITES, (username,))
+        conn.executemany(SQL_INSERT_FAVORITE, [(username, sid, i) for i, sid in enumerate(favs)])
+
+    # ---- 談話室 ----
+
+    def bbs_count(self):
+        return int(self.get_meta("bbs_count", 0))
+
+    def bbs_page(self, page, per_page):
+        rows = self._conn().execute(SQL_BBS_PAGE, ((page - 1) * per_page, per_page))
+        return [{"ts": ts, "user": user, "text": text} for ts, user, text in rows]
+
+    def recent_bbs_messages(self, n):
+        return list(reversed(self.bbs_page(1, n)))
+
+    def append_bbs_message(self, msg):
+        with self._conn() as conn:
+            conn.execute(SQL_INSERT_BBS, (msg.get("ts", ""), msg.get("user", ""), msg.get("text", "")))
+            conn.execute(SQL_INCR_BBS_COUNT, (1,))
+
+    # ---- カウンタ ----
+
+    def load_counters(self):
+        state = empty_state()
+        for name, key, value in self._conn().execute("SELECT name, key, value FROM counters"):
+            if name == "visitor":
+                state["visitor"] = value
+            elif name == "search":
+                state["search"][key] = value
+        hour = self.get_meta("hour")
+        # 週ごとに数えていた頃のデータベースなら、その週の最後の1時間とする
+        state["hour"] = int(hour) if hour else week_last_hour(self.get_meta("week_id"))
+        return state
+
+    def write_counter_events(self, events):
+        """(時刻, 種類, キー, 増分) のイベントを記録し、集計表にも反映する（1トランザクション）"""
+        with self._conn() as conn:
+            conn.executemany(SQL_INSERT_EVENT, events)
+            for _, kind, key, delta in events:
+                if kind == counter_log.VISIT:
+                    conn.execute(SQL_ADD_COUNTER, ("visitor", "", delta))
+                elif kind == counter_log.SEARCH:
+                    conn.execute(SQL_ADD_COUNTER, ("search", key, delta))
+                elif kind == counter_log.HOUR:
+                    conn.execute("DELETE FROM counters WHERE name = 'search'")
+                    conn.execute(SQL_SET_META, ("hour", key))
+
+    def counter_store(self):
+        return SQLiteCounterStore(self)
+
+    # ---- data/ のファイルからの取り込み ----
+
+    def migrate_from(self, files):
+        """FileStorage の内容を取り込む（一度だけ。取り込み済みなら何もしない）
+
+        複数のワーカが同時に起動しても取り込むのが1回だけになるよう、取り込み済みかの確認から
+        取り込みまでを1つの書き込みトランザクション（BEGIN IMMEDIATE）で行う。
+        後から来たワーカは、先のワーカの取り込みが終わるまで待ってから確認し直す。
+        """
+        if self.get_meta("migrated_from_files"):
+            return False
+        conn = self._conn()
+        # 大きなデータの取り込みは数秒で終わらないので、この間だけ長めに待つ
+        conn.execute(f"PRAGMA busy_timeout = {MIGRATE_TIMEOUT_MS}")
+        try:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                if self.get_meta("migrated_from_files"):
+                    return False
+                self._import_files(conn, files)
+        finally:
+            conn.execute("PRAGMA busy_timeout = 10000")
+        return True
+
+    def _import_files(self, conn, files):
+        """migrate_from のトランザクションの中で呼ぶ"""
+        users = files.load_users()
+        messages = files.load_bbs_messages()
+        counters = files.counter_store().state()
+        for username, rec in users.items():
+            if not isinstance(rec, dict):
+                continue
+            conn.execute(SQL_UPSERT_USER, (username, rec.get("pw_hash", ""), rec.get("created_at", "")))
+            favs = rec.get("favorites", [])
+            self._replace_favorites(conn, username, [x for x in favs if isinstance(x, str)])
+        conn.executemany(SQL_INSERT_BBS, [(m["ts"], m["user"], m["text"]) for m in messages])
+        conn.execute(SQL_INCR_BBS_COUNT, (len(messages),))
+        conn.execute("DELETE FROM counters")
+        conn.execute(SQL_ADD_COUNTER, ("visitor", "", counters["visitor"]))
+        conn.executemany(SQL_ADD_COUNTER, [("search", k, v) for k, v in counters["search"].items()])
+        if counters["hour"] is not None:
+            conn.execute(SQL_SET_META, ("hour", str(counters["hour"])))
+        conn.execute(SQL_SET_META, ("migrated_from_files", time.strftime("%Y-%m-%d %H:%M:%S")))
+
+
+class SQLiteCounterStore:
+    """CounterLog と同じ使い方で、カウンタを SQLite に保存する"""
+
+    def __init__(self, db):
+        self._db = db
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._state = db.load_counters()
+
+    def state(self):
+        with self._lock:
+            return {
+                "visitor": self._state["visitor"],
+                "hour": self._state["hour"],
+                "search": dict(self._state["search"]),
+            }
+
+    def record(self, kind, key="", delta=1):
+        with self._lock:
+            apply_event(self._state, kind, key, delta)
+            self._buffer.append((int(time.time()), kind, key, delta))
+
+    @property
+    def pending(self):
+        return len(self._buffer)
+
+    def flush(self):
+        with self._lock:
+            events, self._buffer = self._buffer, []
+        if events:
+            self._db.write_counter_events(events)
+
+    def history(self, kind=None):
+        sql = "SELECT ts, kind, key, delta FROM counter_events"
+        params = ()
+        if kind is not None:
+            sql += " WHERE kind = ?"
+            params = (kind,)
+        yield from self._db._conn().execute(sql + " ORDER BY id", params)
+
+
+def open_storage(backend, data_dir):
+    """設定された保存先を開く。sqlite の場合、初回は data/ のファイルから取り込む"""
+    files = FileStorage(data_dir)
+    if backend == "sqlite":
+        db = SQLiteStorage(os.path.join(data_dir, "cetacean.sqlite3"))
+        db.migrate_from(files)
+        return db
+    if backend not in ("", "file"):
+        raise ValueError(f"未対応の保存先です：{backend}")
+    return files
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["migrate"]:
+        print("usage: python storage.py migrate")
+        sys.exit(2)
+    data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+    db = SQLiteStorage(os.path.join(data_dir, "cetacean.sqlite3"))
+    if db.migrate_from(FileStorage(data_dir)):
+        print("data/ のファイルを取り込みました。")
+    else:
+        print("取り込み済みです。")